@@ -0,0 +1,126 @@
+# accumulators.py
+
+# Mergeable accumulators for descriptive statistics. Each one is fed chunks of
+# rows with update() and combined with merge(), so statistics can be collected
+# chunk by chunk (data that does not fit in memory) or shard by shard (in
+# parallel) and merged at the end. Merging in the order of the rows gives the
+# same result as one pass over all rows.
+#
+# Keys are grouped with observed=True, so only key combinations present in the
+# data appear in the results.
+
+import numpy as np
+import pandas as pd
+
+class MomentAccumulator:
+    """
+    Count, mean and variance of `value` per group of `keys`, merged with the
+    parallel form of Welford's algorithm (Chan et al.), so no values are kept.
+    Groups whose values are all missing are kept with count 0.
+    """
+    def __init__(self, keys, value):
+        self.keys = list(keys)
+        self.value = value
+        self.moments = None # DataFrame of n, mean, m2 (sum of squared deviations) per group
+
+    def update(self, chunk):
+        values = pd.to_numeric(chunk[self.value], errors='coerce')
+        grouped = values.groupby([chunk[key] for key in self.keys], observed=True)
+        n = grouped.count()
+        moments = pd.DataFrame({'n': n, 'mean': grouped.mean().fillna(0.0), 'm2': grouped.var(ddof=0).fillna(0.0) * n})
+        return self._combine(moments)
+
+    def merge(self, other):
+        return self._combine(other.moments) if other.moments is not None else self
+
+    def _combine(self, moments):
+        if self.moments is None:
+            self.moments = moments
+            return self
+        a, b = self.moments.align(moments, join='outer', fill_value=0)
+        n = a['n'] + b['n']
+        delta = b['mean'] - a['mean']
+        weight_b = (b['n'] / n.where(n > 0, 1))
+        self.moments = pd.DataFrame({'n': n, 'mean': a['mean'] + delta * weight_b,
+                                     'm2': a['m2'] + b['m2'] + delta ** 2 * a['n'] * weight_b})
+        return self
+
+    def result(self):
+        """DataFrame of the count, mean and sample standard deviation (ddof=1) per group."""
+        n = self.moments['n']
+        return pd.DataFrame({'count': n.astype(int),
+                             'mean': self.moments['mean'].where(n > 0),
+                             'std': np.sqrt(self.moments['m2'] / (n - 1).where(n > 1))})
+
+class CountAccumulator:
+    """
+    Row counts per combination of `keys` (missing key values are not counted),
+    e.g. a histogram of exact response values per source. With `bins` (edges for
+    the last key), the last key is counted per bin instead of per value.
+    """
+    def __init__(self, keys, bins=None):
+        self.keys = list(keys)
+        self.bins = bins
+        self.counts = None
+
+    def update(self, chunk):
+        columns = [chunk[key] for key in self.keys]
+        if self.bins is not None:
+            columns[-1] = pd.cut(pd.to_numeric(columns[-1], errors='coerce'), self.bins, include_lowest=True)
+        counts = pd.Series(1, index=chunk.index).groupby(columns, observed=True).count()
+        return self._combine(counts)
+
+    def merge(self, other):
+        return self._combine(other.counts) if other.counts is not None else self
+
+    def _combine(self, counts):
+        self.counts = counts if self.counts is None else self.counts.add(counts, fill_value=0).astype(int)
+        return self
+
+    def result(self):
+        return self.counts.sort_index()
+
+class DistinctAccumulator:
+    """Number of distinct `value`s per group of `keys`, e.g. participants per length group."""
+    def __init__(self, keys, value):
+        self.keys = list(keys)
+        self.value = value
+        self.pairs = None # the distinct (keys..., value) combinations seen
+
+    def update(self, chunk):
+        pairs = chunk[self.keys + [self.value]].dropna().drop_duplicates()
+        return self._combine(pairs)
+
+    def merge(self, other):
+        return self._combine(other.pairs) if other.pairs is not None else self
+
+    def _combine(self, pairs):
+        self.pairs = pairs if self.pairs is None else pd.concat([self.pairs, pairs], ignore_index=True).drop_duplicates()
+        return self
+
+    def result(self):
+        return self.pairs.groupby(self.keys, observed=True)[self.value].nunique()
+
+class FirstValueAccumulator:
+    """
+    The first non-missing value of each of `columns` per `key`, as groupby(key).first()
+    gives it, e.g. the age and device of each participant. Chunks must be merged
+    in row order for "first" to mean the first row.
+    """
+    def __init__(self, key, columns):
+        self.key = key
+        self.columns = list(columns)
+        self.values = None
+
+    def update(self, chunk):
+        return self._combine(chunk.groupby(self.key, observed=True)[self.columns].first())
+
+    def merge(self, other):
+        return self._combine(other.values) if other.values is not None else self
+
+    def _combine(self, values):
+        self.values = values if self.values is None else self.values.combine_first(values)
+        return self
+
+    def result(self):
+        return self.values.sort_index()
@@ -1,33 +1,55 @@
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import pingouin as pg
+from .completeness import CompletenessIndex
+from .partitions import question_rows, full_frame
+from .mixed_anova import mixed_anova_tables
+from .resampling import resampling_inference
+from .reporting import print_table
 
-def perform_mixed_anova(df, dv):
-    """Performs a mixed ANOVA for a given dependent variable."""
+def perform_mixed_anova(df, dv, completeness=None, exclude_incomplete=False, aov_table=None):
+    """
+    Performs a mixed ANOVA for a given dependent variable, reading its rows
+    from `df`, the experiment DataFrame or its QuestionPartitions. A table
+    already computed by mixed_anova.mixed_anova_tables can be passed as
+    `aov_table`, in which case pingouin is not called.
+
+    Participants missing 'source' data for the DV are looked up in `completeness`
+    (a CompletenessIndex of df, built here if not given) and reported, or dropped
+    beforehand with exclude_incomplete=True.
+    """
     print(f"\n--- Mixed ANOVA for {dv}---")
-    df_dv = df[df['question'] == dv].copy()
+    df_dv = question_rows(df, dv)
 
     if df_dv.empty:
         print(f"No data found for dependent variable: {dv}. Skipping ANOVA.")
         return None, None
 
-    df_dv = df_dv.rename(columns={'response_value': dv})
-    df_dv['source'] = df_dv['source'].astype('category')
-    df_dv['length'] = df_dv['length'].astype('category')
-    df_dv['participant_id'] = df_dv['participant_id'].astype('category')
-
-    participant_source_counts = df_dv.groupby(['participant_id', 'source']).size().reset_index(name='count')
-    participants_with_missing_sources = participant_source_counts.groupby('participant_id').filter(lambda x: len(x) < df_dv['source'].cat.categories.size)['participant_id'].unique()
-
+    if completeness is None:
+        completeness = CompletenessIndex(full_frame(df))
+    participants_with_missing_sources = completeness.incomplete_participants(dv)
     if len(participants_with_missing_sources) > 0:
         print(f"Warning: Participants missing 'source' data for '{dv}': {list(participants_with_missing_sources)}")
+        if exclude_incomplete:
+            df_dv = df_dv[completeness.mask(df_dv, dv)]
+            print(f"Excluded {len(participants_with_missing_sources)} participant(s) with missing 'source' data from the ANOVA for '{dv}'.")
+
+    # rename copies the rows, which are modified below
+    df_dv = df_dv.rename(columns={'response_value': dv})
+    # Categoricals come from the shared schema, only keep the levels present for this DV
+    for col in ['source', 'length', 'participant_id']:
+        df_dv[col] = df_dv[col].cat.remove_unused_categories()
 
     try:
-        aov = pg.mixed_anova(data=df_dv,
-                             dv=dv,
-                             within='source',
-                             between='length',
-                             subject='participant_id')
-        print(aov.to_markdown(index=False, numalign="left", stralign="left"))
+        aov = aov_table if aov_table is not None else pg.mixed_anova(data=df_dv,
+                                                                   dv=dv,
+                                                                   within='source',
+                                                                   between='length',
+                                                                   subject='participant_code')
+        print_table(aov, index=False)
         return aov, df_dv
     except Exception as e:
         print(f"Error performing mixed ANOVA for {dv}: {e}")
@@ -37,9 +59,9 @@ def perform_mixed_anova(df, dv):
         return None, None
 
 def perform_anova_posthoc(aov_table, df, dv):
-    """Performs post-hoc tests based on significant ANOVA results."""
+    """Performs post-hoc tests based on significant ANOVA results. Returns the post-hoc table, or None if none were run."""
     if aov_table is None:
-        return
+        return None
 
     alpha = 0.1
     source_p_unc = aov_table.loc[aov_table['Source'] == 'source', 'p-unc'].iloc[0] if 'source' in aov_table['Source'].values else 1.0
@@ -49,13 +71,131 @@ def perform_anova_posthoc(aov_table, df, dv):
     if interaction_p_unc < alpha:
         print(f"\n--- Post-hoc tests for significant Interaction effect for {dv} ---")
         pg_posthoc = pg.pairwise_ttests(data=df, dv=dv, within='source', between='length',
-                                         subject='participant_id', padjust='bonf')
-        print(pg_posthoc.to_markdown(index=False, numalign="left", stralign="left"))
+                                         subject='participant_code', padjust='bonf')
+        print_table(pg_posthoc, index=False)
     elif source_p_unc < alpha:
         print(f"\n--- Post-hoc tests for significant Source main effect for {dv} ---")
-        pg_posthoc = pg.pairwise_ttests(data=df, dv=dv, within='source', subject='participant_id', padjust='bonf')
-        print(pg_posthoc.to_markdown(index=False, numalign="left", stralign="left"))
+        pg_posthoc = pg.pairwise_ttests(data=df, dv=dv, within='source', subject='participant_code', padjust='bonf')
+        print_table(pg_posthoc, index=False)
     elif length_p_unc < alpha:
         print(f"\nSignificant main effect of Length for {dv}. No post-hoc needed for 2 levels.")
+        return None
     else:
-        print(f"\nNo significant main effects or interaction for {dv}. No post-hoc tests performed.")
\ No newline at end of file
+        print(f"\nNo significant main effects or interaction for {dv}. No post-hoc tests performed.")
+        return None
+    return pg_posthoc
+
+def perform_resampling_inference(df, dv, n_resamples=5000, seed=0, n_jobs=1):
+    """
+    Prints permutation p-values of the ANOVA effects and of the pairwise source
+    comparisons, and cluster bootstrap confidence intervals (see resampling.py),
+    for the ANOVA data of a DV as returned by perform_mixed_anova.
+    """
+    print(f"\n--- Resampling inference for {dv} ({n_resamples} resamples, seed {seed}) ---")
+    try:
+        effects, contrasts, cell_means = resampling_inference(df, dv, n_resamples=n_resamples, seed=seed, n_jobs=n_jobs)
+    except Exception as e:
+        print(f"Error performing resampling inference for {dv}: {e}")
+        return None
+    print("Permutation p-values of the ANOVA effects:")
+    print_table(effects, index=False)
+    print("\nPairwise source comparisons (sign-flip permutation p-values, cluster bootstrap CIs):")
+    print_table(contrasts, index=False)
+    print("\nLength x Source means (cluster bootstrap CIs):")
+    print_table(cell_means, index=False)
+    return {'effects': effects, 'contrasts': contrasts, 'cell_means': cell_means}
+
+def _anova_for_dv(args):
+    """
+    Runs the mixed ANOVA and post-hoc tests for one DV, capturing what they print.
+    Returns the DV, the ANOVA table, the ANOVA data, the post-hoc table and the printed report.
+    """
+    df, dv, completeness, exclude_incomplete, precomputed_table = args
+    report = io.StringIO()
+    posthoc = None
+    with contextlib.redirect_stdout(report):
+        aov_table, df_anova = perform_mixed_anova(df, dv, completeness, exclude_incomplete, aov_table=precomputed_table)
+        if aov_table is not None and df_anova is not None:
+            posthoc = perform_anova_posthoc(aov_table, df_anova, dv)
+        else:
+            print(f"WARNING: ANOVA tables for {dv} are none.")
+    return dv, aov_table, df_anova, posthoc, report.getvalue()
+
+def _batched_tables(rows, dependent_vars):
+    """
+    mixed_anova_tables of all DVs at once. If the batch fails (e.g. a subject in
+    both between groups of one DV), each DV is computed on its own and the DVs
+    that still fail are left out, so perform_mixed_anova runs pingouin for them.
+    """
+    try:
+        return mixed_anova_tables(rows, dependent_vars)
+    except Exception as e:
+        print(f"Batched ANOVA failed ({e}), computing the DVs one at a time.")
+    tables = {}
+    for dv in dependent_vars:
+        try:
+            tables.update(mixed_anova_tables(rows, [dv]))
+        except Exception as e:
+            print(f"Batched ANOVA failed for {dv} ({e}), using pingouin.")
+    return tables
+
+def perform_anovas(df, dependent_vars, completeness=None, exclude_incomplete=False, n_jobs=1, engine='pingouin',
+                   n_resamples=0, seed=0):
+    """
+    Performs the mixed ANOVA and post-hoc tests for each DV in `dependent_vars`,
+    from `df`, the experiment DataFrame or its QuestionPartitions. Participants
+    missing 'source' data for a DV (per `completeness`) are reported, or left out
+    of its ANOVA with exclude_incomplete=True.
+
+    The DVs are independent, so with n_jobs other than 1 they run on a pool of
+    processes (n_jobs=None uses all cores), each given only its DV's rows. Each
+    DV's report is captured and printed in the order of `dependent_vars`, so the
+    output is the same as running them one after another.
+
+    With engine='batched' the ANOVA tables of all DVs are computed at once by
+    mixed_anova.mixed_anova_tables (same results as pingouin, checked by
+    tests/test_mixed_anova.py); the post-hoc tests still use pingouin. DVs the
+    batch cannot compute (see _batched_tables) fall back to pingouin.
+
+    With n_resamples > 0, each DV's report is followed by resampling-based
+    p-values and confidence intervals from that many permutations and bootstrap
+    resamples (reproducible through `seed`, spread over n_jobs processes).
+
+    Returns:
+        dict of DV -> {'table': ANOVA table, 'data': ANOVA data, 'posthoc': post-hoc table}
+        (None if the ANOVA failed or no post-hoc tests were run), plus 'resampling'
+        results with n_resamples > 0
+    """
+    if completeness is None:
+        completeness = CompletenessIndex(full_frame(df))
+    if engine == 'batched':
+        rows = full_frame(df)
+        if exclude_incomplete:
+            # The same exclusions as perform_mixed_anova applies to each DV's rows
+            rows = rows[completeness.mask(rows)]
+        tables = _batched_tables(rows, dependent_vars)
+    elif engine == 'pingouin':
+        tables = {}
+    else:
+        raise ValueError(f"Unknown ANOVA engine: {engine} (expected 'pingouin' or 'batched')")
+    tasks = [(question_rows(df, dv), dv, completeness, exclude_incomplete, tables.get(dv)) for dv in dependent_vars]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        results = map(_anova_for_dv, tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks)))
+        results = executor.map(_anova_for_dv, tasks)
+
+    anova_results = {}
+    try:
+        # map yields the results in the order of the DVs, so reports are printed in a fixed order
+        for dv, aov_table, df_anova, posthoc, report in results:
+            print(report, end='')
+            anova_results[dv] = {'table': aov_table, 'data': df_anova, 'posthoc': posthoc}
+            if n_resamples > 0 and df_anova is not None:
+                anova_results[dv]['resampling'] = perform_resampling_inference(df_anova, dv, n_resamples, seed, n_jobs)
+    finally:
+        if n_jobs != 1:
+            executor.shutdown()
+    return anova_results
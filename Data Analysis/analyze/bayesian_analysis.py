@@ -1,21 +1,52 @@
 import pandas as pd
-from statsmodels.genmod.bayes_mixed_glm import BinomialBayesMixedGLM
-import numpy as np
 from scipy.stats import norm # Import for calculating intervals
-
-def analyze_accuracy_bayesian(df):
-    """Performs Bayesian mixed-effects logistic regression for accuracy."""
+from .partitions import question_rows
+from .bayesian_fitting import fit_bayesian_glmm, fit_bayesian_glmms
+from .bayesian_diagnostics import BayesianDiagnostics
+from .reporting import print_object, print_table
+
+def fixed_effects_table(fit, level=0.95):
+    """Posterior mean, sd and approximate credible interval (mean +/- z * sd) of each fixed effect of a fit."""
+    z_score = norm.ppf(1 - (1 - level) / 2)
+    return pd.DataFrame({
+        'mean': fit.fe_mean,
+        'sd': fit.fe_sd,
+        f'{level:.0%} CI Lower': fit.fe_mean - z_score * fit.fe_sd,
+        f'{level:.0%} CI Upper': fit.fe_mean + z_score * fit.fe_sd
+    }, index=fit.model.exog_names)
+
+def analyze_accuracy_bayesian(df, completeness=None, exclude_incomplete=False, cache=None, print_diagnostics=True):
+    """
+    Performs Bayesian mixed-effects logistic regression for accuracy, on the accuracy
+    rows of `df`, the experiment DataFrame or its QuestionPartitions.
+    Participants missing 'source' data for accuracy (per the CompletenessIndex
+    `completeness`, if given) are reported, or dropped with exclude_incomplete=True.
+    With a BayesianFitCache as `cache`, the fit is warm started and cached (see bayesian_fitting.py).
+
+    Returns:
+        The BayesianDiagnostics of the pre-fit checks (printed if print_diagnostics)
+        and the fit results, each None if the model could not be set up or fitted.
+    """
     print("\n--- Bayesian Mixed-Effects Logistic Regression for Accuracy ---")
-    df_accuracy = df[df['question'] == 'accuracy'].copy()
+    df_accuracy = question_rows(df, 'accuracy')
 
     if df_accuracy.empty:
         print("No accuracy data found. Skipping Bayesian model.")
-        return
+        return None, None
 
-    print("--- Initial Data Info ---")
-    print(df_accuracy.info())
-    print(df_accuracy.head())
+    if completeness is not None and completeness.incomplete_participants('accuracy'):
+        incomplete = completeness.incomplete_participants('accuracy')
+        print(f"Warning: Participants missing 'source' data for 'accuracy': {incomplete}")
+        if exclude_incomplete:
+            df_accuracy = df_accuracy[completeness.mask(df_accuracy, 'accuracy')]
+            print(f"Excluded {len(incomplete)} participant(s) with missing 'source' data from the Bayesian model.")
 
+    if print_diagnostics:
+        print("--- Initial Data Info ---")
+        print(df_accuracy.info())
+        print(df_accuracy.head())
+
+    # rename copies the rows, which are modified below
     df_accuracy = df_accuracy.rename(columns={'response_value': 'accuracy'})
     # Ensure accuracy is binary (0 or 1)
     df_accuracy['accuracy'] = pd.to_numeric(df_accuracy['accuracy'], errors='coerce')
@@ -23,14 +54,13 @@ def analyze_accuracy_bayesian(df):
          print("\nError: 'accuracy' column contains values other than 0 or 1 after conversion.")
          print("Unique values in accuracy:", df_accuracy['accuracy'].dropna().unique())
          print("Skipping Bayesian model due to invalid accuracy values.")
-         return
+         return None, None
 
     df_accuracy['accuracy'] = df_accuracy['accuracy'].astype(int)
 
-    # Convert to category *after* checking values if needed
-    df_accuracy['length'] = df_accuracy['length'].astype('category')
-    df_accuracy['source'] = df_accuracy['source'].astype('category')
-    df_accuracy['participant_id'] = df_accuracy['participant_id'].astype('category')
+    # Categoricals come from the shared schema, only keep the levels present in the accuracy data
+    for col in ['length', 'source', 'participant_id']:
+        df_accuracy[col] = df_accuracy[col].cat.remove_unused_categories()
 
     # Drop NaNs *after* conversions and initial checks
     initial_rows = len(df_accuracy)
@@ -40,52 +70,9 @@ def analyze_accuracy_bayesian(df):
 
 
     print("\n--- Data Checks Before Model Fitting ---")
-
-    # Check unique values of categorical variables
-    print("\nUnique 'length' categories:", df_accuracy['length'].cat.categories.tolist())
-    print("Unique 'source' categories:", df_accuracy['source'].cat.categories.tolist())
-    print("Unique 'participant_id' categories:", df_accuracy['participant_id'].cat.categories.tolist())
-
-    # Check distribution of the outcome variable
-    print("\nDistribution of 'accuracy':")
-    print(df_accuracy['accuracy'].value_counts())
-    print(df_accuracy['accuracy'].value_counts(normalize=True))
-
-    # Check data points per participant
-    print("\nObservations per participant:")
-    participant_counts = df_accuracy['participant_id'].value_counts()
-    print(participant_counts.describe())
-    print(participant_counts.head())
-    if (participant_counts < 2).any():
-          print("\nWarning: Some participants have very few observations (< 2). This can cause issues.")
-
-    # Check data distribution across fixed effects (Length x Source)
-    print("\nObservations per Length x Source group:")
-    cross_tab_fixed = pd.crosstab(df_accuracy['length'], df_accuracy['source'])
-    print(cross_tab_fixed)
-    if (cross_tab_fixed < 5).any().any():
-          print("\nWarning: Some Length x Source groups have very few observations (< 5).")
-
-    # Check distribution of accuracy (proportion correct) across fixed effects groups
-    print("\nProportion of Correct Responses (accuracy=1) per Length x Source group:")
-    accuracy_by_group = df_accuracy.groupby(['length', 'source'])['accuracy'].agg(['count', 'mean', 'sum'])
-    print(accuracy_by_group)
-    # Check for potential perfect separation (all 0s or all 1s in a group)
-    if (accuracy_by_group['mean'] == 0).any() or (accuracy_by_group['mean'] == 1).any():
-        print("\nWarning: Potential perfect separation detected. Some Length x Source groups have 0% or 100% accuracy.")
-        print("This can cause model fitting issues.")
-
-    # Check data distribution including random effects (Participant x Length x Source)
-    print("\nObservations per Participant x Length x Source combination:")
-    participant_group_counts = df_accuracy.groupby(['participant_id', 'length', 'source']).size().unstack(fill_value=0)
-    print(participant_group_counts.head())
-    print("\nSummary of observations per Participant x Length x Source combination:")
-    print(participant_group_counts.stack().describe())
-
-    if (participant_group_counts == 0).values.any():
-        print("\nWarning: Some Participant x Length x Source combinations have 0 observations.")
-        print("Example participants with missing combinations:\n", participant_group_counts[participant_group_counts.eq(0).any(axis=1)].head())
-
+    diagnostics = BayesianDiagnostics(df_accuracy, 'accuracy')
+    if print_diagnostics:
+        diagnostics.report()
 
     fixed_effects_formula = "accuracy ~ C(length) * C(source)"
     random_effects_formulas = {'participant': '0 + C(participant_id)'}
@@ -93,37 +80,17 @@ def analyze_accuracy_bayesian(df):
 
     print("\n--- Attempting Bayesian Model Fitting ---")
     try:
-        mixed_model = BinomialBayesMixedGLM.from_formula(
-            formula=fixed_effects_formula,
-            vc_formulas=random_effects_formulas,
-            data=df_accuracy
-        )
-        mixed_model_fit = mixed_model.fit_vb()
-        print(mixed_model_fit.summary())
+        mixed_model_fit, from_cache = fit_bayesian_glmm(df_accuracy, fixed_effects_formula, random_effects_formulas, cache)
+        if from_cache:
+            print("(Posterior loaded from the fit cache, the data and model are unchanged since it was fitted.)")
+        print_object(mixed_model_fit.summary())
 
         # print("\n--- Approximate 95% Credible Intervals for Fixed Effects (Log-Odds) ---") # Old
 
-        # Get the posterior mean and standard deviation for fixed effects
-        fe_mean = mixed_model_fit.fe_mean
-        fe_sd = mixed_model_fit.fe_sd
-        fe_names = mixed_model_fit.model.exog_names # Get names for fixed effects
-
-        # Calculate approximate 95% CI using mean +/- 1.96*SD (for standard normal distribution)
-        # For a 95% CI, alpha = 0.05, so we need the Z-score for alpha/2 = 0.025
-        z_score_95 = norm.ppf(1 - 0.05/2) # This is approximately 1.96
-
-        fe_ci_lower = fe_mean - z_score_95 * fe_sd
-        fe_ci_upper = fe_mean + z_score_95 * fe_sd
-
-        # Create a DataFrame to display the results nicely
-        fixed_effects_ci_df = pd.DataFrame({
-            'mean': fe_mean,
-            'sd': fe_sd,
-            '95% CI Lower': fe_ci_lower,
-            '95% CI Upper': fe_ci_upper
-        }, index=fe_names)
-
-        print(fixed_effects_ci_df)
+        # Posterior mean and standard deviation of the fixed effects, with approximate
+        # 95% CIs using mean +/- 1.96*SD (for standard normal distribution)
+        fixed_effects_ci_df = fixed_effects_table(mixed_model_fit)
+        print_object(fixed_effects_ci_df)
 
 
         print("\n--- Interpretation Guidance (Bayesian Mixed-Effects Logistic Regression) ---")
@@ -174,10 +141,60 @@ def analyze_accuracy_bayesian(df):
     except ImportError as e:
         print(f"Import Error: {e}")
         print("Please ensure you have statsmodels installed (pip install statsmodels) and scipy (pip install scipy).")
+        return diagnostics, None
     except Exception as e:
         print(f"\nError during Bayesian model fitting: {e}")
         print("\nDebugging Info (after checks):")
         print(df_accuracy.info())
         print(df_accuracy.head())
         print("\nValue counts of accuracy:")
-        print(df_accuracy['accuracy'].value_counts())
\ No newline at end of file
+        print(diagnostics.outcome_counts)
+        return diagnostics, None
+
+    return diagnostics, mixed_model_fit
+
+def analyze_outcomes_bayesian(df, outcomes, strata_column=None, cache=None, bounds=None, completeness=None,
+                              exclude_incomplete=False):
+    """
+    Fits the accuracy model, outcome ~ C(length) * C(source) with a random intercept
+    per participant, for each binary or bounded outcome in `outcomes`, and per stratum
+    of `strata_column` (e.g. 'test_slug') if given. Fits with the same design warm
+    start from each other and are cached through `cache`.
+
+    Outcomes are rescaled to 0-1 with their (lower, upper) `bounds` (default: 0 and 1,
+    as the evaluated scores are). 0/1 outcomes get the logistic model, others the
+    fractional logit model (see bayesian_fitting.py). Outcomes with values outside
+    their bounds are skipped. With exclude_incomplete=True, participants missing
+    'source' data for an outcome (per the CompletenessIndex `completeness`) are left out.
+
+    Returns:
+        dict of (outcome, stratum) -> fit results (or the exception raised while fitting)
+    """
+    print("\n--- Bayesian Mixed-Effects Models per Outcome ---")
+    bounds = bounds or {}
+    specs = {}
+    for outcome in outcomes:
+        lower, upper = bounds.get(outcome, (0, 1))
+        df_outcome = question_rows(df, outcome).rename(columns={'response_value': 'outcome'})
+        if exclude_incomplete and completeness is not None and outcome in completeness.dvs:
+            df_outcome = df_outcome[completeness.mask(df_outcome, outcome)]
+        df_outcome['outcome'] = (pd.to_numeric(df_outcome['outcome'], errors='coerce') - lower) / (upper - lower)
+        if df_outcome.empty or not df_outcome['outcome'].between(0, 1).all():
+            print(f"Skipping {outcome}: no data, or values outside {lower}-{upper}.")
+            continue
+        strata = [(None, df_outcome)] if strata_column is None else df_outcome.groupby(strata_column, observed=True)
+        for stratum, df_stratum in strata:
+            # Only the levels (and participants) of this stratum, so its design has no empty columns
+            df_stratum = df_stratum.copy()
+            for col in ['length', 'source', 'participant_id']:
+                df_stratum[col] = df_stratum[col].cat.remove_unused_categories()
+            specs[(outcome, stratum)] = (df_stratum, "outcome ~ C(length) * C(source)", {'participant': '0 + C(participant_id)'})
+
+    results = fit_bayesian_glmms(specs, cache)
+    for (outcome, stratum), result in results.items():
+        print(f"\n{outcome}" + (f" ({strata_column} = {stratum})" if stratum is not None else "") + ":")
+        if isinstance(result, Exception):
+            print(f"Error during Bayesian model fitting: {result}")
+            continue
+        print_table(fixed_effects_table(result))
+    return results
@@ -0,0 +1,95 @@
+# bayesian_diagnostics.py
+import numpy as np
+import pandas as pd
+
+class BayesianDiagnostics:
+    """
+    Pre-fit checks of a binary outcome for the length x source model with a
+    random intercept per participant, all derived from one participant x length
+    x source x outcome count array built in a single pass over the rows.
+
+    Holds the counts (outcome, per participant, per length x source group) and
+    the flags the model is sensitive to: participants or groups with few
+    observations, groups with (quasi-)perfect separation, and missing cells.
+    Length is between-subject, so a missing cell is a source a participant has
+    no observations for within their own length group.
+    """
+    def __init__(self, df, outcome='accuracy', min_participant_obs=2, min_group_obs=5):
+        self.outcome = outcome
+        self.participants = df['participant_id'].cat.categories
+        self.lengths = df['length'].cat.categories
+        self.sources = df['source'].cat.categories
+        shape = (len(self.participants), len(self.lengths), len(self.sources), 2)
+
+        # The single pass: one flat code per row, counted with bincount
+        codes = np.ravel_multi_index((df['participant_id'].cat.codes.to_numpy(), df['length'].cat.codes.to_numpy(),
+                                      df['source'].cat.codes.to_numpy(), df[outcome].to_numpy().astype(int)), shape)
+        self.counts = np.bincount(codes, minlength=np.prod(shape)).reshape(shape)
+
+        self.n_obs = int(self.counts.sum())
+        self.outcome_counts = pd.Series(self.counts.sum(axis=(0, 1, 2)), index=[0, 1], name=outcome)
+        participant_counts = self.counts.sum(axis=(1, 2, 3))
+        self.participant_counts = pd.Series(participant_counts, index=self.participants, name='participant_id')[participant_counts > 0]
+
+        group_counts = self.counts.sum(axis=0) # length x source x outcome
+        index = pd.MultiIndex.from_product([self.lengths, self.sources], names=['length', 'source'])
+        self.groups = pd.DataFrame({'count': group_counts.sum(axis=2).ravel(), 'sum': group_counts[..., 1].ravel()}, index=index)
+        self.groups['mean'] = self.groups['sum'] / self.groups['count'].where(self.groups['count'] > 0)
+        self.groups = self.groups[['count', 'mean', 'sum']]
+
+        # Flags
+        self.few_obs_participants = self.participant_counts.index[self.participant_counts < min_participant_obs].tolist()
+        self.few_obs_groups = self.groups.index[self.groups['count'] < min_group_obs].tolist()
+        self.separated_groups = self.groups.index[self.groups['mean'].isin([0, 1])].tolist()
+
+        # Missing cells, within the length group(s) each participant was observed in
+        cell_counts = self.counts.sum(axis=3)
+        participant_lengths = cell_counts.sum(axis=2) > 0
+        self.mixed_length_participants = self.participants[participant_lengths.sum(axis=1) > 1].tolist()
+        self.missing_cells = [(self.participants[p], self.lengths[l], self.sources[s])
+                              for p, l, s in np.argwhere(participant_lengths[:, :, np.newaxis] & (cell_counts == 0))]
+
+    @property
+    def ok(self):
+        """Whether none of the checks raised a flag."""
+        return not (self.few_obs_participants or self.few_obs_groups or self.separated_groups
+                    or self.mixed_length_participants or self.missing_cells)
+
+    def group_table(self):
+        """Observations per length x source group (length rows, source columns)."""
+        return self.groups['count'].unstack('source')
+
+    def report(self, max_examples=5):
+        """Prints the counts and any flags."""
+        print("\nUnique 'length' categories:", self.lengths.tolist())
+        print("Unique 'source' categories:", self.sources.tolist())
+        print(f"Participants: {len(self.participant_counts)}, observations: {self.n_obs}")
+
+        print(f"\nDistribution of '{self.outcome}':")
+        print(pd.DataFrame({'count': self.outcome_counts, 'proportion': self.outcome_counts / max(self.n_obs, 1)}))
+
+        print("\nObservations per participant:")
+        print(self.participant_counts.describe())
+        if self.few_obs_participants:
+            print(f"\nWarning: {len(self.few_obs_participants)} participant(s) have very few observations. This can cause issues.")
+            print("Examples:", self.few_obs_participants[:max_examples])
+
+        print("\nObservations per Length x Source group:")
+        print(self.group_table())
+        if self.few_obs_groups:
+            print(f"\nWarning: Some Length x Source groups have very few observations: {self.few_obs_groups}")
+
+        print(f"\nProportion of {self.outcome} = 1 per Length x Source group:")
+        print(self.groups)
+        if self.separated_groups:
+            print(f"\nWarning: Potential perfect separation detected in {self.separated_groups} (0% or 100% {self.outcome}).")
+            print("This can cause model fitting issues.")
+
+        if self.mixed_length_participants:
+            print(f"\nWarning: {len(self.mixed_length_participants)} participant(s) appear in more than one length group:",
+                  self.mixed_length_participants[:max_examples])
+        if self.missing_cells:
+            print(f"\nWarning: {len(self.missing_cells)} Participant x Source combination(s) within the participant's length group have 0 observations.")
+            print("Examples (participant_id, length, source):", self.missing_cells[:max_examples])
+        elif not self.mixed_length_participants:
+            print("\nEvery participant has observations for every source in their length group.")
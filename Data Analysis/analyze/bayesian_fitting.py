@@ -0,0 +1,217 @@
+# bayesian_fitting.py
+
+# Fitting of BinomialBayesMixedGLM models (variational Bayes) for many
+# outcomes and strata:
+# - Warm starts: a fit starts from the posterior of the latest earlier fit
+#   with the same fixed effects and variance components, with the random
+#   effects matched by name (e.g. the same participants in another stratum).
+# - Caching: fitted posteriors are stored on disk under a fingerprint of the
+#   data, formulas and fit options, so repeated runs skip the fit entirely.
+# - Sparse random effects: variance components of a single grouping factor
+#   ('0 + C(participant_id)') get a sparse indicator design built from the
+#   category codes, instead of patsy's dense n_obs x n_levels dummy matrix.
+# - Bounded outcomes: outcomes between 0 and 1 that are not only 0 and 1
+#   (e.g. comprehension scores) are fitted as a fractional logit model, the
+#   binomial likelihood with a fractional outcome (see FractionalBinomialBayesMixedGLM).
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import numpy as np
+import pandas as pd
+import patsy
+import statsmodels
+from scipy import sparse
+from statsmodels.genmod import families
+from statsmodels.genmod.bayes_mixed_glm import BinomialBayesMixedGLM, BayesMixedGLMResults
+
+CACHE_DIR = "data/cache/bayesian"
+
+# Starting posterior sd of parameters without a warm start value (fit_vb starts near exp(-0.5))
+DEFAULT_START_SD = np.exp(-0.5)
+
+# Variance component formulas of one grouping factor, which get a sparse design
+GROUP_FORMULA = re.compile(r"^\s*0\s*\+\s*C\((\w+)\)\s*$")
+
+# Above this many parameters fit_vb uses L-BFGS-B: BFGS keeps a dense inverse Hessian
+# over all posterior means and sds, which is quadratic in the number of participants
+LIMITED_MEMORY_PARAMETERS = 2000
+
+def design_fingerprint(data, formula, vc_formulas, fit_options=None):
+    """SHA-256 of the data (values and categories), the formulas, the fit options and the statsmodels version."""
+    h = hashlib.sha256()
+    h.update(json.dumps({'formula': formula, 'vc_formulas': vc_formulas, 'fit_options': fit_options or {},
+                         'statsmodels': statsmodels.__version__}, sort_keys=True, default=str).encode())
+    h.update(json.dumps(list(map(str, data.columns))).encode())
+    for col in data.columns:
+        # The categories (including unused ones) shape the design matrices too
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            h.update(json.dumps(list(map(str, data[col].cat.categories))).encode())
+    h.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+def sparse_group_design(data, column):
+    """
+    Indicator matrix (CSR, one column per level) of the grouping factor `column`,
+    the sparse equivalent of patsy's '0 + C(column)' with the same column names
+    and order (the categories of a categorical column, otherwise the sorted values).
+    """
+    values = data[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, levels = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, levels = pd.factorize(values, sort=True)
+    if (codes < 0).any():
+        raise ValueError(f"Missing values in the grouping column '{column}'")
+    n_obs = len(codes)
+    design = sparse.csr_matrix((np.ones(n_obs), codes, np.arange(n_obs + 1)), shape=(n_obs, len(levels)))
+    return design, [f"C({column})[{level}]" for level in levels]
+
+class FractionalBinomialBayesMixedGLM(BinomialBayesMixedGLM):
+    """
+    BinomialBayesMixedGLM for outcomes anywhere between 0 and 1 (a fractional
+    logit model). The variational objective of the binomial model, outcome x linear
+    predictor - log(1 + exp(linear predictor)), is the quasi-likelihood of a
+    fractional outcome, only the constructor's check for 0/1 outcomes is relaxed.
+    """
+    def __init__(self, endog, exog, exog_vc, ident, vcp_p=1, fe_p=2, fep_names=None, vcp_names=None, vc_names=None):
+        # Skips BinomialBayesMixedGLM.__init__, which only accepts 0 and 1
+        super(BinomialBayesMixedGLM, self).__init__(endog, exog, exog_vc=exog_vc, ident=ident, vcp_p=vcp_p, fe_p=fe_p,
+                                                    family=families.Binomial(), fep_names=fep_names,
+                                                    vcp_names=vcp_names, vc_names=vc_names)
+        values = np.asarray(endog, dtype=float)
+        if values.min() < 0 or values.max() > 1 or values.min() == values.max():
+            raise ValueError("endog values must be between 0 and 1, and not all identical")
+
+def binomial_glmm(data, formula, vc_formulas):
+    """
+    BinomialBayesMixedGLM as from_formula builds it, but with a sparse design for
+    grouping-factor variance components (other variance component formulas go
+    through patsy and are stored sparse afterwards). Outcomes with values other
+    than 0 and 1 get a FractionalBinomialBayesMixedGLM.
+    """
+    endog, exog = patsy.dmatrices(formula, data, return_type='dataframe', NA_action='raise')
+    designs, vc_names, ident = [], [], []
+    for j, vc_formula in enumerate(vc_formulas.values()):
+        match = GROUP_FORMULA.match(vc_formula)
+        if match:
+            design, names = sparse_group_design(data, match.group(1))
+        else:
+            dense = patsy.dmatrix(vc_formula, data, return_type='dataframe', NA_action='raise')
+            design, names = sparse.csr_matrix(dense.to_numpy()), dense.columns.tolist()
+        designs.append(design)
+        vc_names += names
+        ident.append(np.full(design.shape[1], j))
+    binary = np.isin(endog.iloc[:, 0].to_numpy(), [0, 1]).all()
+    model_class = BinomialBayesMixedGLM if binary else FractionalBinomialBayesMixedGLM
+    return model_class(endog.iloc[:, 0], exog, exog_vc=sparse.hstack(designs, format='csr'),
+                       ident=np.concatenate(ident), fep_names=exog.columns.tolist(),
+                       vcp_names=list(vc_formulas), vc_names=vc_names)
+
+def _fit_options(model, fit_options):
+    """The fit_vb options for `model`, switching large models to L-BFGS-B unless a fit_method is given."""
+    fit_options = dict(fit_options or {})
+    if 'fit_method' not in fit_options and len(model.names) > LIMITED_MEMORY_PARAMETERS:
+        fit_options['fit_method'] = 'L-BFGS-B'
+    return fit_options
+
+def _parameter_names(model):
+    """Fixed effect, variance parameter and random effect names of a model, in the order of its parameter vector."""
+    return list(model.exog_names), list(model.vcp_names), list(model.vc_names)
+
+class BayesianFitCache:
+    """
+    Earlier solutions for warm starts (kept in memory) and fitted posteriors
+    (pickled in `cache_dir`, None to not store them on disk).
+    """
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._solutions = [] # (fe_names, vcp_names, vc_names, mean, sd) of earlier fits, latest last
+
+    def _path(self, fingerprint):
+        return os.path.join(self.cache_dir, f"{fingerprint}.pkl")
+
+    def load(self, fingerprint):
+        """The cached posterior mean and variance for `fingerprint`, or None."""
+        if self.cache_dir is None or not os.path.exists(self._path(fingerprint)):
+            return None
+        with open(self._path(fingerprint), 'rb') as f:
+            return pickle.load(f)
+
+    def store(self, fingerprint, result):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temporary file first, so an interrupted run never leaves a partial cache entry
+        temporary_path = self._path(fingerprint) + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump({'params': result.params, 'cov_params': np.asarray(result.cov_params())}, f)
+        os.replace(temporary_path, self._path(fingerprint))
+
+    def remember(self, model, result):
+        """Keeps a fit's posterior as a warm start for later fits."""
+        fe_names, vcp_names, vc_names = _parameter_names(model)
+        sd = np.sqrt(np.asarray(result.cov_params()))
+        self._solutions.append((fe_names, vcp_names, vc_names, np.asarray(result.params), sd))
+
+    def warm_start(self, model):
+        """
+        Starting posterior mean and sd for `model` from the latest earlier fit with
+        the same fixed effects and variance parameters, or (None, None) if there is
+        none. Random effects are matched by name; new ones start at 0.
+        """
+        fe_names, vcp_names, vc_names = _parameter_names(model)
+        for previous_fe, previous_vcp, previous_vc, mean, sd in reversed(self._solutions):
+            if previous_fe != fe_names or previous_vcp != vcp_names:
+                continue
+            k = len(fe_names) + len(vcp_names)
+            position = pd.Index(previous_vc).get_indexer(vc_names)
+            found = position >= 0
+            vc_mean = np.where(found, mean[k:][np.maximum(position, 0)], 0.0)
+            vc_sd = np.where(found, sd[k:][np.maximum(position, 0)], DEFAULT_START_SD)
+            return np.concatenate([mean[:k], vc_mean]), np.concatenate([sd[:k], vc_sd])
+        return None, None
+
+def fit_bayesian_glmm(data, formula, vc_formulas, cache=None, fit_options=None):
+    """
+    Fits a BinomialBayesMixedGLM with fit_vb, warm started and cached through
+    `cache` (a BayesianFitCache, or None for a plain fit).
+
+    Returns:
+        The fit results and whether they came from the cache.
+    """
+    model = binomial_glmm(data, formula, vc_formulas)
+    fit_options = _fit_options(model, fit_options)
+    if cache is None:
+        return model.fit_vb(**fit_options), False
+
+    fingerprint = design_fingerprint(data, formula, vc_formulas, fit_options)
+    cached = cache.load(fingerprint)
+    if cached is not None:
+        result, from_cache = BayesMixedGLMResults(model, cached['params'], cached['cov_params']), True
+    else:
+        mean, sd = cache.warm_start(model)
+        result, from_cache = model.fit_vb(mean=mean, sd=sd, **fit_options), False
+        cache.store(fingerprint, result)
+    cache.remember(model, result)
+    return result, from_cache
+
+def fit_bayesian_glmms(specs, cache=None, fit_options=None):
+    """
+    Fits one model per entry of `specs`, a dict of name -> (data, formula, vc_formulas),
+    in order, so each fit can warm start from the fits before it. Without a
+    `cache`, warm starts are kept in memory only.
+
+    Returns:
+        dict of name -> fit results (or the exception raised while fitting)
+    """
+    cache = cache or BayesianFitCache(cache_dir=None)
+    results = {}
+    for name, (data, formula, vc_formulas) in specs.items():
+        try:
+            results[name], _ = fit_bayesian_glmm(data, formula, vc_formulas, cache, fit_options)
+        except Exception as e:
+            results[name] = e
+    return results
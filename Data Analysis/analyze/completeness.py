@@ -0,0 +1,60 @@
+# completeness.py
+import numpy as np
+import pandas as pd
+
+class CompletenessIndex:
+    """
+    Which sources each participant has data for, per DV ('question'), as one
+    boolean participant x DV x source array built in a single pass over the
+    experiment data.
+
+    A participant is incomplete for a DV if they have data for that DV, but not
+    for every source that other participants have data for. The ANOVA, the
+    Bayesian model and the plots use the index to report or apply exclusions
+    without filtering and grouping the data again.
+    """
+    def __init__(self, df):
+        rows = df[df['source'].notna() & df['participant_id'].notna() & df['question'].notna()]
+
+        # Axes from the shared schema: participant_code, and the question and source categories
+        self.participants = df['participant_id'].cat.categories
+        self.dvs = df['question'].cat.categories
+        self.sources = df['source'].cat.categories
+
+        self.present = np.zeros((len(self.participants), len(self.dvs), len(self.sources)), dtype=bool)
+        self.present[rows['participant_code'].to_numpy(),
+                     rows['question'].cat.codes.to_numpy(),
+                     rows['source'].cat.codes.to_numpy()] = True
+
+        # Sources expected per DV: those any participant has data for
+        self.expected = self.present.any(axis=0)
+        has_dv = self.present.any(axis=2)
+        self.complete = (self.present | ~self.expected[np.newaxis]).all(axis=2) & has_dv
+        self.incomplete = has_dv & ~self.complete
+
+    def _dv_position(self, dv):
+        position = self.dvs.get_indexer([dv])[0]
+        if position < 0:
+            raise KeyError(f"Unknown DV: {dv}")
+        return position
+
+    def expected_sources(self, dv):
+        """The sources any participant has data for, for `dv`."""
+        return self.sources[self.expected[self._dv_position(dv)]].tolist() if dv in self.dvs else []
+
+    def incomplete_participants(self, dv):
+        """participant_ids with data for `dv`, but not for all of its sources."""
+        if dv not in self.dvs:
+            return []
+        return self.participants[self.incomplete[:, self._dv_position(dv)]].tolist()
+
+    def mask(self, df, dv=None):
+        """
+        Boolean mask of the rows of `df` (with the same schema) whose participant is
+        complete for `dv`, or for the row's own question if dv is None.
+        """
+        codes = df['participant_code'].to_numpy()
+        if dv is not None:
+            return pd.Series(self.complete[codes, self._dv_position(dv)], index=df.index)
+        dv_positions = self.dvs.get_indexer(df['question'].astype(str))
+        return pd.Series((dv_positions >= 0) & self.complete[codes, np.maximum(dv_positions, 0)], index=df.index)
@@ -1,104 +1,116 @@
 # data_handling.py
+import os
 import pandas as pd
 import numpy as np # often useful for handling NaNs
+from storage import read_table, table_columns
+from .schema import apply_column_schema, participant_dtype, restore_schema
+from .completeness import CompletenessIndex
+from .reporting import print_table
+
+def _read_columns(path, columns=None):
+    """The `columns` (default: all) of the table at `path` that it has, plus participant_id, in file order."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    wanted = [col for col in table_columns(path) if columns is None or col in columns or col == 'participant_id']
+    return read_table(path, columns=wanted)
+
+def _inspect(df, name):
+    """Prints the first rows and the info of a loaded table."""
+    print(f"\n{name} Data (first 5 rows):")
+    # Check if dataframe is not empty before printing head
+    if not df.empty:
+        print_table(df.head(), index=False)
+    else:
+        print(f"{name} dataframe is empty.")
+
+    print(f"\n{name} data info:")
+    # Check if dataframe is not empty before printing info
+    if not df.empty:
+        df.info()
+    else:
+        print(f"{name} dataframe is empty.")
 
 def load_and_inspect_data(experiment_file='data/test_data_evaluated.csv',
-                          questionnaire_file='data/questionnaire_data_evaluated.csv'):
-    """Loads the experiment and questionnaire datasets and performs initial inspection."""
+                          questionnaire_file='data/questionnaire_data_evaluated.csv',
+                          experiment_columns=None, questionnaire_columns=None, inspect=True):
+    """
+    Loads the experiment and questionnaire datasets and performs initial inspection.
+    The shared categorical schema (see schema.py) is applied to both before returning.
+
+    Only `experiment_columns` and `questionnaire_columns` are read (default: all
+    columns), each file once. The head and info of each table are only printed
+    with inspect=True.
+    """
     print(f"\nLoading experiment data from: {experiment_file}")
     try:
-        df_experiment = pd.read_csv(experiment_file)
+        df_experiment = _read_columns(experiment_file, experiment_columns)
     except FileNotFoundError:
         print(f"Error: Experiment data file not found at {experiment_file}")
         return None, None
+    try:
+        df_questionnaire = _read_columns(questionnaire_file, questionnaire_columns)
+    except FileNotFoundError:
+        df_questionnaire = None # Reported below, the experiment data is analyzed without it
 
-    print("\nExperiment Data (first 5 rows):")
-    # Check if dataframe is not empty before printing head
-    if not df_experiment.empty:
-        print(df_experiment.head().to_markdown(index=False, numalign="left", stralign="left"))
-    else:
-        print("Experiment dataframe is empty.")
-
-
-    print("\nExperiment data info:")
-    # Check if dataframe is not empty before printing info
-    if not df_experiment.empty:
-        df_experiment.info()
-    else:
-        print("Experiment dataframe is empty.")
+    # The shared participant_id dtype covers the participants of both tables
+    frames = [df for df in (df_experiment, df_questionnaire) if df is not None]
+    ids_dtype = participant_dtype(*(df['participant_id'] for df in frames))
+    apply_column_schema(df_experiment, ids_dtype, experiment=True)
+    if inspect:
+        _inspect(df_experiment, "Experiment")
 
     print(f"\nLoading questionnaire data from: {questionnaire_file}")
-    try:
-        df_questionnaire = pd.read_csv(questionnaire_file)
-    except FileNotFoundError:
+    if df_questionnaire is None:
         print(f"Error: Questionnaire data file not found at {questionnaire_file}")
-        # Return the experiment data even if questionnaire data is missing
         return df_experiment, None
-
-    print("\nQuestionnaire Data (first 5 rows):")
-    # Check if dataframe is not empty before printing head
-    if not df_questionnaire.empty:
-        print(df_questionnaire.head().to_markdown(index=False, numalign="left", stralign="left"))
-    else:
-         print("Questionnaire dataframe is empty.")
-
-    print("\nQuestionnaire data info:")
-    # Check if dataframe is not empty before printing info
-    if not df_questionnaire.empty:
-        df_questionnaire.info()
-    else:
-        print("Questionnaire dataframe is empty.")
-
+    apply_column_schema(df_questionnaire, ids_dtype, experiment=False)
+    if inspect:
+        _inspect(df_questionnaire, "Questionnaire")
 
     return df_experiment, df_questionnaire
 
-def check_data_completeness(df):
-    """Identifies participants with incomplete 'source' data for ANOVA dependent variables (within experiment data)."""
+def check_data_completeness(df, completeness=None):
+    """
+    Identifies participants with incomplete 'source' data for ANOVA dependent variables (within experiment data).
+
+    Returns:
+        The CompletenessIndex of df (built here unless given), which the ANOVA,
+        Bayesian and plotting steps use to report or apply exclusions.
+    """
     if df is None or df.empty:
         print("\n--- Skipping data completeness check: Experiment data is empty or None ---")
-        return {}
+        return None
 
+    if completeness is None:
+        completeness = CompletenessIndex(df)
     dependent_vars_anova = ['confidence', 'comprehension', 'satisfaction', 'effort']
-    participants_to_exclude_per_dv = {}
 
     print("\n--- Checking for Participants with Incomplete 'source' Data per DV (Experiment Data) ---")
     for dv in dependent_vars_anova:
         print(f"\nChecking data for {dv}...")
-        # Filter for the specific dependent variable and ensure required columns exist
-        df_dv_check = df[(df['question'] == dv) & df['source'].notna() & df['participant_id'].notna()].copy()
-
-        if df_dv_check.empty:
+        if not completeness.expected_sources(dv):
              print(f"No relevant data found for {dv} to check source completeness.")
-             participants_to_exclude_per_dv[dv] = []
              continue
 
-        # Check for number of unique sources per participant for this DV
-        source_counts = df_dv_check.groupby('participant_id')['source'].nunique()
-
-        # Get the total number of expected sources (all participants should have all sources)
-        expected_sources = df_dv_check['source'].nunique()
-        if expected_sources == 0: # Avoid division by zero if no sources found
-            print(f"No 'source' values found for {dv}. Cannot check completeness.")
-            participants_to_exclude_per_dv[dv] = []
-            continue
-
-        incomplete_participants = source_counts[source_counts < expected_sources].index.tolist()
-
+        incomplete_participants = completeness.incomplete_participants(dv)
         if incomplete_participants:
             print(f"Found {len(incomplete_participants)} participant(s) with incomplete 'source' data for {dv}:")
             print(incomplete_participants)
-            participants_to_exclude_per_dv[dv] = incomplete_participants
         else:
             print(f"All participants have complete 'source' data for {dv}.")
-            participants_to_exclude_per_dv[dv] = []
 
-    return participants_to_exclude_per_dv
+    return completeness
 
 def create_new_dvs(df):
     """
     Adds aggregate quality scores (general, subjective, objective) and
     reaction time as new 'questions' for each participant/test group.
 
+    The scores are grouped means over all groups at once. New rows follow the
+    original rows, ordered by (test_slug, participant_id) and within each group
+    general, subjective and objective quality, then reaction time. A row is only
+    added if its value is not NaN.
+
     Args:
         df: pandas DataFrame with columns test_slug, participant_id, id,
             response_value, length, source, reaction_time, question.
@@ -106,115 +118,59 @@ def create_new_dvs(df):
     Returns:
         pandas DataFrame with original rows plus new aggregate rows.
     """
-    # Define the question sets for the new quality metrics
-    general_questions = ['confidence', 'comprehension', 'satisfaction', 'effort', 'accuracy']
-    subjective_questions = ['confidence', 'satisfaction', 'effort']
-    objective_questions = ['accuracy', 'comprehension']
-
-    # Group by test_slug and participant_id
-    grouped = df.groupby(['test_slug', 'participant_id'])
-
-    # List to store the new rows
-    new_rows_list = []
-
-    # Iterate over each group (test_slug, participant_id)
-    for (test_slug, participant_id), group_df in grouped:
-        # Calculate means for each quality type
-        general_mean = group_df[group_df['question'].isin(general_questions)]['response_value'].mean()
-        subjective_mean = group_df[group_df['question'].isin(subjective_questions)]['response_value'].mean()
-        objective_mean = group_df[group_df['question'].isin(objective_questions)]['response_value'].mean()
-
-        # Get values for other columns - assuming they are consistent within the group
-        # Source and reaction_time is consistent within participant/test
-        # id and length are specific to the original question and will be None/NaN for new rows
-        # Use .iloc[0] to get the first value in the group, assuming consistency
-        source_val = group_df['source'].iloc[0] if not group_df.empty else None
-        rt_val = group_df['reaction_time'].iloc[0] if not group_df.empty else None
-        is_mobile = group_df['is_mobile'].iloc[0] if not group_df.empty else None
-        age = group_df['age'].iloc[0] if not group_df.empty else None
-        length_val = group_df['length'].iloc[0] if not group_df.empty else None
-        id_val = group_df['id'].iloc[0] # Placeholder as it's question-specific
-
-        # Create new row dictionaries for Quality scores if mean is not NaN
-        if pd.notna(general_mean):
-            new_rows_list.append({
-                'test_slug': test_slug,
-                'participant_id': participant_id,
-                'is_mobile': is_mobile,
-                'age': age,
-                'id': id_val + '-gq', # Use placeholder
-                'response_value': general_mean,
-                'length': length_val, # Use placeholder
-                'source': source_val, # Use consistent value from group
-                'reaction_time': rt_val, 
-                'question': 'general_quality' # New question type
-            })
-
-        if pd.notna(subjective_mean):
-             new_rows_list.append({
-                'test_slug': test_slug,
-                'participant_id': participant_id,
-                'is_mobile': is_mobile,
-                'age': age,
-                'id': id_val + '-sq',
-                'response_value': subjective_mean,
-                'length': length_val,
-                'source': source_val,
-                'reaction_time': rt_val, # Keep the consistent reaction_time value
-                'question': 'subjective_quality'
-            })
-
-        if pd.notna(objective_mean):
-             new_rows_list.append({
-                'test_slug': test_slug,
-                'participant_id': participant_id,
-                'is_mobile': is_mobile,
-                'age': age,
-                'id': id_val + '-oq',
-                'response_value': objective_mean,
-                'length': length_val,
-                'source': source_val,
-                'reaction_time': rt_val, # Keep the consistent reaction_time value
-                'question': 'objective_quality'
-            })
-
-        # Create a new row for reaction_time, using the value from the column
-        # Only add if rt_val is not None/NaN (meaning the group was not empty)
-        if pd.notna(rt_val):
-             new_rows_list.append({
-                'test_slug': test_slug,
-                'participant_id': participant_id,
-                'is_mobile': is_mobile,
-                'age': age,
-                'id': id_val + '-rt', # Placeholder
-                'response_value': rt_val,
-                'length': length_val, # Placeholder
-                'source': source_val, # Use consistent value from group
-                'reaction_time': rt_val, # Keep the consistent reaction_time value in its column too
-                'question': 'reaction_time' # New question type
-            })
-
-
-    # Create a DataFrame from the new rows
-    df_new_rows = pd.DataFrame(new_rows_list)
-
-    # Ensure columns are in the same order as the original DataFrame before concatenating
-    # Use the columns from the input 'df'
-    df_new_rows = df_new_rows[df.columns]
+    # The question sets of the new quality metrics, with the suffix of their ids
+    quality_questions = {
+        'general_quality': (['confidence', 'comprehension', 'satisfaction', 'effort', 'accuracy'], '-gq'),
+        'subjective_quality': (['confidence', 'satisfaction', 'effort'], '-sq'),
+        'objective_quality': (['accuracy', 'comprehension'], '-oq'),
+    }
+
+    # Group number of every row, in sorted (test_slug, participant_id) order.
+    # Rows with a missing test_slug or participant_id belong to no group (-1), as groupby drops them
+    # (ngroup gives them -1 or NaN, depending on the pandas version)
+    group = df.groupby(['test_slug', 'participant_id'], observed=True).ngroup().fillna(-1).to_numpy(dtype='int64')
+    in_group = group >= 0
+    n_groups = group.max() + 1 if in_group.any() else 0
+
+    # The first row of each group provides source, length, reaction time etc.
+    # (consistent within participant/test), and the id the new ids are built from
+    grouped_positions = np.flatnonzero(in_group)
+    first_positions = np.full(n_groups, -1)
+    first_positions[group[grouped_positions][::-1]] = grouped_positions[::-1]
+    df_first = df.iloc[first_positions].reset_index(drop=True)
+
+    # Means per group, as sums and counts in row order (NaN responses are skipped, like mean())
+    response_values = df['response_value'].to_numpy(dtype=float)
+    question = df['question'].astype(str)
+    values, suffixes = [], []
+    for new_question, (questions, suffix) in quality_questions.items():
+        in_set = question.isin(questions).to_numpy() & ~np.isnan(response_values) & in_group
+        sums = np.bincount(group[in_set], weights=response_values[in_set], minlength=n_groups)
+        counts = np.bincount(group[in_set], minlength=n_groups)
+        with np.errstate(invalid='ignore'):
+            values.append(sums / np.where(counts > 0, counts, np.nan))
+        suffixes.append(suffix)
+    values.append(df_first['reaction_time'].to_numpy(dtype=float))
+    suffixes.append('-rt')
+    new_questions = list(quality_questions) + ['reaction_time']
+
+    # One candidate row per group and new question (group-major), keeping those with a value
+    values = np.column_stack(values).ravel()
+    keep = ~np.isnan(values)
+    group_of_row = np.repeat(np.arange(n_groups), len(new_questions))[keep]
+
+    df_new_rows = df_first.iloc[group_of_row].reset_index(drop=True)
+    if 'id' in df_new_rows.columns: # Not needed by the analysis, so it may not have been loaded
+        df_new_rows['id'] = df_new_rows['id'].astype(str) + np.tile(suffixes, n_groups)[keep]
+    df_new_rows['response_value'] = values[keep]
+    df_new_rows['question'] = pd.Categorical(np.tile(new_questions, n_groups)[keep], dtype=df['question'].dtype)
 
     # Concatenate the original DataFrame and the new rows DataFrame
-    # Use the input 'df' for concatenation
-    df_extended = pd.concat([df, df_new_rows], ignore_index=True)
+    df_extended = pd.concat([df, df_new_rows[df.columns]], ignore_index=True)
+    # Keep the categorical schema, which a concat with plain columns would drop
+    df_extended = restore_schema(df_extended, like=df)
 
     # Drop the old reaction time column as it is not needed anymore
     df_extended = df_extended.drop(['reaction_time'], axis=1)
 
-    print("\nDataFrame with new quality metrics and reaction_time row:")
-    # Use .head() to avoid printing potentially large DataFrame
-    print(df_extended.sample(n=15))
-
-    print("\nChecking that new DVs are correct:")
-    print(df_extended[df_extended['participant_id'] == '144da5ba-b2ef-4861-9e85-7577e9e4ee9a'])
-
-
-    return df_extended
\ No newline at end of file
+    return df_extended
@@ -1,47 +1,120 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+from .accumulators import MomentAccumulator, CountAccumulator, DistinctAccumulator, FirstValueAccumulator
+from .reporting import print_table
 
-def calculate_descriptive_statistics(df, df_anova_results):
+class DescriptiveAccumulator:
     """
-    Calculates and prints descriptive statistics for dependent variables and reaction time.
-    Also prints the number of participants per length group and responses per participant and source.
+    Everything the descriptive statistics are computed from, as mergeable
+    accumulators (see accumulators.py): participants per length group, the age
+    and device of each participant, the response counts per source, and the
+    moments of the DVs (and raw reaction times, if present) per length, source
+    and question. Feed it chunks of the experiment data with update(), or merge
+    the accumulators of several shards.
     """
+    def __init__(self):
+        self.participants_by_length = DistinctAccumulator(['length'], 'participant_id')
+        self.participant_info = FirstValueAccumulator('participant_id', ['is_mobile', 'age'])
+        self.responses = CountAccumulator(['source', 'response_value'])
+        self.dv_moments = MomentAccumulator(['length', 'source', 'question'], 'response_value')
+        self.rt_moments = None # only if the data has a reaction_time column
+
+    def _parts(self):
+        return ['participants_by_length', 'participant_info', 'responses', 'dv_moments', 'rt_moments']
+
+    def update(self, chunk):
+        if 'reaction_time' in chunk.columns and self.rt_moments is None:
+            self.rt_moments = MomentAccumulator(['length', 'source', 'question'], 'reaction_time')
+        for name in self._parts():
+            if getattr(self, name) is not None:
+                getattr(self, name).update(chunk)
+        return self
+
+    def merge(self, other):
+        for name in self._parts():
+            mine, theirs = getattr(self, name), getattr(other, name)
+            if theirs is None:
+                continue
+            if mine is None:
+                setattr(self, name, theirs)
+            else:
+                mine.merge(theirs)
+        return self
+
+    def tables(self):
+        """The accumulated statistics as long-format DataFrames, by name."""
+        participant_info = self.participant_info.result()
+        tables = {
+            'participants_by_length': self.participants_by_length.result().rename('participants').reset_index(),
+            'device': participant_info['is_mobile'].value_counts().rename_axis('is_mobile').rename('participants').reset_index(),
+            'age': participant_info['age'].describe().rename_axis('statistic').reset_index(),
+            'response_counts': self.responses.result().rename('count').reset_index(),
+            'dv_moments': self.dv_moments.result().sort_index().reset_index(),
+        }
+        if self.rt_moments is not None:
+            tables['reaction_time_moments'] = self.rt_moments.result().sort_index().reset_index()
+        return tables
+
+def _accumulate_chunk(chunk):
+    """Accumulates one chunk in a worker process, see accumulate_descriptives."""
+    return DescriptiveAccumulator().update(chunk)
+
+def accumulate_descriptives(chunks, n_jobs=1):
+    """
+    Folds an iterable of experiment data chunks (e.g. storage.read_table_chunks,
+    or row ranges of a DataFrame) into one DescriptiveAccumulator, in order.
+    With n_jobs other than 1 (None: all cores) the chunks are accumulated on a
+    process pool and merged in chunk order; the pool takes all chunks up front,
+    so for data that does not fit in memory keep n_jobs=1.
+    """
+    accumulator = DescriptiveAccumulator()
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        for chunk in chunks:
+            accumulator.update(chunk)
+        return accumulator
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        for partial in executor.map(_accumulate_chunk, chunks):
+            accumulator.merge(partial)
+    return accumulator
+
+def row_chunks(df, n_chunks=None, chunksize=None):
+    """Contiguous row ranges of `df`, either `n_chunks` of them or `chunksize` rows each."""
+    if chunksize is not None:
+        return [df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize)]
+    return [df.iloc[positions[0]:positions[-1] + 1] for positions in np.array_split(np.arange(len(df)), n_chunks or 1) if len(positions)]
+
+def print_descriptive_statistics(accumulator):
+    """Prints the descriptive statistics tables from a DescriptiveAccumulator."""
     print("\n--- Descriptive Statistics ---")
 
     # Print number of participants in each 'length' group
     print("Number of Participants per Length Group:")
-    participant_counts_by_length = df.groupby('length')['participant_id'].nunique()
-    print(participant_counts_by_length.to_markdown(numalign="left", stralign="left"))
+    participant_counts_by_length = accumulator.participants_by_length.result()
+    print_table(participant_counts_by_length)
     print("\n") # Add a newline for separation
 
-    # First, create a DataFrame where each row is a unique participant
-    # and contains their is_mobile status and age.
-    # Aage and is_mobile are consistent for a given participant_id.
-    # Using .first() to select one value per participant
-    participant_info = df.groupby('participant_id')[['is_mobile', 'age']].first()
-
-    # Perform descriptive statistics on this participant-level data
+    # One row per participant with their is_mobile status and age.
+    # Age and is_mobile are consistent for a given participant_id, the first value is kept.
+    participant_info = accumulator.participant_info.result()
 
     # Descriptive statistics for 'is_mobile' among unique participants
     print("Descriptive Statistics for device type (per unique participant):")
-    # Value counts on the participant-level mobile status
     participant_mobile_counts = participant_info['is_mobile'].value_counts()
-    print(participant_mobile_counts.to_markdown(numalign="left", stralign="left"))
+    print_table(participant_mobile_counts)
     print("\n")
 
     # Descriptive statistics for 'age' among unique participants
     print("Descriptive Statistics for age (per unique participant):")
-    # .describe() on the participant-level age
     participant_age_description = participant_info['age'].describe()
-    print(participant_age_description.to_markdown(numalign="left", stralign="left"))
+    print_table(participant_age_description)
     print("\n")
 
     print("Distribution of Responses per Source (Counts):")
-    # Group by source and response_value, then count occurrences
-    response_distribution_by_source = df.groupby('source')['response_value'].value_counts().sort_index()
-
-    # Unstack to get a table format: Sources as rows, Response Values as columns
-    # Fill NaN with 0 for combinations that didn't occur
-    response_distribution_table = response_distribution_by_source.unstack(fill_value=0)
+    # Sources as rows, Response Values as columns, 0 for combinations that didn't occur
+    response_distribution_table = accumulator.responses.result().unstack(fill_value=0)
 
     # Ensure columns (response values) are sorted if they are numeric/ordered
     try:
@@ -55,19 +128,33 @@ def calculate_descriptive_statistics(df, df_anova_results):
         response_distribution_table = response_distribution_table.sort_index(axis=1)
 
 
-    print(response_distribution_table.to_markdown(numalign="left", stralign="left"))
+    print_table(response_distribution_table)
     print("\n") # Add a newline for separation
 
 
     print("Dependent Variable Means & Std Dev per Length, Source, and Question:\n")
-    # Ensure 'response_value' is numeric, coercing errors will turn non-numeric into NaN
-    df['response_value'] = pd.to_numeric(df['response_value'], errors='coerce')
-    descriptive_stats_dv = df.groupby(['length', 'source', 'question'])['response_value'].agg(['mean', 'std']).unstack('question')
-    print(descriptive_stats_dv.to_markdown(numalign="left", stralign="left"))
+    # Non-numeric response values count as missing
+    descriptive_stats_dv = accumulator.dv_moments.result()[['mean', 'std']].sort_index().unstack('question')
+    print_table(descriptive_stats_dv)
 
-    if 'reaction_time' in df.columns:
+    if accumulator.rt_moments is not None:
          print("\nReaction Time Means & Std Dev per Length, Source, and Question:\n")
-         # Ensure 'reaction_time' is numeric
-         df['reaction_time'] = pd.to_numeric(df['reaction_time'], errors='coerce')
-         descriptive_stats_rt = df.groupby(['length', 'source', 'question'])['reaction_time'].agg(['mean', 'std']).unstack('question')
-         print(descriptive_stats_rt.to_markdown(numalign="left", stralign="left"))
\ No newline at end of file
+         descriptive_stats_rt = accumulator.rt_moments.result()[['mean', 'std']].sort_index().unstack('question')
+         print_table(descriptive_stats_rt)
+
+def calculate_descriptive_statistics(df, df_anova_results, n_jobs=1, chunksize=None):
+    """
+    Calculates and prints descriptive statistics for dependent variables and reaction time.
+    Also prints the number of participants per length group and responses per participant and source.
+
+    The statistics are accumulated over contiguous row chunks of `df` (`chunksize`
+    rows each, or one per job) and merged, on `n_jobs` processes (see
+    accumulate_descriptives). `df` itself is not modified.
+
+    Returns:
+        The DescriptiveAccumulator, e.g. to merge with other data later.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    accumulator = accumulate_descriptives(row_chunks(df, n_jobs, chunksize), n_jobs)
+    print_descriptive_statistics(accumulator)
+    return accumulator
@@ -2,10 +2,10 @@
 
 import pandas as pd
 import seaborn as sns
-import matplotlib.pyplot as plt
 import os
-from matplotlib import rcParams
 import numpy as np
+from .reporting import print_table
+from .rendering import render_plots
 
 def aggregate_experiment_data(df):
     """
@@ -36,7 +36,8 @@ def aggregate_experiment_data(df):
             index='participant_id',       # Participant ID becomes the index (one row per participant)
             columns=['source', 'question'], # Source and Question become column levels
             values='response_value',
-            aggfunc='mean' # Calculate mean response for each source/question combination per participant
+            aggfunc='mean', # Calculate mean response for each source/question combination per participant
+            observed=True # Only source/question levels present in the data (schema categoricals)
         )
 
         # Flatten column MultiIndex: join levels with _mean_
@@ -47,7 +48,7 @@ def aggregate_experiment_data(df):
         df_agg = df_agg.reset_index()
 
         print("Experiment data aggregation complete with source in column names. Head:")
-        print(df_agg.head().to_markdown(numalign="left", stralign="left"))
+        print_table(df_agg.head())
         return df_agg
 
     except Exception as e:
@@ -97,32 +98,63 @@ def wrangle_questionnaire_data(df):
             index='participant_id',
             columns=['questionnaire_type', 'question'],
             values='response_value',
-            aggfunc='mean'
+            aggfunc='mean',
+            observed=True
         )
 
         # Flatten column MultiIndex: join levels with an underscore
         df_q_wide.columns = [f'{col[0]}_{col[1]}' for col in df_q_wide.columns]
 
         print("Questionnaire data wrangling complete. Head:")
-        print(df_q_wide.head().to_markdown(numalign="left", stralign="left"))
+        print_table(df_q_wide.head())
         return df_q_wide.reset_index() # Convert index back to column
 
     except Exception as e:
         print(f"Error during questionnaire data wrangling: {e}")
         return pd.DataFrame()
 
-# Modified _plot_correlation_heatmap to handle source prefix removal from labels
-def _plot_correlation_heatmap(correlation_matrix, title, filename, source_prefix=None, output_dir='plots'):
+def _clean_correlation_label(label, source_prefix=None):
+    """Display label of a correlation matrix variable, optionally without a source prefix."""
+    cleaned_label = label
+
+    # 1. Attempt to remove source prefix + '_mean_' specifically from experiment labels
+    if source_prefix and cleaned_label.startswith(f'{source_prefix}_mean_'):
+        # Remove the prefix (e.g., 'AI_mean_accuracy' -> 'accuracy')
+        cleaned_label = cleaned_label[len(f'{source_prefix}_mean_'):]
+    # Note: Questionnaire labels ('pre_...', 'post_...') will not start with source_prefix_mean_
+
+    # 2. Apply general cleaning (replace remaining underscores, title case)
+    cleaned_label = cleaned_label.replace('_', ' ').title()
+
+    # 3. Fix common acronyms/terms that title() might mess up
+    # These checks apply after general cleaning, so handle spaces around acronyms
+    cleaned_label = cleaned_label.replace(' Ai ', ' AI ')
+    cleaned_label = cleaned_label.replace(' Rt ', ' RT ') # Example if RT (response time) exists
+    cleaned_label = cleaned_label.replace(' Gglm ', ' GGLM ') # Example if GGLM exists
+    return cleaned_label
+
+def _draw_correlation_heatmap(fig, correlation_matrix, title, cleaned_labels):
+    """Draws a lower-triangle correlation heatmap (a plot job, see rendering.py)."""
+    ax = fig.subplots()
+    mask = np.triu(np.ones_like(correlation_matrix, dtype=bool))
+
+    sns.heatmap(correlation_matrix, mask=mask, annot=True, fmt=".2f", cmap='coolwarm',
+                vmin=-1, vmax=1, center=0, square=True, linewidths=.5, cbar_kws={"shrink": .5},
+                xticklabels=cleaned_labels, yticklabels=cleaned_labels, ax=ax) # Use cleaned labels here
+
+    ax.set_title(title)
+    fig.tight_layout()
+
+def _correlation_heatmap_job(correlation_matrix, title, filename, source_prefix=None, output_dir='plots'):
     """
-    Helper function to generate and save a correlation heatmap with cleaned labels,
-    optionally removing a source prefix from experiment outcome labels.
+    Plot job for a correlation heatmap with cleaned labels, optionally removing a
+    source prefix from experiment outcome labels. None if there is nothing to plot.
     """
     if correlation_matrix.empty or correlation_matrix.shape[0] < 2:
         print(f"Correlation matrix for '{title}' is empty or too small (less than 2 variables). Skipping plot.")
-        return
+        return None
 
     print(f"\n--- Generating Heatmap: {title} ---")
-    rcParams['font.family'] = 'Times New Roman'
 
     # Ensure output directory exists
     if not os.path.exists(output_dir):
@@ -134,62 +166,30 @@ def _plot_correlation_heatmap(correlation_matrix, title, filename, source_prefix
     # Adjust figure size dynamically based on the number of variables
     num_vars = correlation_matrix.shape[0]
     fig_size = max(6, min(25, num_vars * 0.7)) # Adjusted scaling factor and max size
-    fig, ax = plt.subplots(figsize=(fig_size, fig_size))
 
     # --- Clean up labels for correlation plot ---
-    original_labels = correlation_matrix.columns
-    cleaned_labels = []
-    for label in original_labels:
-        cleaned_label = label
-
-        # 1. Attempt to remove source prefix + '_mean_' specifically from experiment labels
-        if source_prefix and cleaned_label.startswith(f'{source_prefix}_mean_'):
-            # Remove the prefix (e.g., 'AI_mean_accuracy' -> 'accuracy')
-            cleaned_label = cleaned_label[len(f'{source_prefix}_mean_'):]
-        # Note: Questionnaire labels ('pre_...', 'post_...') will not start with source_prefix_mean_
-
-        # 2. Apply general cleaning (replace remaining underscores, title case)
-        cleaned_label = cleaned_label.replace('_', ' ').title()
-
-        # 3. Fix common acronyms/terms that title() might mess up
-        # These checks apply after general cleaning, so handle spaces around acronyms
-        cleaned_label = cleaned_label.replace(' Ai ', ' AI ')
-        cleaned_label = cleaned_label.replace(' Rt ', ' RT ') # Example if RT (response time) exists
-        cleaned_label = cleaned_label.replace(' Gglm ', ' GGLM ') # Example if GGLM exists
-
-        cleaned_labels.append(cleaned_label)
+    cleaned_labels = [_clean_correlation_label(label, source_prefix) for label in correlation_matrix.columns]
 
-
-    mask = np.triu(np.ones_like(correlation_matrix, dtype=bool))
-
-    sns.heatmap(correlation_matrix, mask=mask, annot=True, fmt=".2f", cmap='coolwarm',
-                vmin=-1, vmax=1, center=0, square=True, linewidths=.5, cbar_kws={"shrink": .5},
-                xticklabels=cleaned_labels, yticklabels=cleaned_labels, ax=ax) # Use cleaned labels here
-
-    ax.set_title(title)
-    plt.tight_layout()
-
-    filepath = os.path.join(output_dir, filename)
-    try:
-        plt.savefig(filepath, dpi=300)
-        print(f"Saved plot to: {filepath}")
-    except Exception as e:
-        print(f"Error saving plot {filepath}: {e}")
-    finally:
-        plt.close(fig) # Close plot
+    return (_draw_correlation_heatmap, dict(correlation_matrix=correlation_matrix, title=title, cleaned_labels=cleaned_labels),
+            os.path.join(output_dir, filename), (fig_size, fig_size))
 
 
-def perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir='plots'):
+def perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir='plots', plot_jobs=1):
     """
     Merges aggregated experiment data (with source distinction) and wrangled
     questionnaire data and performs and plots correlation analysis
-    separately for each source for pre and post questions.
+    separately for each source for pre and post questions. The heatmaps are
+    rendered together at the end, on `plot_jobs` processes (None: all cores).
+
+    Returns:
+        dict of '<source>_pre' / '<source>_post' -> correlation matrix
     """
+    correlations = {}
     if df_exp_agg.empty or df_q_wide.empty:
         print("\n--- Skipping Correlation Analysis: Aggregated data is empty ---")
         print("Experiment aggregated data (with source) empty:", df_exp_agg.empty)
         print("Questionnaire wide data empty:", df_q_wide.empty)
-        return
+        return correlations
 
     print("\n--- Performing Source-Specific Correlation Analysis ---")
 
@@ -198,7 +198,7 @@ def perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir='plots'):
 
     if df_merged.empty:
         print("Merged data is empty after merging. Skipping correlation.")
-        return
+        return correlations
 
     # Identify column groups
     # Pre-questionnaire columns start with 'pre_', EXCLUDING 'pre_ai_familiarity'
@@ -214,7 +214,7 @@ def perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir='plots'):
         print("Could not identify any source-specific experiment outcome columns (e.g., AI_mean_accuracy). Skipping source-specific correlation plots.")
         if not pre_q_cols and not post_q_cols:
              print("No pre or post questionnaire columns found either.")
-        return
+        return correlations
 
     print(f"Identified sources for correlation: {unique_sources}")
 
@@ -227,6 +227,7 @@ def perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir='plots'):
 
 
     # --- Generate Plots for each Source ---
+    jobs = []
     for source in unique_sources:
         print(f"\nProcessing source: {source}")
 
@@ -246,15 +247,16 @@ def perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir='plots'):
              df_plot_pre = df_merged[plot_cols_pre].select_dtypes(include=[np.number])
              if df_plot_pre.shape[1] > 1:
                  pre_correlation_matrix = df_plot_pre.corr()
+                 correlations[f'{source}_pre'] = pre_correlation_matrix
                  # Create specific title and filename
                  title_pre = f'Correlation Matrix: {source_display_name} Exp. Outcomes and Pre-Exp. Questionnaire'
                  filename_pre = f'{source.lower()}_pre_correlation_heatmap.png' # Use lower case for filenames
                  # Pass the source to the plotting function for label cleaning
-                 _plot_correlation_heatmap(pre_correlation_matrix,
-                                           title_pre,
-                                           filename_pre,
-                                           source_prefix=source, # Pass the source
-                                           output_dir=output_dir)
+                 jobs.append(_correlation_heatmap_job(pre_correlation_matrix,
+                                                      title_pre,
+                                                      filename_pre,
+                                                      source_prefix=source, # Pass the source
+                                                      output_dir=output_dir))
              else:
                  print(f"Not enough numeric variables ({df_plot_pre.shape[1]}) for {source} Pre-experiment correlation plot after selecting numeric types.")
         else:
@@ -267,39 +269,44 @@ def perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir='plots'):
              df_plot_post = df_merged[plot_cols_post].select_dtypes(include=[np.number])
              if df_plot_post.shape[1] > 1:
                  post_correlation_matrix = df_plot_post.corr()
+                 correlations[f'{source}_post'] = post_correlation_matrix
                  # Create specific title and filename
                  title_post = f'Correlation Matrix: {source_display_name} Exp. Outcomes and Post-Exp. Questionnaire'
                  filename_post = f'{source.lower()}_post_correlation_heatmap.png' # Use lower case for filenames
                  # Pass the source to the plotting function for label cleaning
-                 _plot_correlation_heatmap(post_correlation_matrix,
-                                           title_post,
-                                           filename_post,
-                                           source_prefix=source, # Pass the source
-                                           output_dir=output_dir)
+                 jobs.append(_correlation_heatmap_job(post_correlation_matrix,
+                                                      title_post,
+                                                      filename_post,
+                                                      source_prefix=source, # Pass the source
+                                                      output_dir=output_dir))
              else:
                  print(f"Not enough numeric variables ({df_plot_post.shape[1]}) for {source} Post-experiment correlation plot after selecting numeric types.")
         else:
              print(f"Skipping {source} Post-experiment correlation plot: Not enough variables ({len(plot_cols_post)}). Need at least 2 numeric columns.")
 
 
+    render_plots([job for job in jobs if job is not None], plot_jobs)
     print("\nSource-specific correlation analysis complete.")
+    return correlations
 
 
 # Main function to orchestrate integrated analysis
-def analyze_integrated_data(df_experiment, df_questionnaire, output_dir='plots'):
+def analyze_integrated_data(df_experiment, df_questionnaire, output_dir='plots', plot_jobs=1):
      """
      Orchestrates the aggregation of experiment data, wrangling of questionnaire data,
-     and correlation analysis between the two, broken down by experiment source.
+     and correlation analysis between the two, broken down by experiment source,
+     with the heatmaps rendered on `plot_jobs` processes. Returns the correlation matrices (see perform_correlation_analysis).
      """
      if df_experiment is None or df_questionnaire is None:
          print("\n--- Skipping integrated analysis: One or both dataframes are missing ---")
-         return
+         return {}
 
      df_exp_agg = aggregate_experiment_data(df_experiment)
      df_q_wide = wrangle_questionnaire_data(df_questionnaire)
 
      # Only proceed if both aggregated dataframes are valid
      if not df_exp_agg.empty and not df_q_wide.empty:
-        perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir=output_dir)
+        return perform_correlation_analysis(df_exp_agg, df_q_wide, output_dir=output_dir, plot_jobs=plot_jobs)
      else:
-         print("\n--- Skipping correlation analysis due to empty aggregated data ---")
\ No newline at end of file
+         print("\n--- Skipping correlation analysis due to empty aggregated data ---")
+         return {}
\ No newline at end of file
@@ -1,21 +1,86 @@
 # main_analysis.py
 # Import necessary modules
 from .data_handling import load_and_inspect_data, check_data_completeness, create_new_dvs
-from .anova_analysis import perform_mixed_anova, perform_anova_posthoc
-from .bayesian_analysis import analyze_accuracy_bayesian
+from .partitions import QuestionPartitions
+from .anova_analysis import perform_anovas
+from .bayesian_analysis import analyze_accuracy_bayesian, analyze_outcomes_bayesian, fixed_effects_table
+from .bayesian_fitting import BayesianFitCache, CACHE_DIR
 from .descriptive_stats import calculate_descriptive_statistics
 from .plotting import generate_plots
 # Import the new integrated analysis function
 from .integrated_analysis import analyze_integrated_data
 from .questionnaire_analysis import analyze_questionnaire_data
+from .reporting import quiet
+from .results_store import ResultsStore
 import pandas as pd # Keep pandas import
-
-
-def analyze_data():
-    # Load and inspect data - loads both experiment and questionnaire data
+from storage import intermediate_path
+
+# Columns the analysis steps use; the other columns of the files (e.g. the response ids) are not read
+EXPERIMENT_COLUMNS = ['test_slug', 'participant_id', 'response_value', 'length', 'source', 'reaction_time', 'question', 'is_mobile', 'age']
+QUESTIONNAIRE_COLUMNS = ['questionnaire_type', 'participant_id', 'response_value', 'question']
+
+# Bounded outcomes (scores between 0 and 1) fitted with the Bayesian mixed model next to accuracy
+BAYESIAN_OUTCOMES = ['comprehension', 'confidence', 'satisfaction', 'effort', 'general_quality', 'subjective_quality', 'objective_quality']
+
+def analyze_data(data_format='csv', inspect=True, anova_jobs=1, anova_engine='pingouin', n_resamples=0, seed=0,
+                 bayes_cache_dir=CACHE_DIR, descriptive_jobs=1, results_dir=None, results_format='sqlite',
+                 quiet_mode=False, plot_jobs=1, exclude_incomplete=False, bayes_outcomes=BAYESIAN_OUTCOMES,
+                 bayes_strata=None):
+    """
+    Runs the analysis steps and returns their results: a dict with the ANOVA results
+    per DV, the Bayesian diagnostics and fit, the DescriptiveAccumulator, and the
+    questionnaire and correlation tables (None if the experiment data failed to load).
+    With `results_dir`, the result tables are also saved there as a new run of a
+    ResultsStore ('sqlite', or 'parquet' with pyarrow). quiet_mode=True prints nothing and skips
+    formatting the tables for the console. Plots are rendered on `plot_jobs` processes
+    (None: all cores). With exclude_incomplete=True, participants missing 'source'
+    data for a DV are left out of its ANOVA, Bayesian model and plot (otherwise
+    they are only reported). The outcomes in `bayes_outcomes` get the Bayesian
+    mixed model too, per stratum of the `bayes_strata` column (e.g. 'test_slug') if given.
+    """
+    with quiet(quiet_mode):
+        results = _run_analysis(data_format, inspect and not quiet_mode, anova_jobs, anova_engine, n_resamples, seed,
+                                bayes_cache_dir, descriptive_jobs, plot_jobs, exclude_incomplete, bayes_outcomes,
+                                bayes_strata, print_diagnostics=not quiet_mode)
+    if results is not None and results_dir is not None:
+        store = ResultsStore(results_dir, backend=results_format)
+        save_results(store, results)
+        if not quiet_mode:
+            print(f"Saved the analysis results to {results_dir} (run {store.run_id}).")
+    return results
+
+def save_results(store, results):
+    """Saves the result tables returned by analyze_data to a ResultsStore, by step and DV."""
+    for dv, anova in results['anova'].items():
+        store.save('anova', anova['table'], dv)
+        store.save('posthoc', anova['posthoc'], dv)
+        for name, table in (anova.get('resampling') or {}).items():
+            store.save(f'resampling_{name}', table, dv)
+    if results['bayesian_diagnostics'] is not None:
+        store.save('bayesian_groups', results['bayesian_diagnostics'].groups, 'accuracy')
+    if results['bayesian_fit'] is not None:
+        store.save('bayesian_fixed_effects', fixed_effects_table(results['bayesian_fit']).rename_axis('term'), 'accuracy')
+    for (outcome, stratum), fit in results['bayesian_outcomes'].items():
+        if not isinstance(fit, Exception):
+            store.save('bayesian_outcome_fixed_effects', fixed_effects_table(fit).rename_axis('term'),
+                       outcome if stratum is None else f"{outcome}_{stratum}")
+    for name, table in results['descriptives'].tables().items():
+        store.save(f'descriptives_{name}', table)
+    for name, table in results['questionnaire'].items():
+        store.save(f'questionnaire_{name}', table)
+    for name, matrix in results['correlations'].items():
+        store.save('correlations', matrix.rename_axis('variable'), name)
+
+def _run_analysis(data_format, inspect, anova_jobs, anova_engine, n_resamples, seed, bayes_cache_dir, descriptive_jobs,
+                  plot_jobs, exclude_incomplete=False, bayes_outcomes=(), bayes_strata=None, print_diagnostics=True):
+    # Load and inspect data - loads the used columns of the experiment and questionnaire data ('csv' or 'parquet')
+    # With inspect=False the first rows and info of each table are not printed
     df_experiment, df_questionnaire = load_and_inspect_data(
-        experiment_file='data/test_data_evaluated.csv',
-        questionnaire_file='data/questionnaire_data_wrangled.csv'
+        experiment_file=intermediate_path('test_data_evaluated', data_format),
+        questionnaire_file=intermediate_path('questionnaire_data_wrangled', data_format),
+        experiment_columns=EXPERIMENT_COLUMNS,
+        questionnaire_columns=QUESTIONNAIRE_COLUMNS,
+        inspect=inspect
     )
 
     # Check if experiment data loaded successfully, essential
@@ -24,7 +89,7 @@ def analyze_data():
 
         if df_questionnaire is not None:
              print("However, questionnaire data loaded. You could add code here for standalone questionnaire analysis if needed.")
-        return
+        return None
 
     # Warn if questionnaire data is missing, but allow experiment analysis to proceed
     if df_questionnaire is None:
@@ -34,41 +99,59 @@ def analyze_data():
     # --- Analyze Experiment Data (Existing Logic) ---
     print("\n--- Analyzing Experiment Data ---")
 
-    # Check data completeness for ANOVA - this uses df_experiment
-    participants_to_exclude = check_data_completeness(df_experiment)
-
     # Make 3 new dep variables = General Quality, Objective Quality (accuracy + comprehension), Subjective Quality (confidence, satisfaction, effort)
     df_experiment = create_new_dvs(df_experiment)
 
+    # Check data completeness once, for all DVs - the index is reused by the ANOVA, Bayesian model and plots
+    completeness = check_data_completeness(df_experiment)
+
+    # Group the rows by DV once - the ANOVA, Bayesian model and plots read each DV's rows as a slice
+    partitions = QuestionPartitions(df_experiment)
+
     # Define dependent variables for ANOVA (these are 'question' values in df_experiment)
     dependent_vars_anova = ['confidence', 'comprehension', 'satisfaction', 'effort', 'reaction_time', 'general_quality', 'subjective_quality', 'objective_quality'] # Ensure these match your data
-    anova_results = {}
-    for dv in dependent_vars_anova:
-        # Pass df_experiment to the ANOVA function
-        aov_table, df_anova = perform_mixed_anova(df_experiment, dv)
-        anova_results[dv] = {'table': aov_table, 'data': df_anova}
-        if aov_table is not None and df_anova is not None:
-            perform_anova_posthoc(aov_table, df_anova, dv)
-        else:
-            print(f"WARNING: ANOVA tables for {dv} are none.")
+    # Mixed ANOVA and post-hoc tests per DV, on `anova_jobs` processes (1: in this process, None: all cores)
+    # anova_engine='batched' computes all ANOVA tables at once with NumPy instead of pingouin per DV
+    # n_resamples > 0 adds permutation p-values and bootstrap CIs (reproducible with `seed`)
+    # exclude_incomplete=True drops participants missing 'source' data for a DV from its ANOVA, Bayesian model and plot
+    anova_results = perform_anovas(partitions, dependent_vars_anova, completeness, exclude_incomplete, n_jobs=anova_jobs,
+                                   engine=anova_engine, n_resamples=n_resamples, seed=seed)
 
     # Analyze accuracy using Bayesian mixed-effects logistic regression (on experiment data)
-    analyze_accuracy_bayesian(df_experiment) # Pass df_experiment
+    # Fitted posteriors are cached in `bayes_cache_dir` (None to always refit)
+    bayes_cache = BayesianFitCache(bayes_cache_dir)
+    bayesian_diagnostics, bayesian_fit = analyze_accuracy_bayesian(partitions, completeness, exclude_incomplete,
+                                                                   cache=bayes_cache, print_diagnostics=print_diagnostics)
+    # The same model for the other bounded outcomes (fractional logit), warm started from the fits before and cached
+    bayesian_outcomes = analyze_outcomes_bayesian(partitions, bayes_outcomes, bayes_strata, cache=bayes_cache,
+                                                  completeness=completeness, exclude_incomplete=exclude_incomplete)
 
     # Calculate descriptive statistics (primarily for experiment data structure and ANOVAs)
-    calculate_descriptive_statistics(df_experiment, anova_results) # Pass df_experiment
+    # Accumulated over row shards on `descriptive_jobs` processes and merged (see accumulators.py)
+    descriptives = calculate_descriptive_statistics(df_experiment, anova_results, n_jobs=descriptive_jobs) # Pass df_experiment
 
     # Generate plots (primarily for experiment data DVs and Decision Quality)
-    generate_plots(df_experiment) # Pass df_experiment
+    generate_plots(partitions, completeness=completeness, exclude_incomplete=exclude_incomplete, n_jobs=plot_jobs)
 
     # --- Integrated Analysis (Experiment Outcomes & Questionnaire Responses) ---
     # Perform analysis combining experiment and questionnaire data, including correlation
+    correlations, questionnaire = {}, {}
     if df_questionnaire is not None: # Only run integrated analysis if questionnaire data loaded
-         analyze_integrated_data(df_experiment, df_questionnaire)
-         analyze_questionnaire_data(df_questionnaire, df_experiment)
+         correlations = analyze_integrated_data(df_experiment, df_questionnaire, plot_jobs=plot_jobs)
+         questionnaire = analyze_questionnaire_data(df_questionnaire, df_experiment, plot_jobs=plot_jobs)
     else:
          print("\nSkipping integrated analysis due to missing questionnaire data.")
 
+    return {
+        'anova': anova_results,
+        'bayesian_diagnostics': bayesian_diagnostics,
+        'bayesian_fit': bayesian_fit,
+        'bayesian_outcomes': bayesian_outcomes,
+        'descriptives': descriptives,
+        'correlations': correlations,
+        'questionnaire': questionnaire,
+    }
+
 
 if __name__ == "__main__":
     analyze_data()
\ No newline at end of file
@@ -0,0 +1,190 @@
+# mixed_anova.py
+
+# Mixed-design ANOVA with one within factor (source) and one between factor
+# (length), computed for a whole stack of DVs at once with NumPy. It gives the
+# same table as pingouin.mixed_anova (with its default correction='auto' and
+# effsize='np2'), including the Greenhouse-Geisser epsilon and Mauchly's test,
+# without rebuilding pingouin's long-format tables per DV.
+#
+# The tables are checked against pingouin on the bundled data in
+# tests/test_mixed_anova.py.
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Columns of the ANOVA table, in pingouin's order (optional ones are dropped when empty)
+TABLE_COLUMNS = ['Source', 'SS', 'DF1', 'DF2', 'MS', 'F', 'p-unc', 'p-GG-corr', 'np2', 'eps', 'sphericity', 'W-spher', 'p-spher']
+
+def batched_mixed_anova(Y, valid, between_codes, n_groups, alpha=0.05):
+    """
+    Mixed ANOVA statistics for a stack of DVs sharing the same within levels.
+
+    Args:
+        Y: array (n_dvs, n_subjects, n_within) of each subject's mean per within level.
+        valid: boolean array (n_dvs, n_subjects), True for the subjects with data
+            for every within level of that DV (complete cases, as pingouin uses).
+        between_codes: int array (n_subjects,) of each subject's between level.
+        n_groups: number of between levels.
+        alpha: significance level of Mauchly's test of sphericity.
+
+    Returns:
+        dict of arrays of shape (n_dvs,) per statistic.
+    """
+    m, n, k = Y.shape
+    w = valid.astype(float)
+    Y = np.where(valid[:, :, np.newaxis], Y, 0.0)
+    H = np.eye(n_groups)[between_codes] # Subject x between level indicator
+
+    N = w.sum(axis=1)
+    n_per_group = w @ H
+    groups = (n_per_group > 0).sum(axis=1)
+    grand_mean = Y.sum(axis=(1, 2)) / (N * k)
+
+    # Means per within level, per subject, per between level and per cell
+    col_mean = Y.sum(axis=1) / N[:, np.newaxis]
+    subject_mean = Y.mean(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        group_mean = np.einsum('mn,ng->mg', subject_mean * w, H) / n_per_group
+        cell_mean = np.einsum('mnk,ng->mgk', Y, H) / n_per_group[:, :, np.newaxis]
+    cell_mean = np.nan_to_num(cell_mean)[:, between_codes, :]
+
+    # Sums of squares, split as in pingouin.mixed_anova
+    ss_total = (w[:, :, np.newaxis] * (Y - grand_mean[:, np.newaxis, np.newaxis]) ** 2).sum(axis=(1, 2))
+    ss_with = N * ((col_mean - grand_mean[:, np.newaxis]) ** 2).sum(axis=1)
+    ss_betw = (k * n_per_group * np.nan_to_num(group_mean - grand_mean[:, np.newaxis]) ** 2).sum(axis=1)
+    ss_resall = (w[:, :, np.newaxis] * (Y - cell_mean) ** 2).sum(axis=(1, 2))
+    # Error term of the repeated measures ANOVA on the within factor alone
+    ss_resall_rm = (w[:, :, np.newaxis] * (Y - col_mean[:, np.newaxis, :]) ** 2).sum(axis=(1, 2))
+    ss_reswith_rm = ss_resall_rm - k * (w * (subject_mean - grand_mean[:, np.newaxis]) ** 2).sum(axis=1)
+
+    ss_inter = ss_total - (ss_resall + ss_with + ss_betw)
+    ss_reswith = ss_reswith_rm - ss_inter
+    ss_resbetw = ss_total - (ss_with + ss_betw + ss_reswith + ss_inter)
+
+    # Degrees of freedom, mean squares, F, p and partial eta-squared
+    df_with = np.full(m, k - 1)
+    df_betw = groups - 1
+    df_resbetw = N - groups
+    df_reswith = df_with * df_resbetw
+    df_inter = df_with * df_betw
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ms_with, ms_betw, ms_inter = ss_with / df_with, ss_betw / df_betw, ss_inter / df_inter
+        ms_resbetw, ms_reswith = ss_resbetw / df_resbetw, ss_reswith / df_reswith
+        f_betw, f_with, f_inter = ms_betw / ms_resbetw, ms_with / ms_reswith, ms_inter / ms_reswith
+
+    results = {
+        'ss_betw': ss_betw, 'ss_with': ss_with, 'ss_inter': ss_inter,
+        'df_betw': df_betw, 'df_with': df_with, 'df_inter': df_inter,
+        'df_resbetw': df_resbetw, 'df_reswith': df_reswith,
+        'ms_betw': ms_betw, 'ms_with': ms_with, 'ms_inter': ms_inter,
+        'f_betw': f_betw, 'f_with': f_with, 'f_inter': f_inter,
+        'p_betw': stats.f.sf(f_betw, df_betw, df_resbetw),
+        'p_with': stats.f.sf(f_with, df_with, df_reswith),
+        'p_inter': stats.f.sf(f_inter, df_inter, df_reswith),
+        'np2_betw': ss_betw / (ss_betw + ss_resbetw),
+        'np2_with': ss_with / (ss_with + ss_reswith),
+        'np2_inter': ss_inter / (ss_inter + ss_reswith),
+    }
+    results.update(_sphericity(Y, w, col_mean, N, ss_with, ss_reswith_rm, alpha))
+    return results
+
+def _sphericity(Y, w, col_mean, N, ss_with, ss_reswith_rm, alpha):
+    """Greenhouse-Geisser epsilon, Mauchly's test and the corrected p-value per DV, as pingouin's rm_anova."""
+    m, n, k = Y.shape
+    centered = (Y - col_mean[:, np.newaxis, :]) * w[:, :, np.newaxis]
+    S = np.einsum('mnk,mnl->mkl', centered, centered) / (N - 1)[:, np.newaxis, np.newaxis]
+
+    if k <= 2:
+        # Sphericity always holds with two within levels
+        nan = np.full(m, np.nan)
+        return {'eps': np.ones(m), 'spher': np.ones(m, dtype=bool), 'W_spher': nan, 'p_spher': np.ones(m), 'p_gg': nan}
+
+    # Greenhouse-Geisser epsilon (sums of squares method)
+    mean_var = np.trace(S, axis1=1, axis2=2) / k
+    S_mean = S.mean(axis=(1, 2))
+    ss_mat = (S ** 2).sum(axis=(1, 2))
+    ss_rows = (S.mean(axis=2) ** 2).sum(axis=1)
+    eps = np.minimum((k * (mean_var - S_mean)) ** 2 / ((k - 1) * (ss_mat - 2 * k * ss_rows + k ** 2 * S_mean ** 2)), 1)
+
+    # Mauchly's test, eigenvalue method
+    d = k - 1
+    S_pop = S - S.mean(axis=1)[:, :, np.newaxis] - S.mean(axis=2)[:, np.newaxis, :] + S_mean[:, np.newaxis, np.newaxis]
+    eig = np.linalg.eigvalsh(S_pop)[:, 1:]
+    kept = eig > 0.001
+    W = np.where(kept, eig, 1.0).prod(axis=1) / (np.where(kept, eig, 0.0).sum(axis=1) / d) ** d
+    ddof = max(d * (d + 1) / 2 - 1, 1)
+    f = 1 - (2 * d ** 2 + d + 2) / (6 * d * (N - 1))
+    w2 = (d + 2) * (d - 1) * (d - 2) * (2 * d ** 3 + 6 * d ** 2 + 3 * k + 2) / (288 * ((N - 1) * d * f) ** 2)
+    chi_sq = -(N - 1) * f * np.log(W)
+    p1, p2 = stats.chi2.sf(chi_sq, ddof), stats.chi2.sf(chi_sq, ddof + 4)
+    p_spher = p1 + w2 * (p2 - p1)
+    spher = p_spher > alpha
+
+    # Greenhouse-Geisser corrected p-value of the repeated measures F (only reported without sphericity)
+    f_rm = (ss_with / d) / (ss_reswith_rm / (d * (N - 1)))
+    p_gg = stats.f.sf(f_rm, np.maximum(d * eps, 1.0), np.maximum(d * (N - 1) * eps, 1.0))
+    return {'eps': eps, 'spher': spher, 'W_spher': W, 'p_spher': p_spher, 'p_gg': np.where(spher, np.nan, p_gg)}
+
+def _anova_table(results, i, within, between):
+    """The ANOVA table of the i-th DV of batched_mixed_anova's results, laid out as pingouin.mixed_anova's."""
+    r = {key: values[i] for key, values in results.items()}
+    corrected = not r['spher']
+    table = pd.DataFrame({
+        'Source': [between, within, 'Interaction'],
+        'SS': [r['ss_betw'], r['ss_with'], r['ss_inter']],
+        'DF1': [int(r['df_betw']), int(r['df_with']), int(r['df_inter'])],
+        'DF2': [int(r['df_resbetw']), int(r['df_reswith']), int(r['df_reswith'])],
+        'MS': [r['ms_betw'], r['ms_with'], r['ms_inter']],
+        'F': [r['f_betw'], r['f_with'], r['f_inter']],
+        'p-unc': [r['p_betw'], r['p_with'], r['p_inter']],
+        'p-GG-corr': [np.nan, r['p_gg'], np.nan] if corrected else np.nan,
+        'np2': [r['np2_betw'], r['np2_with'], r['np2_inter']],
+        'eps': [np.nan, r['eps'], np.nan],
+        'sphericity': [np.nan, r['spher'], np.nan] if corrected else np.nan,
+        'W-spher': [np.nan, r['W_spher'], np.nan] if corrected else np.nan,
+        'p-spher': [np.nan, r['p_spher'], np.nan] if corrected else np.nan,
+    }, columns=TABLE_COLUMNS)
+    return table.dropna(how='all', axis=1)
+
+def wide_design(df_dv, dv_column='response_value', within='source', between='length', subject='participant_code'):
+    """
+    One DV's rows in wide format: each complete-case subject's mean per within level.
+
+    Returns:
+        Y: array (n_subjects, n_within), between_codes: array (n_subjects,),
+        and the between and within levels (the codes index the between levels)
+    """
+    wide = df_dv.pivot_table(index=[subject, between], columns=within, values=dv_column, aggfunc='mean', observed=True).dropna()
+    if wide.index.get_level_values(0).duplicated().any():
+        raise ValueError(f"Subject IDs cannot overlap between groups: each subject must be in one `{between}` group")
+    between_codes, between_levels = pd.factorize(wide.index.get_level_values(1), sort=True)
+    return wide.to_numpy(dtype=float), between_codes, list(between_levels), list(wide.columns)
+
+def mixed_anova_tables(df, dvs, dv_column='response_value', within='source', between='length', subject='participant_code'):
+    """
+    Mixed ANOVA tables for every DV in `dvs`, from long-format rows with a 'question'
+    column naming the DV. DVs with the same within levels are computed in one batch.
+
+    Returns:
+        dict of DV -> ANOVA table (DVs without data are left out)
+    """
+    df = df[df['question'].isin(dvs)]
+    # Each subject's mean per DV and within level, as pingouin's pivot_table
+    wide = df.pivot_table(index=[subject, between], columns=['question', within], values=dv_column, aggfunc='mean', observed=True)
+    if wide.index.get_level_values(0).duplicated().any():
+        raise ValueError(f"Subject IDs cannot overlap between groups: each subject must be in one `{between}` group")
+    between_codes, between_levels = pd.factorize(wide.index.get_level_values(1), sort=True)
+
+    # Batch the DVs by their within levels
+    levels_per_dv = {dv: tuple(wide[dv].columns) for dv in dvs if dv in wide.columns.get_level_values(0)}
+    tables = {}
+    for levels in dict.fromkeys(levels_per_dv.values()):
+        batch = [dv for dv, dv_levels in levels_per_dv.items() if dv_levels == levels]
+        Y = np.stack([wide[dv][list(levels)].to_numpy(dtype=float) for dv in batch])
+        valid = ~np.isnan(Y).any(axis=2)
+        results = batched_mixed_anova(Y, valid, between_codes, len(between_levels))
+        for i, dv in enumerate(batch):
+            tables[dv] = _anova_table(results, i, within, between)
+    return {dv: tables[dv] for dv in dvs if dv in tables}
@@ -0,0 +1,38 @@
+# partitions.py
+import numpy as np
+
+class QuestionPartitions:
+    """
+    The experiment data grouped by 'question' once: the frame is reordered so
+    that each question's rows are contiguous (keeping their original order and
+    index), and each DV's rows are handed out as an iloc slice of it, without
+    scanning or copying the full frame again.
+
+    The slices are views, so callers that modify them should copy first (e.g.
+    through rename, which returns a new frame).
+    """
+    def __init__(self, df):
+        codes = df['question'].cat.codes.to_numpy()
+        order = np.argsort(codes, kind='stable')
+        self.frame = df.take(order)
+
+        questions = df['question'].cat.categories
+        bounds = np.searchsorted(codes[order], np.arange(len(questions) + 1))
+        self._slices = {question: slice(bounds[i], bounds[i + 1]) for i, question in enumerate(questions)}
+
+    def __contains__(self, question):
+        return question in self._slices
+
+    def rows(self, question):
+        """The rows of `question` (empty if there are none), as a slice of the partitioned frame."""
+        return self.frame.iloc[self._slices.get(question, slice(0, 0))]
+
+def question_rows(data, question):
+    """The rows of `question` from QuestionPartitions or a plain experiment DataFrame (not copied)."""
+    if isinstance(data, QuestionPartitions):
+        return data.rows(question)
+    return data[data['question'] == question]
+
+def full_frame(data):
+    """All experiment rows of QuestionPartitions or a plain DataFrame."""
+    return data.frame if isinstance(data, QuestionPartitions) else data
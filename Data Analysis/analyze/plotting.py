@@ -1,16 +1,91 @@
-import pandas as pd
+import numpy as np
 import seaborn as sns
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
+import matplotlib as mpl
 import os
+from .partitions import full_frame
+from .rendering import render_plots
 
-def generate_plots(df, output_dir='plots'):
+# Style of the standard error bars: colour and width of seaborn's error bars, caps in points
+ERRORBAR_STYLE = {'ecolor': '.26', 'capsize': 8}
+
+def bar_plot_table(df, completeness=None, exclude_incomplete=False):
+    """
+    Mean, standard error and n of 'response_value' per DV ('question') x source x
+    length, in one grouped pass over the experiment DataFrame or its QuestionPartitions.
+    With exclude_incomplete=True, participants missing 'source' data for a DV (per
+    the CompletenessIndex `completeness`) are left out of that DV's groups.
+    """
+    rows = full_frame(df)
+    if exclude_incomplete and completeness is not None:
+        rows = rows[completeness.mask(rows)]
+    table = (rows.groupby(['question', 'source', 'length'], observed=True)['response_value']
+             .agg(['mean', 'std', 'count']).reset_index())
+    # Standard error as sns.barplot(errorbar='se') computes it (undefined for a single value)
+    table['se'] = table['std'] / np.sqrt(table['count'])
+    return table[['question', 'source', 'length', 'mean', 'se', 'count']]
+
+def _draw_dv_barplot(fig, summary, y_label, plot_title_dv, source_order, length_order, palette,
+                     source_display_labels, length_display_labels):
+    """
+    Draws the bar plot of one DV by source and length from its rows of bar_plot_table
+    (a plot job, see rendering.py): the bars through sns.barplot, and the standard
+    errors with ax.errorbar at the centre and height of each drawn bar.
+    """
+    ax = fig.subplots()
+    sns.barplot(data=summary, x='source', y='mean', hue='length', errorbar=None,
+                order=source_order, hue_order=length_order, palette=palette, ax=ax)
+
+    # One bar container per length (in hue order, empty for lengths without data in some seaborn
+    # versions, left out in others), each bar's source is the x tick it is drawn at
+    se = summary.set_index(['source', 'length'])['se']
+    tick_sources = [label.get_text() for label in ax.get_xticklabels()]
+    lengths = length_order if len(ax.containers) == len(length_order) else \
+        [length for length in length_order if length in set(summary['length'])]
+    centers, heights, errors = [], [], []
+    for length, container in zip(lengths, ax.containers):
+        for bar in container:
+            center = bar.get_x() + bar.get_width() / 2
+            key = (tick_sources[int(np.argmin(np.abs(ax.get_xticks() - center)))], length)
+            if key in se.index and not np.isnan(se[key]):
+                centers.append(center)
+                heights.append(bar.get_height())
+                errors.append(se[key])
+
+    # sns.barplot fixes the categorical axis to the sources, the error bars must not widen it
+    xlim = ax.get_xlim()
+    linewidth = 1.5 * mpl.rcParams['lines.linewidth']
+    ax.errorbar(centers, heights, yerr=errors, fmt='none', elinewidth=linewidth, capthick=linewidth, **ERRORBAR_STYLE)
+    ax.set_xlim(xlim)
+
+    ax.set_title(f'Mean {plot_title_dv} by Source and Length')
+    ax.set_xlabel('Microcontent Source')
+    ax.set_ylabel(y_label)
+
+    # Capitalize source labels on x-axis
+    ax.set_xticklabels(source_display_labels)
+
+    # Modify the legend call
+    handles, labels = ax.get_legend_handles_labels()
+    new_labels = [length_display_labels[length_order.index(label)] for label in labels]
+
+    ax.legend(handles, new_labels, title='Length') # Use the new_labels here
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    fig.tight_layout()
+
+def generate_plots(df, output_dir='plots', completeness=None, exclude_incomplete=False, n_jobs=1):
     """
     Generates bar plots for each dependent variable, reaction time,
-    and a combined Decision Quality metric.
+    and a combined Decision Quality metric, from `df`, the experiment
+    DataFrame or its QuestionPartitions.
+    Participants missing 'source' data for a DV (per the CompletenessIndex
+    `completeness`, if given) are reported, or left out of its plot with exclude_incomplete=True.
+    The plots are rendered on `n_jobs` processes (None: all cores), see rendering.py.
+    Returns the (path, error) of each rendered plot.
     """
     print("\n--- Generating Plots ---") # Print message
-    rcParams['font.family'] = 'Times New Roman'
+
+    # Means, standard errors and counts of all DVs, the plots are drawn from this table
+    summaries = bar_plot_table(df, completeness, exclude_incomplete)
     
     # Dependent variables to plot individually
     dv_order_plot_individual = ['accuracy', 'comprehension', 'confidence', 'satisfaction', 'effort', 'general_quality', 'subjective_quality', 'objective_quality', 'reaction_time']
@@ -31,61 +106,39 @@ def generate_plots(df, output_dir='plots'):
     # --- Generate DV Plots ---
     print("\n--- Generating Dependent Variable Plots ---")
     
+    jobs = []
     for dv_plot in dv_order_plot_individual:
-        fig, ax = plt.subplots(figsize=(8, 6))
-        plot_data = pd.DataFrame()
-        y_column = None
         y_label = ''
         plot_title_dv = ''
         filename_dv = dv_plot
 
         if dv_plot == 'accuracy':
-            # Ensure only the 'accuracy' question rows are selected
-            plot_data = df[df['question'] == 'accuracy'].copy()
-            y_column = 'response_value' 
             y_label = 'Proportion Correct (Accuracy)'
             plot_title_dv = 'Accuracy'
         elif dv_plot in ['confidence', 'comprehension', 'satisfaction', 'effort', 'general_quality', 'objective_quality', 'subjective_quality']:
-            plot_data = df[df['question'] == dv_plot].copy()
-            y_column = 'response_value' # These are ratings on a scale
+            # These are ratings on a scale
             y_label = f'Mean {dv_plot.replace("_", " ").title()} Rating'
             plot_title_dv = dv_plot.replace("_", " ").title()
         elif dv_plot == 'reaction_time':
-            # Ensure only the 'accuracy' question rows are selected
-            plot_data = df[df['question'] == 'reaction_time'].copy()
-            y_column = 'response_value'
             y_label = 'Average Reaction Time (ms)'
             plot_title_dv = 'Reaction Time'
         else:
             print(f"Skipping plotting for unknown DV: {dv_plot}")
-            plt.close(fig)
             continue # Skip to the next iteration
 
-        # Check if necessary columns exist before plotting
-        required_cols = [y_column, 'source', 'length']
-        if not plot_data.empty and all(col in plot_data.columns for col in required_cols):
+        summary = summaries[summaries['question'] == dv_plot]
+        if completeness is not None and not summary.empty and completeness.incomplete_participants(dv_plot):
+            print(f"Note: {len(completeness.incomplete_participants(dv_plot))} participant(s) missing 'source' data for {plot_title_dv}"
+                  + (", excluded from the plot." if exclude_incomplete else "."))
+
+        if not summary.empty:
             print(f"Generating plot for: {plot_title_dv}")
-            sns.barplot(data=plot_data, x='source', y=y_column, hue='length', errorbar='se', capsize=0.1,
-                        order=source_order, hue_order=length_order, palette=custom_palette, ax=ax)
-            
-            ax.set_title(f'Mean {plot_title_dv} by Source and Length')
-            ax.set_xlabel('Microcontent Source')
-            ax.set_ylabel(y_label)
-            
-            # Capitalize source labels on x-axis
-            ax.set_xticklabels(source_display_labels)
-            
-            # Modify the legend call
-            handles, labels = ax.get_legend_handles_labels()
-            new_labels = [length_display_labels[length_order.index(label)] for label in labels]
-
-            ax.legend(handles, new_labels, title='Length') # Use the new_labels here
-            ax.grid(axis='y', linestyle='--', alpha=0.7)
-            plt.tight_layout()
-            filename = os.path.join(output_dir, f'{filename_dv}_barplot.png')
-            plt.savefig(filename, dpi=300)
-            print(f"Saved plot to: {filename}")
-            plt.close(fig) # Close plot to free memory
+            jobs.append((_draw_dv_barplot,
+                         dict(summary=summary, y_label=y_label, plot_title_dv=plot_title_dv,
+                              source_order=source_order, length_order=length_order, palette=custom_palette,
+                              source_display_labels=source_display_labels, length_display_labels=length_display_labels),
+                         os.path.join(output_dir, f'{filename_dv}_barplot.png'), (8, 6)))
         else:
-            print(f"Skipping plot for {plot_title_dv} due to missing data or columns.")
-            plt.close(fig)
\ No newline at end of file
+            print(f"Skipping plot for {plot_title_dv} due to missing data.")
+
+    return render_plots(jobs, n_jobs)
\ No newline at end of file
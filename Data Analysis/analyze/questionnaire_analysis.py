@@ -1,24 +1,46 @@
 # questionnaire_analysis.py
 import pandas as pd
 import seaborn as sns
-import matplotlib.pyplot as plt
 import os
-from matplotlib import rcParams
 import pingouin as pg 
-
-def analyze_questionnaire_data(df_questionnaire, df_experiment=None, output_dir='plots'):
+from .reporting import print_table
+from .rendering import render_plots
+
+def _draw_questionnaire_barplot(fig, df_plot_type, q_type, color):
+    """Draws the mean response per question of one questionnaire type (a plot job, see rendering.py)."""
+    ax = fig.subplots()
+
+    # Use question as x-axis, mean response_value as y-axis
+    # Simple bar plot for each question within the type
+    sns.barplot(data=df_plot_type, x='question', y='response_value', ax=ax, color=color)
+
+    ax.set_title(f'Mean Responses for {q_type.capitalize()} Questionnaire')
+    ax.set_xlabel('Question')
+    ax.set_ylabel('Mean Response Value')
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    for label in ax.get_xticklabels(): # Rotate labels if they overlap
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+    fig.tight_layout()
+
+def analyze_questionnaire_data(df_questionnaire, df_experiment=None, output_dir='plots', plot_jobs=1):
     """
     Analyzes questionnaire data: calculates descriptive statistics and generates plots.
     Optionally takes df_experiment for potential linking (e.g., comparing post-exp
     data by experimental group), including additional analysis for significant
     group differences in pre and post questionnaires, indicating the direction
-    of significant differences.
+    of significant differences. The plots are rendered on `plot_jobs` processes
+    (None: all cores), see rendering.py.
+
+    Returns:
+        dict of result tables: 'descriptives' (mean and std per questionnaire type
+        and question) and 'ttests_pre' / 'ttests_post' when t-tests were run.
     """
     print("\n--- Analyzing Questionnaire Data ---")
 
     if df_questionnaire is None or df_questionnaire.empty:
         print("No questionnaire data provided or loaded. Skipping analysis.")
-        return
+        return {}
 
     # Ensure response_value is numeric, coercing errors will turn non-numeric into NaN
     df_questionnaire['response_value'] = pd.to_numeric(df_questionnaire['response_value'], errors='coerce')
@@ -27,19 +49,19 @@ def analyze_questionnaire_data(df_questionnaire, df_experiment=None, output_dir=
 
     if df_questionnaire.empty:
         print("Questionnaire data is empty after cleaning. Skipping analysis.")
-        return
+        return {}
 
     # Calculate Descriptive Statistics for Questionnaire Data
     print("\nDescriptive Statistics for Questionnaire Responses (Mean & Std Dev):")
     descriptive_stats_q = df_questionnaire.groupby(['questionnaire_type', 'question'])['response_value'].agg(['mean', 'std'])
+    results = {'descriptives': descriptive_stats_q.reset_index()}
     # Unstack to have questionnaire_type as columns for easier comparison
     descriptive_stats_q_unstacked = descriptive_stats_q.unstack('questionnaire_type')
-    print(descriptive_stats_q_unstacked.to_markdown(numalign="left", stralign="left"))
+    print_table(descriptive_stats_q_unstacked)
 
 
     # --- Generate Plots for Questionnaire Data ---
     print("\n--- Generating Questionnaire Plots ---")
-    rcParams['font.family'] = 'Times New Roman' # Use consistent styling
 
     # Ensure output directory exists
     if not os.path.exists(output_dir):
@@ -62,32 +84,15 @@ def analyze_questionnaire_data(df_questionnaire, df_experiment=None, output_dir=
         # Define a simple color palette for pre/post
         q_palette = {'pre': 'steelblue', 'post': 'indianred'} # Example colors
 
+        jobs = []
         for q_type in unique_types:
             df_plot_type = mean_responses[mean_responses['questionnaire_type'] == q_type].copy()
             if df_plot_type.empty:
                 continue
-
-            fig, ax = plt.subplots(figsize=(10, 6)) # Adjust size as needed
-
-            # Use question as x-axis, mean response_value as y-axis
-            # Simple bar plot for each question within the type
-            sns.barplot(data=df_plot_type, x='question', y='response_value', ax=ax, color=q_palette.get(q_type, 'gray')) # Use color from palette
-
-            ax.set_title(f'Mean Responses for {q_type.capitalize()} Questionnaire')
-            ax.set_xlabel('Question')
-            ax.set_ylabel('Mean Response Value')
-            ax.grid(axis='y', linestyle='--', alpha=0.7)
-            plt.xticks(rotation=45, ha='right') # Rotate labels if they overlap
-            plt.tight_layout()
-
-            filename = os.path.join(output_dir, f'{q_type}_questionnaire_means_barplot.png')
-            try:
-                plt.savefig(filename, dpi=300)
-                print(f"Saved plot to: {filename}")
-            except Exception as e:
-                print(f"Error saving plot {filename}: {e}")
-            finally:
-                plt.close(fig) # Close plot to free memory
+            jobs.append((_draw_questionnaire_barplot,
+                         dict(df_plot_type=df_plot_type, q_type=q_type, color=q_palette.get(q_type, 'gray')), # Use color from palette
+                         os.path.join(output_dir, f'{q_type}_questionnaire_means_barplot.png'), (10, 6))) # Adjust size as needed
+        render_plots(jobs, plot_jobs)
 
 
     # --- Aanalysis comparing PRE-EXPERIMENT questions by experiment group ---
@@ -161,8 +166,9 @@ def analyze_questionnaire_data(df_questionnaire, df_experiment=None, output_dir=
                     # Reorder columns for readability
                     cols = ['Question'] + [col for col in all_ttest_results.columns if col != 'Question']
                     all_ttest_results = all_ttest_results[cols]
+                    results['ttests_pre'] = all_ttest_results
                     print("\nSummary of Independent t-tests (Pre-Experiment):")
-                    print(all_ttest_results.to_markdown(index=False, numalign="left", stralign="left"))
+                    print_table(all_ttest_results, index=False)
                 else:
                     print("No t-tests could be performed for pre-experiment questions with sufficient data.")
 
@@ -238,7 +244,10 @@ def analyze_questionnaire_data(df_questionnaire, df_experiment=None, output_dir=
                     # Reorder columns for readability
                     cols = ['Question'] + [col for col in all_ttest_results.columns if col != 'Question']
                     all_ttest_results = all_ttest_results[cols]
+                    results['ttests_post'] = all_ttest_results
                     print("\nSummary of Independent t-tests (Post-Experiment):")
-                    print(all_ttest_results.to_markdown(index=False, numalign="left", stralign="left"))
+                    print_table(all_ttest_results, index=False)
                 else:
-                    print("No t-tests could be performed for post-experiment questions with sufficient data.")
\ No newline at end of file
+                    print("No t-tests could be performed for post-experiment questions with sufficient data.")
+
+    return results
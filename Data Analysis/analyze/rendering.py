@@ -0,0 +1,164 @@
+# rendering.py
+
+# Rendering of the analysis plots. The plotting code builds a list of plot
+# jobs, (draw_function, kwargs, path, figsize) tuples, and render_plots draws
+# them, on a process pool if asked:
+# - Headless: figures are matplotlib Figure objects on an Agg canvas, not
+#   pyplot figures, so no GUI backend or global pyplot state is involved.
+# - Atomic: each file is written to a temporary file next to it and renamed,
+#   so an interrupted run never leaves a truncated image behind.
+# - Incremental: each plot is keyed by a hash of its inputs (the job's data
+#   and styling arguments, figure size, DPI and font) and of the plotting code
+#   (the draw function's module, this module, matplotlib and seaborn versions).
+#   The keys are kept in a manifest next to the output directory, e.g.
+#   plots.manifest.json for plots/, and plots whose key is unchanged are not
+#   redrawn. Delete the manifest (or pass force=True) to redraw everything.
+#
+# draw_function(fig, **kwargs) draws on the figure; it must be a module-level
+# function (and kwargs picklable) for the process pool.
+
+import hashlib
+import inspect
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib import rcParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Styling shared by all plots
+FONT_FAMILY = 'Times New Roman'
+DPI = 300
+
+# Manifest of plot keys, next to the output directory: <output_dir>.manifest.json
+MANIFEST_SUFFIX = '.manifest.json'
+
+def _update_hash(h, value):
+    """Feeds `value` (DataFrames, Series, arrays, containers and plain values) into the hash `h`."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        h.update(json.dumps([list(map(str, frame.columns)), list(map(str, frame.dtypes)), list(map(str, frame.index))]).encode())
+        for col in frame.columns:
+            # The categories (including unused ones) set the order of categorical axes
+            if isinstance(frame[col].dtype, pd.CategoricalDtype):
+                h.update(json.dumps(list(map(str, frame[col].cat.categories))).encode())
+        h.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        h.update(json.dumps([str(value.dtype), value.shape]).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        h.update(b'{')
+        for key in sorted(value, key=str):
+            h.update(json.dumps(str(key)).encode())
+            _update_hash(h, value[key])
+        h.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        h.update(b'[')
+        for item in value:
+            _update_hash(h, item)
+        h.update(b']')
+    else:
+        h.update(json.dumps(repr(value)).encode())
+
+def plot_key(job):
+    """SHA-256 of a plot job's inputs, styling and plotting code (see the top of this module)."""
+    draw_function, kwargs, path, figsize = job
+    h = hashlib.sha256()
+    h.update(json.dumps({'draw_function': f"{draw_function.__module__}.{draw_function.__qualname__}",
+                         'figsize': list(figsize), 'dpi': DPI, 'font_family': FONT_FAMILY,
+                         'matplotlib': matplotlib.__version__, 'seaborn': sns.__version__}, sort_keys=True).encode())
+    h.update(inspect.getsource(sys.modules[draw_function.__module__]).encode())
+    h.update(inspect.getsource(sys.modules[__name__]).encode())
+    _update_hash(h, kwargs)
+    return h.hexdigest()
+
+def manifest_path(output_dir):
+    """The manifest of the plots in `output_dir`, next to it."""
+    return os.path.normpath(output_dir) + MANIFEST_SUFFIX
+
+def _load_manifest(output_dir):
+    """File name -> key of the plots in `output_dir` (empty if there is no readable manifest)."""
+    try:
+        with open(manifest_path(output_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(output_dir, manifest):
+    # Written atomically like the plots, so the manifest never names a plot that was not saved
+    path = manifest_path(output_dir)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+def render_job(job):
+    """Draws and saves one plot job. Returns its path and the error message, or None if it was saved."""
+    draw_function, kwargs, path, figsize = job
+    rcParams['font.family'] = FONT_FAMILY
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        draw_function(fig, **kwargs)
+        # The extension of the temporary file is not the image format, so pass it explicitly
+        fig.savefig(temporary_path, dpi=DPI, format=os.path.splitext(path)[1][1:] or 'png')
+        os.replace(temporary_path, path)
+        return path, None
+    except Exception as e:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return path, str(e)
+
+def render_plots(jobs, n_jobs=1, force=False):
+    """
+    Renders the plot `jobs` in this process (n_jobs=1) or on a pool of `n_jobs`
+    processes (None: all cores), and prints where each one was saved, in job order.
+    Plots whose file exists and whose key matches the manifest are skipped,
+    unless force=True.
+
+    Returns:
+        list of (path, error message or None), in job order (skipped plots have no error)
+    """
+    keys = [plot_key(job) for job in jobs]
+    manifests = {}
+    for job in jobs:
+        output_dir = os.path.dirname(job[2])
+        if output_dir not in manifests:
+            manifests[output_dir] = _load_manifest(output_dir)
+
+    unchanged = [not force and os.path.exists(job[2])
+                 and manifests[os.path.dirname(job[2])].get(os.path.basename(job[2])) == key
+                 for job, key in zip(jobs, keys)]
+    pending = [job for job, skip in zip(jobs, unchanged) if not skip]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(pending) <= 1:
+        rendered = [render_job(job) for job in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(pending))) as executor:
+            rendered = list(executor.map(render_job, pending))
+
+    rendered = iter(rendered)
+    results = []
+    for job, key, skip in zip(jobs, keys, unchanged):
+        path, error = (job[2], None) if skip else next(rendered)
+        manifest = manifests[os.path.dirname(path)]
+        if skip:
+            print(f"Plot unchanged: {path}")
+        elif error is None:
+            manifest[os.path.basename(path)] = key
+            print(f"Saved plot to: {path}")
+        else:
+            manifest.pop(os.path.basename(path), None)
+            print(f"Error saving plot {path}: {error}")
+        results.append((path, error))
+
+    for output_dir, manifest in manifests.items():
+        _write_manifest(output_dir, manifest)
+    return results
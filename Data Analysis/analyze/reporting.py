@@ -0,0 +1,39 @@
+# reporting.py
+
+# Console output of the analysis. Tables are printed through print_table, which
+# skips the (slow) markdown formatting in quiet mode. quiet() also silences the
+# other progress messages, so only the returned results (and a ResultsStore, if
+# used) remain.
+
+import contextlib
+import os
+
+# Set by quiet(); process pools started inside quiet() inherit it
+QUIET = False
+
+def print_table(df, index=True, **kwargs):
+    """Prints `df` as a markdown table (left aligned), unless in quiet mode."""
+    if QUIET:
+        return
+    print(df.to_markdown(index=index, **{'numalign': 'left', 'stralign': 'left', **kwargs}))
+
+def print_object(obj):
+    """Prints `obj` (e.g. a DataFrame or a model summary) as is, unless in quiet mode."""
+    if QUIET:
+        return
+    print(obj)
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Quiet mode: no tables are formatted and everything printed is discarded."""
+    global QUIET
+    if not enabled:
+        yield
+        return
+    previous = QUIET
+    QUIET = True
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        QUIET = previous
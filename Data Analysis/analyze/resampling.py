@@ -0,0 +1,144 @@
+# resampling.py
+
+# Resampling-based inference for the mixed ANOVA (within: source, between:
+# length) and its source post-hocs, as an alternative to the parametric
+# p-values for skewed DVs such as reaction time.
+#
+# - Permutation p-values: source labels are permuted within each participant
+#   (for the source effect and the interaction), length labels across
+#   participants (for the length effect). For the pairwise source comparisons
+#   permuting two labels within a participant flips the sign of their difference.
+# - Cluster bootstrap: participants (with all their responses) are resampled
+#   with replacement within each length group, giving percentile confidence
+#   intervals of the cell means and the pairwise source differences.
+#
+# Every resample is evaluated as part of a batch of array operations (the F
+# values through mixed_anova.batched_mixed_anova). Batches get their own seed
+# from one SeedSequence, so results depend on the seed and not on n_jobs.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from .mixed_anova import batched_mixed_anova, wide_design
+
+# Resamples evaluated per batch (a batch of permutations is a (batch, subjects, sources) array)
+BATCH_SIZE = 500
+
+def _f_values(Y_stack, between_codes, n_groups):
+    """F values of the between, within and interaction effects for each dataset of a stack."""
+    results = batched_mixed_anova(Y_stack, np.ones(Y_stack.shape[:2], dtype=bool), between_codes, n_groups)
+    return np.column_stack([results['f_betw'], results['f_with'], results['f_inter']])
+
+def _pair_differences(Y, pairs):
+    """Per-subject differences between the within levels of each pair, array (..., n_subjects, n_pairs)."""
+    return np.stack([Y[..., a] - Y[..., b] for a, b in pairs], axis=-1)
+
+def _resample_batch(args):
+    """Evaluates one batch of permutations and bootstrap resamples with its own random generator."""
+    Y, between_codes, n_groups, pairs, size, seed = args
+    rng = np.random.default_rng(seed)
+    n, k = Y.shape
+
+    # Source labels permuted within each participant, length labels across participants
+    within_permuted = rng.permuted(np.broadcast_to(Y, (size, n, k)), axis=2)
+    between_permuted = Y[np.argsort(rng.random((size, n)), axis=1)]
+    f_within = _f_values(within_permuted, between_codes, n_groups)
+    f_between = _f_values(between_permuted, between_codes, n_groups)
+
+    # Sign flips of the paired differences (permuting the two labels within a participant)
+    differences = _pair_differences(Y, pairs)
+    signs = rng.choice([-1.0, 1.0], size=(size, n))
+    flipped_means = np.einsum('bn,np->bp', signs, differences) / n
+
+    # Cluster bootstrap, stratified by length group
+    bootstrap_index = np.concatenate([rng.choice(np.flatnonzero(between_codes == g), size=(size, (between_codes == g).sum()))
+                                      for g in range(n_groups)], axis=1)
+    Y_boot = Y[bootstrap_index]
+    boot_codes = np.sort(between_codes)
+    cell_means = np.stack([Y_boot[:, boot_codes == g, :].mean(axis=1) for g in range(n_groups)], axis=1)
+    boot_differences = _pair_differences(Y_boot, pairs).mean(axis=1)
+
+    return {
+        'f_between': f_between[:, 0], 'f_within': f_within[:, 1], 'f_inter': f_within[:, 2],
+        'flipped_means': flipped_means, 'cell_means': cell_means, 'boot_differences': boot_differences,
+    }
+
+def resample_mixed_anova(Y, between_codes, n_resamples=5000, seed=0, n_jobs=1):
+    """
+    Permutation and cluster bootstrap distributions for one DV in wide format
+    (see mixed_anova.wide_design), evaluated in batches of BATCH_SIZE resamples
+    on `n_jobs` processes (None: all cores).
+
+    Returns:
+        dict with the observed statistics and their resampled distributions.
+    """
+    n_groups = int(between_codes.max()) + 1
+    pairs = list(combinations(range(Y.shape[1]), 2))
+    sizes = [min(BATCH_SIZE, n_resamples - start) for start in range(0, n_resamples, BATCH_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    # Bootstrap resamples come out grouped by length, so the observed values use the same order
+    order = np.argsort(between_codes, kind='stable')
+    tasks = [(Y[order], between_codes[order], n_groups, pairs, size, batch_seed) for size, batch_seed in zip(sizes, seeds)]
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1 or len(tasks) == 1:
+        batches = list(map(_resample_batch, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks))) as executor:
+            batches = list(executor.map(_resample_batch, tasks))
+    resampled = {key: np.concatenate([batch[key] for batch in batches]) for key in batches[0]}
+
+    observed_f = _f_values(Y[np.newaxis], between_codes, n_groups)[0]
+    resampled['observed_f'] = dict(zip(['between', 'within', 'interaction'], observed_f))
+    resampled['observed_differences'] = _pair_differences(Y, pairs).mean(axis=0)
+    resampled['observed_cell_means'] = np.stack([Y[between_codes == g].mean(axis=0) for g in range(n_groups)])
+    resampled['pairs'] = pairs
+    return resampled
+
+def _permutation_p(null, observed):
+    """Permutation p-value counting the observed statistic as one of the resamples."""
+    return (1 + np.sum(null >= observed, axis=0)) / (len(null) + 1)
+
+def resampling_inference(df_dv, dv, within='source', between='length', subject='participant_code',
+                         n_resamples=5000, seed=0, n_jobs=1, ci=0.95):
+    """
+    Permutation p-values and bootstrap confidence intervals for one DV (rows of
+    the DV with the value in column `dv`, as perform_mixed_anova returns them).
+
+    Returns:
+        effects: DataFrame of the ANOVA effects with their F and permutation p-value
+        contrasts: DataFrame of the pairwise source differences with their
+            sign-flip permutation p-value and bootstrap CI
+        cell_means: DataFrame of the length x source means with bootstrap CIs
+    """
+    Y, between_codes, between_levels, within_levels = wide_design(df_dv, dv, within, between, subject)
+    r = resample_mixed_anova(Y, between_codes, n_resamples, seed, n_jobs)
+    low, high = (1 - ci) / 2 * 100, (1 + ci) / 2 * 100
+
+    effects = pd.DataFrame({
+        'Source': [between, within, 'Interaction'],
+        'F': list(r['observed_f'].values()),
+        'p-perm': [_permutation_p(r['f_between'], r['observed_f']['between']),
+                   _permutation_p(r['f_within'], r['observed_f']['within']),
+                   _permutation_p(r['f_inter'], r['observed_f']['interaction'])],
+    })
+
+    contrasts = pd.DataFrame({
+        'A': [within_levels[a] for a, _ in r['pairs']],
+        'B': [within_levels[b] for _, b in r['pairs']],
+        'mean(A-B)': r['observed_differences'],
+        'p-perm': _permutation_p(np.abs(r['flipped_means']), np.abs(r['observed_differences'])),
+        f'CI{ci:.0%} low': np.percentile(r['boot_differences'], low, axis=0),
+        f'CI{ci:.0%} high': np.percentile(r['boot_differences'], high, axis=0),
+    })
+
+    cell_low = np.percentile(r['cell_means'], low, axis=0)
+    cell_high = np.percentile(r['cell_means'], high, axis=0)
+    cell_means = pd.DataFrame([
+        {between: between_levels[g], within: within_levels[s], 'mean': r['observed_cell_means'][g, s],
+         f'CI{ci:.0%} low': cell_low[g, s], f'CI{ci:.0%} high': cell_high[g, s]}
+        for g in range(len(between_levels)) for s in range(len(within_levels))
+    ])
+    return effects, contrasts, cell_means
@@ -0,0 +1,112 @@
+# results_store.py
+
+# Persists the result tables of an analysis run (ANOVA tables, post-hocs,
+# Bayesian fixed effects, t-tests, descriptives, ...) so other tools can read
+# them without rerunning the analysis. Results are indexed by run, step and DV:
+# - 'parquet': <root>/<run_id>/<step>/<dv>.parquet (requires pyarrow)
+# - 'sqlite':  <root>/results.sqlite, one table per step with run_id and dv columns
+
+import contextlib
+import datetime
+import os
+import re
+import sqlite3
+import pandas as pd
+from storage import read_table, write_table
+
+# File / table name for results that are not per DV
+ALL_DVS = 'all'
+
+def _flat_table(df):
+    """
+    `df` as a plain table that Parquet and SQLite can store: named index levels
+    become columns, MultiIndex columns are joined with '_', and object columns
+    holding mixed types are stored as strings.
+    """
+    df = df.copy()
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = ['_'.join(map(str, col)) for col in df.columns]
+    df.columns = [str(col) for col in df.columns]
+    if any(name is not None for name in df.index.names):
+        df = df.reset_index()
+    else:
+        df = df.reset_index(drop=True)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+        elif df[col].dtype == object and df[col].map(type).nunique() > 1:
+            df[col] = df[col].map(lambda v: v if v is None else str(v))
+    return df
+
+def _safe_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(name))
+
+class ResultsStore:
+    """
+    Result tables of analysis runs on disk, in `root`, as 'sqlite' (standard library) or 'parquet'.
+    A new run_id (a timestamp to the microsecond) is made if none is given.
+    """
+    def __init__(self, root='results', backend='sqlite', run_id=None):
+        if backend not in ('parquet', 'sqlite'):
+            raise ValueError(f"Unknown results backend: {backend} (expected 'parquet' or 'sqlite')")
+        self.root = root
+        self.backend = backend
+        self.run_id = run_id or datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, step, dv, run_id=None):
+        return os.path.join(self.root, _safe_name(run_id or self.run_id), _safe_name(step), f"{_safe_name(dv)}.parquet")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """A connection to results.sqlite, committed (or rolled back on an error) and closed on exit."""
+        connection = sqlite3.connect(os.path.join(self.root, 'results.sqlite'))
+        try:
+            with connection: # commits, but does not close
+                yield connection
+        finally:
+            connection.close()
+
+    def save(self, step, table, dv=ALL_DVS):
+        """Stores one result table of `step` (e.g. 'anova') for `dv` in the current run, replacing an earlier one."""
+        if table is None:
+            return
+        table = _flat_table(table)
+        if self.backend == 'parquet':
+            path = self._path(step, dv)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_table(table, path)
+            return
+        table.insert(0, 'dv', dv)
+        table.insert(0, 'run_id', self.run_id)
+        with self._connect() as connection:
+            existing = connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (step,)).fetchone()
+            if existing:
+                connection.execute(f'DELETE FROM "{step}" WHERE run_id = ? AND dv = ?', (self.run_id, dv))
+                columns = [row[1] for row in connection.execute(f'PRAGMA table_info("{step}")')]
+                for col in table.columns.difference(columns, sort=False):
+                    connection.execute(f'ALTER TABLE "{step}" ADD COLUMN "{col}"')
+            table.to_sql(step, connection, if_exists='append', index=False)
+
+    def save_all(self, step, tables):
+        """Stores a dict of DV -> result table (None entries are skipped)."""
+        for dv, table in tables.items():
+            self.save(step, table, dv)
+
+    def load(self, step, dv=ALL_DVS, run_id=None):
+        """A stored result table of `step` for `dv`, from `run_id` (default: the current run)."""
+        run_id = run_id or self.run_id
+        if self.backend == 'parquet':
+            return read_table(self._path(step, dv, run_id))
+        with self._connect() as connection:
+            table = pd.read_sql_query(f'SELECT * FROM "{step}" WHERE run_id = ? AND dv = ?', connection, params=(run_id, dv))
+        return table.drop(columns=['run_id', 'dv']).dropna(axis=1, how='all')
+
+    def runs(self):
+        """The run_ids in the store, oldest first."""
+        if self.backend == 'parquet':
+            return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+        with self._connect() as connection:
+            steps = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+            return sorted(set().union(*(
+                (row[0] for row in connection.execute(f'SELECT DISTINCT run_id FROM "{step}"')) for step in steps)))
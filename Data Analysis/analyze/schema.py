@@ -0,0 +1,54 @@
+# schema.py
+
+# The shared categorical schema, assigned once at load time (see
+# data_handling.load_and_inspect_data): `test_slug`, `source`, `length` and
+# `question` of the experiment data become categoricals, and `participant_id`
+# becomes a categorical with the same categories in both datasets (so merges
+# between them stay categorical), next to a dense int32 `participant_code`.
+# Downstream code should group with observed=True, as the categories can
+# include levels that are absent from a subset.
+
+import pandas as pd
+
+# Known levels of the experiment's categorical columns. Categories are kept in
+# alphabetical order, as astype('category') would give, so reference levels in
+# the models stay the same ('ai' for source, 'longer' for length).
+SOURCE_LEVELS = ['ai', 'original', 'programmatic']
+LENGTH_LEVELS = ['longer', 'shorter']
+QUESTION_LEVELS = ['accuracy', 'comprehension', 'confidence', 'effort', 'satisfaction',
+                   # Added by create_new_dvs
+                   'general_quality', 'objective_quality', 'reaction_time', 'subjective_quality']
+
+EXPERIMENT_LEVELS = {'source': SOURCE_LEVELS, 'length': LENGTH_LEVELS, 'question': QUESTION_LEVELS, 'test_slug': []}
+
+def _categorical_dtype(known_levels, values):
+    """Categorical dtype over the known levels plus any other values present, sorted."""
+    observed = pd.unique(values.dropna().astype(str)) if values.dtype != 'category' else values.cat.categories
+    return pd.CategoricalDtype(sorted(set(known_levels) | set(observed)))
+
+def participant_dtype(*participant_ids):
+    """The shared participant_id categorical dtype: every participant id in any of the given Series, sorted."""
+    return pd.CategoricalDtype(sorted(set().union(*(ids.dropna().astype(str) for ids in participant_ids))))
+
+def apply_column_schema(df, participant_ids_dtype, experiment=True):
+    """
+    Applies the schema to the columns `df` has: `participant_id` gets `participant_ids_dtype`
+    and a `participant_code` column is added, and for experiment data the columns
+    of EXPERIMENT_LEVELS become categoricals.
+    """
+    if 'participant_id' in df.columns:
+        df['participant_id'] = df['participant_id'].astype(str).astype(participant_ids_dtype)
+        df['participant_code'] = df['participant_id'].cat.codes.astype('int32')
+
+    if experiment:
+        for col, levels in EXPERIMENT_LEVELS.items():
+            if col in df.columns:
+                df[col] = df[col].astype(_categorical_dtype(levels, df[col]))
+    return df
+
+def restore_schema(df, like):
+    """Casts the columns of `df` back to the categorical (and participant code) dtypes of `like`, e.g. after a concat."""
+    for col in df.columns.intersection(like.columns):
+        if isinstance(like[col].dtype, pd.CategoricalDtype) or col == 'participant_code':
+            df[col] = df[col].astype(like[col].dtype)
+    return df
@@ -0,0 +1,64 @@
+# benchmark_wrangle.py
+
+# Compares the vectorized response aggregation in wrangle.py against the
+# original per-group lambda implementation, on the bundled test responses
+# replicated to a larger number of participants.
+#
+# Run from the Data Analysis directory: python benchmark_wrangle.py [replicas]
+
+import sys
+import time
+import pandas as pd
+from wrangle import aggregate_test_responses, aggregate_questionnaire_responses
+
+def legacy_aggregate_test_responses(df_test_responses):
+    """The original aggregation from wrangle_data, kept here as the baseline."""
+    return df_test_responses.groupby(['test_slug', 'question_id', 'participant_id']).agg(
+        id=('id', lambda x: '-'.join(x.astype(str))),
+        response_value=('response_value', lambda x: list(x) if len(x) > 1 else x.iloc[0]),
+        length=('content_length', 'first'),
+        source=('content_source', 'first'),
+        reaction_time=('reaction_time_ms', 'first'),
+    ).reset_index()
+
+def legacy_aggregate_questionnaire_responses(df_questionnaire_responses):
+    """The original questionnaire aggregation from wrangle_data."""
+    return df_questionnaire_responses.groupby(['questionnaire_type', 'question_id', 'participant_id']).agg(
+        id=('id', lambda x: '-'.join(x.astype(str))),
+        response_value=('response_value', lambda x: int(x)),
+    ).reset_index()
+
+def replicate(df, replicas):
+    """Copies every participant's rows `replicas` times under new participant and row ids."""
+    copies = []
+    for i in range(replicas):
+        df_copy = df.copy()
+        df_copy['participant_id'] = df_copy['participant_id'] + f'-{i}'
+        df_copy['id'] = df_copy['id'] + i * len(df)
+        copies.append(df_copy)
+    return pd.concat(copies, ignore_index=True)
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def run_benchmark(replicas=50):
+    df_test = replicate(pd.read_csv("data/init/test_responses.csv"), replicas)
+    df_test = df_test[df_test['test_slug'] != "practice"]
+    df_questionnaire = replicate(pd.read_csv("data/init/questionnaire_responses.csv"), replicas)
+
+    print(f"Benchmarking on {len(df_test)} test response rows and {len(df_questionnaire)} questionnaire response rows")
+    for name, legacy, vectorized, df in [
+        ('test_responses', legacy_aggregate_test_responses, aggregate_test_responses, df_test),
+        ('questionnaire_responses', legacy_aggregate_questionnaire_responses, aggregate_questionnaire_responses, df_questionnaire),
+    ]:
+        expected, legacy_seconds = time_call(legacy, df)
+        result, vectorized_seconds = time_call(vectorized, [df])
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        print(f"{name}: legacy {legacy_seconds:.2f}s, vectorized {vectorized_seconds:.2f}s "
+              f"({legacy_seconds / vectorized_seconds:.1f}x faster), outputs identical")
+
+# This block allows the script to be run directly
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
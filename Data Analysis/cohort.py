@@ -0,0 +1,82 @@
+# cohort.py
+
+# Which participants and tests are included in the analysis. A cohort is a
+# plain dict, applied while the data is read: as a mask on the participants
+# table, as a filter on each response chunk, and as SQL conditions when
+# reading from the database.
+
+import pandas as pd
+
+# The cohort analysed in the study: controlled sessions from Friday 2025-04-25 onwards
+DEFAULT_COHORT = {
+    'start_date': '2025-04-25', # Inclusive, participants' created_at in UTC
+    'end_date': None,           # Exclusive, None for no upper bound
+    'is_controlled': True,      # None keeps both controlled and uncontrolled sessions
+    'is_pilot': None,
+    'is_mobile': None,
+    'test_slugs': None,         # Test slugs to keep, None for all (practice is always dropped)
+}
+
+# Format of the timestamps in the platform exports, e.g. 2025-04-24 10:07:16.870712+00
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f%z'
+
+BOOLEAN_FILTERS = ['is_controlled', 'is_pilot', 'is_mobile']
+
+def make_cohort(**filters):
+    """Returns DEFAULT_COHORT with the given filters replaced, e.g. make_cohort(is_mobile=False)."""
+    unknown = set(filters) - set(DEFAULT_COHORT)
+    if unknown:
+        raise ValueError(f"Unknown cohort filters: {sorted(unknown)}")
+    return {**DEFAULT_COHORT, **filters}
+
+def parse_timestamps(values):
+    """Parses platform timestamps (strings or datetimes) once, with a fixed format, to UTC datetimes."""
+    return pd.to_datetime(values, format=TIMESTAMP_FORMAT, utc=True)
+
+def participant_mask(df_participants, cohort):
+    """Boolean mask of the participants (rows of the participants table) in the cohort."""
+    mask = pd.Series(True, index=df_participants.index)
+    for col in BOOLEAN_FILTERS:
+        if cohort[col] is not None:
+            mask &= df_participants[col] == cohort[col]
+
+    if cohort['start_date'] is not None or cohort['end_date'] is not None:
+        created_at = parse_timestamps(df_participants['created_at'])
+        if cohort['start_date'] is not None:
+            mask &= created_at >= pd.Timestamp(cohort['start_date'], tz='UTC')
+        if cohort['end_date'] is not None:
+            mask &= created_at < pd.Timestamp(cohort['end_date'], tz='UTC')
+    return mask
+
+def test_slug_mask(df, cohort):
+    """Boolean mask of the test response rows in the cohort's tests, never including practice."""
+    mask = df['test_slug'] != "practice"
+    if cohort['test_slugs'] is not None:
+        mask &= df['test_slug'].isin(cohort['test_slugs'])
+    return mask
+
+def participant_sql(cohort):
+    """
+    The cohort's participant filter as a SQL condition on the participants table, with
+    '{p}' parameter placeholders (see database.read_table_chunks), and its parameters.
+    """
+    conditions, params = [], []
+    for col in BOOLEAN_FILTERS:
+        if cohort[col] is not None:
+            conditions.append(f"{col} = {{p}}")
+            params.append(cohort[col])
+    if cohort['start_date'] is not None:
+        conditions.append("created_at >= {p}")
+        params.append(f"{cohort['start_date']} 00:00:00+00")
+    if cohort['end_date'] is not None:
+        conditions.append("created_at < {p}")
+        params.append(f"{cohort['end_date']} 00:00:00+00")
+    return " AND ".join(conditions) or "TRUE", params
+
+def test_slug_sql(cohort):
+    """The cohort's test filter as a SQL condition on test_responses, and its parameters."""
+    conditions, params = ["test_slug <> {p}"], ["practice"]
+    if cohort['test_slugs'] is not None:
+        conditions.append(f"test_slug IN ({', '.join(['{p}'] * len(cohort['test_slugs']))})")
+        params.extend(cohort['test_slugs'])
+    return " AND ".join(conditions), params
@@ -1,109 +1,286 @@
 # evaluate.py
 
+import os
+import numpy as np
 import pandas as pd
 import json
+from concurrent.futures import ProcessPoolExecutor
+from storage import intermediate_path, read_table, write_table
 
-def evaluate_data():
-    # Define the correct answers
-    answers = {
-        "email-inbox_accuracy": "Review and give feedback on the legal team's contract",
-        "email-inbox_comprehension": [
-            "You have a mandatory training session to attend tomorrow",
-            "Sarah Johnson has requested an extension for a project deadline",
-            "You need to provide feedback on a contract by the end of today"
-        ],
-        "meeting-transcription_accuracy": "Refine and improve existing core user experiences and address known technical problems.",
-        "meeting-transcription_comprehension": [
-            "Reviewing current product features.",
-            "Evaluating the project timeline.",
-            "Addressing technical performance."
-        ],
-        "presentation-slide_accuracy": "Enhance core technology offerings",
-        "presentation-slide_comprehension": [
-            "Projected revenue growth",
-            "Targets for operating margin"
-        ],
-        "product-listing_accuracy": "All items are discounted",
-        "product-listing_comprehension": [
-            "All the audio items listed are available to buy right now.",
-            "The audio products represent offerings from multiple different brands.",
-            "Information about customer satisfaction (ratings) is provided for all audio items."
-        ],
-        "push-notifications_accuracy": "Information related to weather alerts.",
-        "push-notifications_comprehension": [
-            "You have an upcoming meeting with a team member named Sarah",
-            "There is a severe weather alert active in your area"
-        ],
-        "search-engine_accuracy": "Written articles",
-        "search-engine_comprehension": [
-            "Varied content formats",
-            "Different update schedules"
-        ]
-    }
-
-    def evaluate_response(row, answers):
-        question_type = row['question']
-        response_value = row['response_value']
-
-        if question_type == "accuracy":
-            test_slug = row['test_slug']
-            # For accuracy, exact match is required
-            correct_answer = answers.get(f"{test_slug}_{question_type}")
-            return 1 if response_value == correct_answer else 0
-        elif question_type == "comprehension":
-            test_slug = row['test_slug']
-            # For comprehension, compare lists and return a similarity score
-            correct_answers = answers.get(f"{test_slug}_{question_type}", [])
-
-            # Ensure response_value is treated as a list for comparison
-            if not isinstance(response_value, list):
-                # Attempt to parse the string representation of a list
-                try:
-                    response_list = json.loads(response_value)
-                    if not isinstance(response_list, list):
-                        response_list = [response_value] if response_value is not None else []
-                except json.JSONDecodeError:
-                    response_list = [response_value] if response_value is not None else []
-            else:
-                response_list = response_value
+# The answer key (correct answers per test slug), versioned so a changed key is noticed
+ANSWER_KEY_PATH = "data/answer_key.json"
+ANSWER_KEY_VERSION = 1
+
+# How comprehension (multi-select) responses are scored, with k correct options,
+# h of them selected and w incorrect options selected:
+# - recall:    h / k, the share of correct options selected (the study's score)
+# - precision: h / (h + w), the share of selected options that are correct
+# - jaccard:   h / (k + w), overlap between the selection and the correct options
+# - penalized: max(0, (h - w) / k), partial credit minus a penalty per wrong option
+COMPREHENSION_RULES = ['recall', 'precision', 'jaccard', 'penalized']
+
+def load_answer_key(path=ANSWER_KEY_PATH):
+    """
+    Reads the answer key file, {"version": 1, "tests": {test_slug: {question: answer}}},
+    and returns it flattened to {"<test_slug>_<question>": answer}, as evaluate_response expects.
+    A new test only needs a new entry in the file.
+    """
+    with open(path, encoding='utf-8') as f:
+        answer_key = json.load(f)
+    if answer_key.get('version') != ANSWER_KEY_VERSION:
+        raise ValueError(f"Unsupported answer key version in {path}: {answer_key.get('version')} (expected {ANSWER_KEY_VERSION})")
+    return {f"{test_slug}_{question}": answer
+            for test_slug, questions in answer_key['tests'].items()
+            for question, answer in questions.items()}
 
-            # Calculate similarity: number of correct items in the response
-            # divided by the total number of unique correct answers.
-            # Using sets to handle potential duplicates and order
-            correct_set = set(correct_answers)
-            response_set = set(response_list)
+def compile_comprehension_index(answers):
+    """
+    Compiles the comprehension answers into an index of integer ids: one row per
+    (key, correct option) with the option's bit in that key's bitmask, plus the
+    number of correct options per key.
 
-            if not correct_set: # Avoid division by zero if there are no correct answers
-                return 1.0 if not response_set else 0.0 # If no correct answers, full score only if response is also empty list
+    Returns:
+        options: DataFrame with columns key, option, bit
+        n_correct: Series of the number of correct options, indexed by key
+    """
+    rows = []
+    for key, correct_options in answers.items():
+        if key.endswith('_comprehension'):
+            # dict.fromkeys drops duplicates but keeps the order of the key file
+            rows.extend((key, option, bit) for bit, option in enumerate(dict.fromkeys(correct_options)))
+    options = pd.DataFrame(rows, columns=['key', 'option', 'bit'])
+    if len(options) and options['bit'].max() >= 63:
+        raise ValueError("Comprehension bitmasks support at most 63 correct options per question")
+    n_correct = options.groupby('key').size()
+    return options, n_correct
 
-            # Number of elements common to both sets
-            common_elements = len(correct_set.intersection(response_set))
+def evaluate_response(row, answers):
+    """Scores a single response (row). Reference implementation for evaluate_responses."""
+    question_type = row['question']
+    response_value = row['response_value']
 
-            # Similarity score: proportion of correct elements found in the response
-            similarity_score = common_elements / len(correct_set)
+    if question_type == "accuracy":
+        test_slug = row['test_slug']
+        # For accuracy, exact match is required
+        correct_answer = answers.get(f"{test_slug}_{question_type}")
+        return 1 if response_value == correct_answer else 0
+    elif question_type == "comprehension":
+        test_slug = row['test_slug']
+        # For comprehension, compare lists and return a similarity score
+        correct_answers = answers.get(f"{test_slug}_{question_type}", [])
 
-            return round(similarity_score, 2)
+        # Ensure response_value is treated as a list for comparison
+        if not isinstance(response_value, list):
+            # Attempt to parse the string representation of a list
+            try:
+                response_list = json.loads(response_value)
+                if not isinstance(response_list, list):
+                    response_list = [response_value] if response_value is not None else []
+            except json.JSONDecodeError:
+                response_list = [response_value] if response_value is not None else []
         else:
-            # For other question types, returns the response value as a decimal (7 point Likert scale)
-            # Invert the scale so 7 (highest value) becomes 1, and 1 becomes 0
+            response_list = response_value
+
+        # Calculate similarity: number of correct items in the response
+        # divided by the total number of unique correct answers.
+        # Using sets to handle potential duplicates and order
+        correct_set = set(correct_answers)
+        response_set = set(response_list)
+
+        if not correct_set: # Avoid division by zero if there are no correct answers
+            return 1.0 if not response_set else 0.0 # If no correct answers, full score only if response is also empty list
+
+        # Number of elements common to both sets
+        common_elements = len(correct_set.intersection(response_set))
+
+        # Similarity score: proportion of correct elements found in the response
+        similarity_score = common_elements / len(correct_set)
+
+        return round(similarity_score, 2)
+    else:
+        # For other question types, returns the response value as a decimal (7 point Likert scale)
+        return _likert_score(response_value)
+
+def _map_unique(values, func):
+    """Applies `func` once per distinct value of `values` and maps the results back (values must be hashable)."""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.asarray([func(value) for value in uniques], dtype=object)[codes]
+
+def _likert_score(response_value):
+    """Score of a Likert (or other non-test) response, see evaluate_response."""
+    # Invert the scale so 7 (highest value) becomes 1, and 1 becomes 0
+    try:
+        normalized_value = (int(response_value) - 1) / 6
+        return round(1 - normalized_value, 2)
+    except (ValueError, TypeError):
+        return 0.0 # Return 0 if response_value cannot be converted to int
+
+def _response_lists(response_values):
+    """
+    Returns each response as a list, as evaluate_response reads it: lists stay lists,
+    strings holding a JSON array are parsed, anything else becomes a one-item list.
+    Only strings that can hold a JSON array are passed to json.loads.
+    """
+    def as_list(value):
+        if isinstance(value, list):
+            return value
+        if isinstance(value, str) and value.lstrip().startswith('['):
             try:
-                normalized_value = (int(response_value) - 1) / 6
-                return round(1 - normalized_value, 2)
-            except (ValueError, TypeError):
-                return 0.0 # Return 0 if response_value cannot be converted to int
+                return json.loads(value)
+            except json.JSONDecodeError:
+                pass
+        return [value] if value is not None else []
+    return [as_list(value) for value in response_values]
+
+def _popcount(masks):
+    """Number of set bits of each int64 bitmask."""
+    bits = np.unpackbits(np.ascontiguousarray(masks, dtype='<i8').view(np.uint8).reshape(-1, 8), axis=1)
+    return bits.sum(axis=1)
+
+def comprehension_score_table(df, index):
+    """
+    Scores comprehension rows under every rule of COMPREHENSION_RULES in one pass (unrounded).
+
+    Each response becomes a bitmask of the correct options it selects (via the
+    compiled `index`, see compile_comprehension_index) and a count of distinct
+    selected options, from which all rules follow.
+
+    Returns:
+        DataFrame with one column per rule, aligned with df.
+    """
+    options, n_correct_by_key = index
+    keys = (df['test_slug'].astype(str) + '_comprehension').to_numpy()
+
+    # One row per distinct (response row, selected option), with the option's bit if it is correct.
+    # Rows are keyed by position, so any index of df (e.g. with duplicate labels) works
+    response_lists = _response_lists(df['response_value'])
+    selected = pd.DataFrame({'row': np.repeat(np.arange(len(df)), [len(items) for items in response_lists]),
+                             'option': [item for items in response_lists for item in items]})
+    selected = selected.drop_duplicates()
+    selected['key'] = keys[selected['row'].to_numpy()]
+    selected = selected.merge(options, on=['key', 'option'], how='left')
+    is_correct = selected['bit'].notna().to_numpy()
+    selected['mask'] = np.where(is_correct, np.left_shift(1, selected['bit'].fillna(0).to_numpy(dtype='int64')), 0)
+
+    # Sums per row position, 0 for rows without selected options
+    rows = selected['row'].to_numpy()
+    masks = np.zeros(len(df), dtype='int64')
+    np.add.at(masks, rows, selected['mask'].to_numpy(dtype='int64'))
+    n_selected = np.bincount(rows, minlength=len(df)).astype(float)
+
+    k = pd.Series(keys).map(n_correct_by_key).fillna(0).to_numpy(dtype=float)
+    h = _popcount(masks).astype(float)
+    w = n_selected - h
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table = pd.DataFrame({
+            'recall': h / k,
+            'precision': np.where(h + w > 0, h / (h + w), 0.0),
+            'jaccard': h / (k + w),
+            'penalized': np.maximum(0.0, (h - w) / k),
+        }, index=df.index)
+
+    # Without correct answers, full score only if the response is empty too
+    no_key = k == 0
+    for rule in table.columns:
+        table[rule] = np.where(no_key, (w == 0).astype(float), table[rule].to_numpy())
+    return table
+
+def _comprehension_scores(df, index, rule='recall'):
+    """Comprehension scores of `df` under `rule`, rounded to 2 decimals."""
+    scores = comprehension_score_table(df, index)[rule].to_numpy()
+    return _map_unique(scores, lambda score: round(score, 2))
+
+def evaluate_responses(df, answers, comprehension_rule='recall'):
+    """
+    Scores every row of `df` at once, giving the same scores as applying
+    evaluate_response row by row:
+    - accuracy: 1 if the response matches the answer key exactly, else 0 (a join against the key)
+    - comprehension: share of correct options selected (a bitmask per row over the compiled
+      answer key), or another rule of COMPREHENSION_RULES
+    - anything else: inverted 7 point Likert scale, (7 - value) / 6 (per distinct value)
+
+    Returns:
+        pandas Series of scores aligned with df.
+    """
+    if comprehension_rule not in COMPREHENSION_RULES:
+        raise ValueError(f"Unknown comprehension rule: {comprehension_rule} (expected one of {COMPREHENSION_RULES})")
+
+    # Scores are filled by row position, so any index of df (e.g. with duplicate labels) works
+    scores = np.full(len(df), np.nan)
+    question = df['question'].astype(str).to_numpy()
+
+    is_accuracy = question == "accuracy"
+    if is_accuracy.any():
+        df_accuracy = df[is_accuracy]
+        correct_answer = (df_accuracy['test_slug'].astype(str) + '_accuracy').map(answers)
+        scores[is_accuracy] = (df_accuracy['response_value'] == correct_answer).astype(int).to_numpy()
+
+    is_comprehension = question == "comprehension"
+    if is_comprehension.any():
+        index = compile_comprehension_index(answers)
+        scores[is_comprehension] = _comprehension_scores(df[is_comprehension], index, comprehension_rule)
+
+    is_other = ~(is_accuracy | is_comprehension)
+    if is_other.any():
+        # Few distinct values in practice (1-7), so each distinct value is scored once
+        scores[is_other] = _map_unique(df.loc[is_other, 'response_value'].to_numpy(), _likert_score).astype(float)
+
+    return pd.Series(scores, index=df.index)
+
+def _evaluate_shard(args):
+    """Scores one participant shard in a worker process, see evaluate_responses_parallel."""
+    df_shard, answers, comprehension_rule = args
+    return evaluate_responses(df_shard, answers, comprehension_rule)
+
+def participant_shards(df, n_shards):
+    """
+    Splits the row positions of `df` into at most `n_shards` shards, with all rows
+    of a participant in the same shard and rows kept in their original order.
+    Participants are dealt round-robin in order of first appearance.
+    """
+    codes, _ = pd.factorize(df['participant_id'])
+    shard_of_row = codes % n_shards
+    return [positions for positions in (np.flatnonzero(shard_of_row == shard) for shard in range(n_shards)) if len(positions)]
+
+def evaluate_responses_parallel(df, answers, comprehension_rule='recall', n_jobs=None):
+    """
+    Scores `df` like evaluate_responses, split into participant shards scored on a
+    pool of `n_jobs` processes (default: all cores). The shard results are put back
+    in the row order of df, so the output matches evaluate_responses row for row.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    shards = participant_shards(df, n_jobs)
+    if n_jobs == 1 or len(shards) <= 1:
+        return evaluate_responses(df, answers, comprehension_rule)
+
+    with ProcessPoolExecutor(max_workers=min(n_jobs, len(shards))) as executor:
+        # map returns the results in shard order, whichever worker finishes first
+        results = list(executor.map(_evaluate_shard, [(df.iloc[positions], answers, comprehension_rule) for positions in shards]))
 
+    scores = np.empty(len(df), dtype=float)
+    for positions, shard_scores in zip(shards, results):
+        scores[positions] = shard_scores.to_numpy()
+    return pd.Series(scores, index=df.index)
 
-    # Read the CSV files
-    test_data = pd.read_csv("data/test_data_wrangled.csv")
-    questionnaire_data = pd.read_csv("data/questionnaire_data_wrangled.csv")
+def evaluate_data(data_format='csv', answer_key_path=ANSWER_KEY_PATH, comprehension_rule='recall', n_jobs=1):
+    """
+    Scores the wrangled test and questionnaire data and saves the evaluated tables.
+    With n_jobs other than 1, scoring runs on a process pool over participant
+    shards (n_jobs=None uses all cores); the output is the same either way.
+    """
+    # Read the answer key and the wrangled data ('csv' or 'parquet')
+    answers = load_answer_key(answer_key_path)
+    test_data = read_table(intermediate_path("test_data_wrangled", data_format))
+    questionnaire_data = read_table(intermediate_path("questionnaire_data_wrangled", data_format))
 
-    # Apply the evaluation function to create the is_correct column
-    test_data['response_value'] = test_data.apply(lambda row: evaluate_response(row, answers), axis=1)
-    questionnaire_data['response_value'] = questionnaire_data.apply(lambda row: evaluate_response(row, answers), axis=1)
+    # Score all responses at once to create the is_correct column
+    test_data['response_value'] = evaluate_responses_parallel(test_data, answers, comprehension_rule, n_jobs)
+    questionnaire_data['response_value'] = evaluate_responses_parallel(questionnaire_data, answers, comprehension_rule, n_jobs)
 
-    # Save the dataframes to CSV files
-    test_data.to_csv("data/test_data_evaluated.csv", index=False)
-    questionnaire_data.to_csv("data/questionnaire_data_evaluated.csv", index=False)
+    # Save the dataframes for the analysis step
+    write_table(test_data, intermediate_path("test_data_evaluated", data_format))
+    write_table(questionnaire_data, intermediate_path("questionnaire_data_evaluated", data_format))
 
     print("Evaluation complete. Output saved.")
 
@@ -5,15 +5,36 @@ from evaluate import evaluate_data
 from wrangle import wrangle_data
 from analyze.main import analyze_data
 
+# Format of the intermediate tables handed between the stages: 'csv' or 'parquet' (requires pyarrow)
+DATA_FORMAT = 'csv'
+
+# Processes used to score responses in evaluate_data, None for all cores
+EVALUATION_JOBS = 1
+
+# Processes used to render the plots, None for all cores
+PLOT_JOBS = None
+
+# Directory the analysis result tables are saved to, per run and DV (None to not save them),
+# as 'sqlite' (one results.sqlite file) or 'parquet' (one file per table, requires pyarrow)
+RESULTS_DIR = 'results'
+RESULTS_FORMAT = 'sqlite'
+
+# Leave participants missing 'source' data for a DV out of its ANOVA, Bayesian model and plot (False: only report them)
+EXCLUDE_INCOMPLETE = False
+
+# Skip printing the analysis (and formatting its tables), e.g. when only the saved results are used
+QUIET = False
+
 # Call the function to run the data processing logic
 
 if __name__ == "__main__":
     print("Wrangling data...")
-    wrangle_data()
+    wrangle_data(data_format=DATA_FORMAT)
     print("Data wrangling finished.")
     print("Evaluating data...")
-    evaluate_data()
+    evaluate_data(data_format=DATA_FORMAT, n_jobs=EVALUATION_JOBS)
     print("Data evaluation finished.")
     print("Analyzing data...")
-    analyze_data()
+    analyze_data(data_format=DATA_FORMAT, results_dir=RESULTS_DIR, results_format=RESULTS_FORMAT, quiet_mode=QUIET,
+                 plot_jobs=PLOT_JOBS, exclude_incomplete=EXCLUDE_INCOMPLETE)
     print("Data analysis finished.")
\ No newline at end of file
@@ -0,0 +1,124 @@
+# storage.py
+
+# Reading and writing of the intermediate tables handed from one pipeline
+# stage to the next (wrangle -> evaluate -> analyze). The format is chosen by
+# the file extension: '.csv' for plain CSV, '.parquet' for typed Parquet.
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError: # Parquet support is optional, CSV works without pyarrow
+    pa = None
+
+# Parquet schema metadata key listing the columns stored as lists
+LIST_COLUMNS_METADATA_KEY = b'list_columns'
+
+# Columns that may hold a list (multi-select answers) next to scalar values
+LIST_COLUMN_CANDIDATES = ['response_value']
+
+def intermediate_path(name, data_format='csv', data_dir='data'):
+    """Returns the path of an intermediate table, e.g. data/test_data_wrangled.parquet."""
+    return os.path.join(data_dir, f"{name}.{data_format}")
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Parquet intermediates require pyarrow (pip install pyarrow).")
+
+def _list_columns(df):
+    """Object columns holding at least one list, e.g. multi-select response_value."""
+    return [col for col in LIST_COLUMN_CANDIDATES
+            if col in df.columns and df[col].dtype == object and df[col].map(type).eq(list).any()]
+
+def _to_arrow_list_array(series):
+    """Stores a column of scalars and lists as an Arrow list<string> column (scalars become one-item lists)."""
+    cells = [None if not isinstance(v, list) and pd.isna(v) else [str(item) for item in (v if isinstance(v, list) else [v])]
+             for v in series]
+    return pa.array(cells, type=pa.list_(pa.string()))
+
+def _from_arrow_list_array(array):
+    """Inverse of _to_arrow_list_array: one-item lists become scalars again, longer lists Python lists."""
+    array = array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array
+    lengths = pc.fill_null(pc.list_value_length(array), 0).to_numpy(zero_copy_only=False)
+    values = np.full(len(array), None, dtype=object)
+
+    single = lengths == 1
+    if single.any():
+        values[single] = pc.list_element(array.filter(pa.array(single)), 0).to_numpy(zero_copy_only=False)
+
+    multi = np.flatnonzero(lengths > 1)
+    for position, items in zip(multi, array.take(pa.array(multi)).to_pylist()):
+        values[position] = items
+    return values
+
+def write_table(df, path):
+    """
+    Writes an intermediate table to `path`.
+
+    CSV stores list cells as JSON arrays. Parquet keeps dtypes (including
+    categoricals) and stores list cells as a native list<string> column.
+    """
+    if path.endswith('.parquet'):
+        _require_pyarrow()
+        list_columns = _list_columns(df)
+        table = pa.Table.from_pandas(df.drop(columns=list_columns), preserve_index=False)
+        for col in list_columns:
+            table = table.add_column(df.columns.get_loc(col), col, _to_arrow_list_array(df[col]))
+        metadata = dict(table.schema.metadata or {})
+        metadata[LIST_COLUMNS_METADATA_KEY] = json.dumps(list_columns).encode()
+        pq.write_table(table.replace_schema_metadata(metadata), path)
+    else:
+        df = df.copy()
+        for col in _list_columns(df):
+            df[col] = df[col].map(lambda v: json.dumps(v) if isinstance(v, list) else v)
+        df.to_csv(path, index=False)
+
+def table_columns(path):
+    """Column names of an intermediate table, read from the Parquet schema or the CSV header only."""
+    if path.endswith('.parquet'):
+        _require_pyarrow()
+        return pq.read_schema(path).names
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+def read_table(path, columns=None):
+    """
+    Reads an intermediate table written by write_table, optionally only `columns`.
+
+    List columns of a Parquet file are restored to Python lists without any
+    string parsing. CSV list cells stay JSON strings.
+    """
+    if path.endswith('.parquet'):
+        _require_pyarrow()
+        table = pq.read_table(path, columns=columns)
+        list_columns = json.loads((table.schema.metadata or {}).get(LIST_COLUMNS_METADATA_KEY, b'[]'))
+        list_columns = [col for col in list_columns if col in table.column_names]
+        df = table.drop(list_columns).to_pandas()
+        for col in list_columns:
+            df.insert(table.column_names.index(col), col, _from_arrow_list_array(table.column(col)))
+        return df
+    return pd.read_csv(path, usecols=columns)
+
+def read_table_chunks(path, columns=None, chunksize=100_000):
+    """
+    Reads an intermediate table like read_table, as an iterator of DataFrames of
+    at most `chunksize` rows, so tables larger than memory can be processed
+    chunk by chunk (e.g. by the accumulators in analyze/accumulators.py).
+    """
+    if path.endswith('.parquet'):
+        _require_pyarrow()
+        parquet_file = pq.ParquetFile(path)
+        list_columns = json.loads((parquet_file.schema_arrow.metadata or {}).get(LIST_COLUMNS_METADATA_KEY, b'[]'))
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            table = pa.Table.from_batches([batch])
+            batch_list_columns = [col for col in list_columns if col in table.column_names]
+            df = table.drop(batch_list_columns).to_pandas()
+            for col in batch_list_columns:
+                df.insert(table.column_names.index(col), col, _from_arrow_list_array(table.column(col)))
+            yield df
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
@@ -0,0 +1,96 @@
+# Tests of the mergeable accumulators and chunked descriptives (run from "Data Analysis": python -m pytest tests)
+
+import contextlib
+import io
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from analyze.accumulators import MomentAccumulator, CountAccumulator, DistinctAccumulator, FirstValueAccumulator
+from analyze.data_handling import load_and_inspect_data, create_new_dvs
+from analyze.descriptive_stats import accumulate_descriptives, row_chunks
+
+KEYS = ['length', 'source', 'question']
+
+@pytest.fixture(scope='module')
+def experiment():
+    with contextlib.redirect_stdout(io.StringIO()):
+        df, _ = load_and_inspect_data(os.path.join(ROOT, 'data', 'test_data_evaluated.csv'),
+                                      os.path.join(ROOT, 'data', 'questionnaire_data_wrangled.csv'), inspect=False)
+    return create_new_dvs(df)
+
+def _merged(make, chunks):
+    """One accumulator per chunk, merged in chunk order."""
+    merged = make()
+    for chunk in chunks:
+        merged.merge(make().update(chunk))
+    return merged
+
+def _plain(result):
+    """
+    A result with its keys as sorted plain columns: merged results have object key
+    levels where a single update keeps the categoricals of the schema.
+    """
+    table = result.sort_index().reset_index()
+    return table.astype({col: object for col in table.columns if isinstance(table[col].dtype, pd.CategoricalDtype)})
+
+def _assert_same(result, expected):
+    pd.testing.assert_frame_equal(_plain(result), _plain(expected), check_dtype=False, check_exact=False, rtol=1e-9)
+
+def _assert_merge_equals_one_pass(make, df, chunksize=97):
+    expected = make().update(df).result()
+    chunks = row_chunks(df, chunksize=chunksize)
+    updated = make()
+    for chunk in chunks:
+        updated.update(chunk)
+    _assert_same(updated.result(), expected)
+    _assert_same(_merged(make, chunks).result(), expected)
+    return expected
+
+def test_moments_match_pandas(experiment):
+    expected = experiment.groupby(KEYS, observed=True)['response_value'].agg(['count', 'mean', 'std'])
+    result = _assert_merge_equals_one_pass(lambda: MomentAccumulator(KEYS, 'response_value'), experiment)
+    _assert_same(result, expected)
+
+def test_moments_keep_groups_without_values():
+    df = pd.DataFrame({'group': ['a', 'a', 'b', 'b', 'a'], 'value': [1.0, 3.0, np.nan, np.nan, 5.0]})
+    accumulator = _merged(lambda: MomentAccumulator(['group'], 'value'), [df.iloc[:2], df.iloc[2:4], df.iloc[4:]])
+    result = accumulator.result()
+    assert result.loc['a', 'count'] == 3 and result.loc['a', 'mean'] == 3.0 and result.loc['a', 'std'] == 2.0
+    assert result.loc['b', 'count'] == 0 and np.isnan(result.loc['b', 'mean'])
+
+def test_counts_match_pandas(experiment):
+    expected = experiment.groupby(['source', 'question'], observed=True).size()
+    result = _assert_merge_equals_one_pass(lambda: CountAccumulator(['source', 'question']), experiment)
+    _assert_same(result, expected)
+
+def test_binned_counts():
+    df = pd.DataFrame({'group': ['a'] * 4 + ['b'] * 2, 'value': [0.0, 0.4, 0.6, 1.0, 0.2, np.nan]})
+    accumulator = _merged(lambda: CountAccumulator(['group', 'value'], bins=[0, 0.5, 1]), [df.iloc[:3], df.iloc[3:]])
+    assert accumulator.result().tolist() == [2, 2, 1]
+
+def test_distinct_match_pandas(experiment):
+    expected = experiment.groupby('length', observed=True)['participant_id'].nunique()
+    result = _assert_merge_equals_one_pass(lambda: DistinctAccumulator(['length'], 'participant_id'), experiment)
+    _assert_same(result, expected)
+
+def test_first_values_match_pandas(experiment):
+    df = experiment.copy()
+    # A missing first value is taken from a later chunk, as groupby().first() does
+    df['age'] = df['age'].astype(float)
+    df.loc[df.index[0], 'age'] = np.nan
+    expected = df.groupby('participant_id', observed=True)[['is_mobile', 'age']].first()
+    result = _assert_merge_equals_one_pass(lambda: FirstValueAccumulator('participant_id', ['is_mobile', 'age']), df, chunksize=5)
+    _assert_same(result, expected)
+
+def test_chunked_and_parallel_descriptives_match_one_pass(experiment):
+    expected = accumulate_descriptives([experiment]).tables()
+    for chunks, n_jobs in [(row_chunks(experiment, chunksize=100), 1), (row_chunks(experiment, n_chunks=3), 2)]:
+        tables = accumulate_descriptives(chunks, n_jobs).tables()
+        assert list(tables) == list(expected)
+        for name, table in tables.items():
+            _assert_same(table, expected[name])
@@ -0,0 +1,48 @@
+# Tests of the Bayesian models per outcome (run from "Data Analysis": python -m pytest tests)
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analyze.bayesian_analysis import analyze_outcomes_bayesian
+from analyze.bayesian_fitting import FractionalBinomialBayesMixedGLM
+from analyze.schema import apply_column_schema, participant_dtype
+
+def _experiment_rows(seed=0):
+    """Accuracy (0/1), comprehension (0-1) and reaction time rows; the two test_slugs have different participants."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for p in range(16):
+        test_slug = 'test-a' if p < 8 else 'test-b'
+        length = 'longer' if p % 2 else 'shorter'
+        for source in ['ai', 'original', 'programmatic']:
+            for _ in range(3):
+                rows.append((f"p{p:02d}", test_slug, length, source, 'accuracy', float(rng.integers(0, 2))))
+                rows.append((f"p{p:02d}", test_slug, length, source, 'comprehension', round(rng.uniform(), 2)))
+                rows.append((f"p{p:02d}", test_slug, length, source, 'reaction_time', rng.uniform(1000, 5000)))
+    df = pd.DataFrame(rows, columns=['participant_id', 'test_slug', 'length', 'source', 'question', 'response_value'])
+    return apply_column_schema(df, participant_dtype(df['participant_id']))
+
+def test_binary_and_bounded_outcomes_are_fitted_per_stratum():
+    df = _experiment_rows()
+    results = analyze_outcomes_bayesian(df, ['accuracy', 'comprehension', 'reaction_time'], strata_column='test_slug')
+
+    # Reaction time is not between 0 and 1, so it is skipped
+    assert set(results) == {(outcome, slug) for outcome in ['accuracy', 'comprehension'] for slug in ['test-a', 'test-b']}
+    for (outcome, slug), result in results.items():
+        assert not isinstance(result, Exception), result
+        assert np.isfinite(result.fe_mean).all()
+        # Each stratum's design only has the participants of that stratum
+        expected = {f"C(participant_id)[p{p:02d}]" for p in (range(8) if slug == 'test-a' else range(8, 16))}
+        assert set(result.model.vc_names) == expected
+    assert isinstance(results[('comprehension', 'test-a')].model, FractionalBinomialBayesMixedGLM)
+    assert not isinstance(results[('accuracy', 'test-a')].model, FractionalBinomialBayesMixedGLM)
+
+def test_bounds_rescale_an_outcome():
+    df = _experiment_rows()
+    results = analyze_outcomes_bayesian(df, ['reaction_time'], bounds={'reaction_time': (0, 10000)})
+    result = results[('reaction_time', None)]
+    assert not isinstance(result, Exception), result
+    assert result.model.endog.max() <= 1
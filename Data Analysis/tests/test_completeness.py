@@ -0,0 +1,61 @@
+# Tests of the completeness index and question partitions (run from "Data Analysis": python -m pytest tests)
+
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analyze.completeness import CompletenessIndex
+from analyze.partitions import QuestionPartitions, question_rows, full_frame
+from analyze.schema import apply_column_schema, participant_dtype
+
+def _experiment_rows():
+    """
+    Shuffled rows where, for accuracy, p1 has every source and p2 lacks programmatic;
+    nobody has programmatic for effort, and p3 has no effort rows at all.
+    """
+    rows = [('p1', 'accuracy', source) for source in ['ai', 'original', 'programmatic']]
+    rows += [('p2', 'accuracy', 'ai'), ('p2', 'accuracy', 'original'), ('p3', 'accuracy', 'ai'),
+             ('p3', 'accuracy', 'original'), ('p3', 'accuracy', 'programmatic')]
+    rows += [(p, 'effort', source) for p in ['p1', 'p2'] for source in ['ai', 'original']]
+    df = pd.DataFrame(rows, columns=['participant_id', 'question', 'source'])
+    df['response_value'] = range(len(df))
+    df = df.sample(frac=1, random_state=0)
+    df.index = df.index + 100
+    return apply_column_schema(df, participant_dtype(df['participant_id']))
+
+def test_incomplete_participants_and_expected_sources():
+    index = CompletenessIndex(_experiment_rows())
+    assert index.incomplete_participants('accuracy') == ['p2']
+    assert index.expected_sources('accuracy') == ['ai', 'original', 'programmatic']
+    # A source nobody has is not expected, and p3 without effort rows is not incomplete
+    assert index.incomplete_participants('effort') == []
+    assert index.expected_sources('effort') == ['ai', 'original']
+    # Known DVs without rows and unknown DVs have no incomplete participants
+    assert index.incomplete_participants('confidence') == []
+    assert index.incomplete_participants('unknown') == [] and index.expected_sources('unknown') == []
+
+def test_mask_per_dv_and_per_row():
+    df = _experiment_rows()
+    index = CompletenessIndex(df)
+    assert index.mask(df, 'accuracy').index.equals(df.index)
+    pd.testing.assert_series_equal(index.mask(df, 'accuracy'), df['participant_id'] != 'p2', check_names=False)
+    # With dv=None, each row is checked against its own question: p2 is complete for effort
+    pd.testing.assert_series_equal(index.mask(df), (df['participant_id'] != 'p2') | (df['question'] == 'effort'), check_names=False)
+    # p3 has no effort rows, so is not complete for effort either
+    pd.testing.assert_series_equal(index.mask(df, 'effort'), df['participant_id'] != 'p3', check_names=False)
+    with pytest.raises(KeyError):
+        index.mask(df, 'unknown')
+
+def test_partitions_match_filtering():
+    df = _experiment_rows()
+    partitions = QuestionPartitions(df)
+    assert len(full_frame(partitions)) == len(df) and full_frame(df) is df
+    for question in df['question'].cat.categories:
+        expected = df[df['question'] == question]
+        # Same rows, in their original order and with their index
+        pd.testing.assert_frame_equal(question_rows(partitions, question), expected)
+        pd.testing.assert_frame_equal(question_rows(df, question), expected)
+    assert 'confidence' in partitions and question_rows(partitions, 'confidence').empty
+    assert 'unknown' not in partitions and partitions.rows('unknown').empty
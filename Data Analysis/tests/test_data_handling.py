@@ -0,0 +1,43 @@
+# Tests of the loading and derived DVs (run from "Data Analysis": python -m pytest tests)
+
+import contextlib
+import io
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from analyze.data_handling import load_and_inspect_data, create_new_dvs
+
+@pytest.fixture(scope='module')
+def experiment():
+    with contextlib.redirect_stdout(io.StringIO()):
+        df, _ = load_and_inspect_data(os.path.join(ROOT, 'data', 'test_data_evaluated.csv'),
+                                      os.path.join(ROOT, 'data', 'questionnaire_data_wrangled.csv'), inspect=False)
+    return df
+
+def test_new_dvs_are_group_means(experiment):
+    extended = create_new_dvs(experiment)
+    new_rows = extended.iloc[len(experiment):]
+    assert len(extended) - len(experiment) == len(new_rows)
+    expected = (experiment[experiment['question'].isin(['accuracy', 'comprehension'])]
+                .groupby(['test_slug', 'participant_id'], observed=True)['response_value'].mean())
+    objective = new_rows[new_rows['question'] == 'objective_quality'].set_index(['test_slug', 'participant_id'])['response_value']
+    pd.testing.assert_series_equal(objective.sort_index(), expected.sort_index(), check_names=False)
+
+@pytest.mark.parametrize('key', ['test_slug', 'participant_id'])
+def test_rows_with_a_missing_key_get_no_new_rows(experiment, key):
+    """Rows without a test_slug or participant_id are kept, but (like groupby) add no aggregate rows."""
+    orphans = experiment.iloc[:5].copy()
+    orphans[key] = np.nan
+    df = pd.concat([orphans, experiment], ignore_index=True)
+    df[key] = df[key].astype(experiment[key].dtype)
+
+    extended = create_new_dvs(df)
+    expected = create_new_dvs(experiment)
+    assert len(extended) == len(expected) + len(orphans)
+    pd.testing.assert_frame_equal(extended.iloc[len(df):].reset_index(drop=True),
+                                  expected.iloc[len(experiment):].reset_index(drop=True))
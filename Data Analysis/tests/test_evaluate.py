@@ -0,0 +1,47 @@
+# Regression tests of the vectorized and parallel scoring (run from "Data Analysis": python -m pytest tests)
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import evaluate
+from storage import read_table
+
+def test_scores_of_a_frame_with_duplicate_index():
+    """A frame concatenated without ignore_index scores like evaluate_response row by row."""
+    answers = evaluate.load_answer_key(os.path.join(ROOT, evaluate.ANSWER_KEY_PATH))
+    df = read_table(os.path.join(ROOT, 'data', 'test_data_wrangled.csv'))
+    df = pd.concat([df, df])
+
+    scores = evaluate.evaluate_responses(df, answers)
+    expected = df.apply(lambda row: evaluate.evaluate_response(row, answers), axis=1)
+    assert scores.index.equals(df.index)
+    np.testing.assert_allclose(scores.to_numpy(), expected.to_numpy(dtype=float))
+
+def test_participant_shards():
+    df = read_table(os.path.join(ROOT, 'data', 'test_data_wrangled.csv'))
+    shards = evaluate.participant_shards(df, 3)
+    assert len(shards) == 3
+    # Every row in exactly one shard, in order, and each participant in one shard only
+    assert np.array_equal(np.sort(np.concatenate(shards)), np.arange(len(df)))
+    assert all((np.diff(positions) > 0).all() for positions in shards)
+    shard_of_participant = {}
+    for shard, positions in enumerate(shards):
+        for participant in df['participant_id'].iloc[positions].unique():
+            assert shard_of_participant.setdefault(participant, shard) == shard
+    # More shards than participants leaves no empty shard
+    assert len(evaluate.participant_shards(df, df['participant_id'].nunique() + 5)) == df['participant_id'].nunique()
+
+def test_parallel_scores_match_serial():
+    answers = evaluate.load_answer_key(os.path.join(ROOT, evaluate.ANSWER_KEY_PATH))
+    df = read_table(os.path.join(ROOT, 'data', 'test_data_wrangled.csv'))
+    # Shuffled and with a gapped index, so the scores must be put back by position
+    df = df.sample(frac=1, random_state=0)
+    df.index = df.index * 2
+    for rule in ['recall', 'jaccard']:
+        expected = evaluate.evaluate_responses(df, answers, rule)
+        for n_jobs in [2, 3]:
+            pd.testing.assert_series_equal(evaluate.evaluate_responses_parallel(df, answers, rule, n_jobs=n_jobs), expected)
@@ -0,0 +1,86 @@
+# The batched mixed ANOVA against pingouin (run from "Data Analysis": python -m pytest tests)
+
+import contextlib
+import io
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pingouin as pg
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from analyze.anova_analysis import perform_anovas
+from analyze.data_handling import load_and_inspect_data, create_new_dvs
+from analyze.mixed_anova import mixed_anova_tables
+
+DVS = ['confidence', 'comprehension', 'satisfaction', 'effort', 'reaction_time', 'general_quality', 'subjective_quality', 'objective_quality']
+
+@pytest.fixture(scope='module')
+def experiment():
+    with contextlib.redirect_stdout(io.StringIO()):
+        df, _ = load_and_inspect_data(os.path.join(ROOT, 'data', 'test_data_evaluated.csv'),
+                                      os.path.join(ROOT, 'data', 'questionnaire_data_wrangled.csv'), inspect=False)
+    return create_new_dvs(df)
+
+def _pingouin_table(df, dv):
+    df_dv = df[df['question'] == dv].rename(columns={'response_value': dv})
+    for col in ['source', 'length', 'participant_id']:
+        df_dv[col] = df_dv[col].cat.remove_unused_categories()
+    return pg.mixed_anova(data=df_dv, dv=dv, within='source', between='length', subject='participant_code')
+
+def _assert_same_table(table, expected, rtol=1e-9):
+    assert list(table.columns) == list(expected.columns)
+    assert list(table['Source']) == list(expected['Source'])
+    numeric = expected.columns.drop(['Source', 'sphericity'], errors='ignore')
+    np.testing.assert_allclose(table[numeric].to_numpy(dtype=float), expected[numeric].to_numpy(dtype=float), rtol=rtol)
+
+def test_batched_tables_match_pingouin(experiment):
+    tables = mixed_anova_tables(experiment, DVS)
+    assert list(tables) == DVS
+    for dv in DVS:
+        _assert_same_table(tables[dv], _pingouin_table(experiment, dv))
+
+def test_subject_in_both_groups_raises(experiment):
+    df = experiment.copy()
+    rows = (df['participant_code'] == df['participant_code'].iloc[0]) & (df['question'] == 'effort')
+    df.loc[rows[rows].index[:2], 'length'] = ['longer', 'shorter']
+    with pytest.raises(ValueError, match='Subject IDs cannot overlap'):
+        mixed_anova_tables(df, DVS)
+
+def test_failing_dv_falls_back_to_pingouin(experiment):
+    """A DV the batch cannot compute gets pingouin's result, the other DVs keep their batched tables."""
+    df = experiment.copy()
+    rows = (df['participant_code'] == df['participant_code'].iloc[0]) & (df['question'] == 'effort')
+    df.loc[rows[rows].index[:2], 'length'] = ['longer', 'shorter']
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        batched = perform_anovas(df, DVS, engine='batched')
+        expected = perform_anovas(df, DVS, engine='pingouin')
+    assert "Batched ANOVA failed for effort" in output.getvalue()
+    for dv in DVS:
+        if expected[dv]['table'] is None:
+            assert batched[dv]['table'] is None
+        else:
+            _assert_same_table(batched[dv]['table'], expected[dv]['table'])
+
+def test_engines_and_jobs_give_the_same_results(experiment):
+    """The batched engine and the process pool give pingouin's serial results, printed in the same order."""
+    with contextlib.redirect_stdout(io.StringIO()) as serial_output:
+        serial = perform_anovas(experiment, DVS)
+    with contextlib.redirect_stdout(io.StringIO()) as parallel_output:
+        parallel = perform_anovas(experiment, DVS, n_jobs=2)
+    with contextlib.redirect_stdout(io.StringIO()):
+        batched = perform_anovas(experiment, DVS, engine='batched')
+    assert parallel_output.getvalue() == serial_output.getvalue()
+    assert list(parallel) == list(batched) == DVS
+    for dv in DVS:
+        for results in [parallel, batched]:
+            _assert_same_table(results[dv]['table'], serial[dv]['table'])
+            pd.testing.assert_frame_equal(results[dv]['data'], serial[dv]['data'])
+            # No post-hoc tests are run without a significant effect
+            if serial[dv]['posthoc'] is None:
+                assert results[dv]['posthoc'] is None
+            else:
+                pd.testing.assert_frame_equal(results[dv]['posthoc'], serial[dv]['posthoc'])
+    assert any(serial[dv]['posthoc'] is not None for dv in DVS)
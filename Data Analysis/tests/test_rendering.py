@@ -0,0 +1,83 @@
+# Tests of the plot rendering and its manifest (run from "Data Analysis": python -m pytest tests)
+
+import contextlib
+import io
+import json
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analyze.rendering import manifest_path, plot_key, render_plots
+
+def draw_line(fig, data, title=''):
+    ax = fig.add_subplot()
+    ax.plot(data['x'], data['y'])
+    ax.set_title(title)
+
+def draw_failing(fig, data):
+    raise ValueError('no data')
+
+def _data(y=(1.0, 3.0, 2.0)):
+    return pd.DataFrame({'x': [0, 1, 2], 'y': list(y)})
+
+def _render(jobs, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        results = render_plots(jobs, **kwargs)
+    return results, output.getvalue()
+
+def test_unchanged_plots_are_skipped(tmp_path):
+    plots = tmp_path / 'plots'
+    plots.mkdir()
+    jobs = [(draw_line, {'data': _data(), 'title': name}, str(plots / f"{name}.png"), (4, 3)) for name in ['a', 'b']]
+
+    results, output = _render(jobs)
+    assert results == [(job[2], None) for job in jobs] and output.count('Saved plot to') == 2
+    with open(manifest_path(str(plots))) as f:
+        assert json.load(f) == {'a.png': plot_key(jobs[0]), 'b.png': plot_key(jobs[1])}
+    mtimes = [os.path.getmtime(job[2]) for job in jobs]
+
+    # Nothing changed: no plot is drawn again
+    results, output = _render(jobs)
+    assert results == [(job[2], None) for job in jobs] and output.count('Plot unchanged') == 2
+    assert [os.path.getmtime(job[2]) for job in jobs] == mtimes
+
+    # New data, a deleted file or force=True redraw the plot
+    jobs[0] = (draw_line, {'data': _data((1.0, 3.0, 2.5)), 'title': 'a'}, jobs[0][2], (4, 3))
+    _, output = _render(jobs)
+    assert output.splitlines() == [f"Saved plot to: {jobs[0][2]}", f"Plot unchanged: {jobs[1][2]}"]
+    os.remove(jobs[1][2])
+    _, output = _render(jobs)
+    assert output.splitlines() == [f"Plot unchanged: {jobs[0][2]}", f"Saved plot to: {jobs[1][2]}"]
+    _, output = _render(jobs, force=True)
+    assert output.count('Saved plot to') == 2
+
+def test_failed_plots_are_not_recorded(tmp_path):
+    plots = tmp_path / 'plots'
+    plots.mkdir()
+    path = str(plots / 'failing.png')
+    results, output = _render([(draw_failing, {'data': _data()}, path, (4, 3))])
+    assert results == [(path, 'no data')] and 'Error saving plot' in output
+    # Neither the plot nor its temporary file is left behind
+    assert os.listdir(plots) == []
+    with open(manifest_path(str(plots))) as f:
+        assert json.load(f) == {}
+
+def test_key_covers_the_inputs():
+    job = (draw_line, {'data': _data(), 'title': 'a'}, 'a.png', (4, 3))
+    assert plot_key(job) == plot_key((draw_line, {'title': 'a', 'data': _data()}, 'b.png', (4, 3)))
+    assert plot_key(job) != plot_key((draw_line, {'data': _data(), 'title': 'b'}, 'a.png', (4, 3)))
+    assert plot_key(job) != plot_key((draw_line, {'data': _data(), 'title': 'a'}, 'a.png', (5, 3)))
+    # Categories set the order of categorical axes, unused ones included
+    categorical = _data().assign(x=pd.Categorical(['a', 'b', 'c']))
+    reordered = categorical.assign(x=categorical['x'].cat.set_categories(['c', 'b', 'a']))
+    assert plot_key((draw_line, {'data': categorical}, 'a.png', (4, 3))) != plot_key((draw_line, {'data': reordered}, 'a.png', (4, 3)))
+
+def test_parallel_rendering_saves_the_same_plots(tmp_path):
+    jobs = [(draw_line, {'data': _data((1.0, i, 2.0)), 'title': str(i)}, str(tmp_path / f"{i}.png"), (4, 3)) for i in range(3)]
+    results, output = _render(jobs, n_jobs=2)
+    assert results == [(job[2], None) for job in jobs]
+    # Printed in job order, whichever process finished first
+    assert output.splitlines() == [f"Saved plot to: {job[2]}" for job in jobs]
+    _, output = _render(jobs, n_jobs=2)
+    assert output.count('Plot unchanged') == 3
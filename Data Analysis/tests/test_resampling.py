@@ -0,0 +1,70 @@
+# Tests of the permutation and cluster bootstrap inference (run from "Data Analysis": python -m pytest tests)
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pingouin as pg
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analyze.resampling import BATCH_SIZE, resampling_inference
+
+SOURCES = ['ai', 'original', 'programmatic']
+
+def _dv_rows(seed=0):
+    """Two responses per participant and source; 'original' is 2 points higher, length has no effect."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for p in range(20):
+        subject_effect = rng.normal()
+        for s, source in enumerate(SOURCES):
+            for _ in range(2):
+                rows.append((p, 'longer' if p < 10 else 'shorter', source, subject_effect + 2.0 * (s == 1) + rng.normal(scale=0.5)))
+    df = pd.DataFrame(rows, columns=['participant_code', 'length', 'source', 'score'])
+    df['length'] = df['length'].astype('category')
+    df['source'] = df['source'].astype('category')
+    return df
+
+def test_observed_statistics():
+    df = _dv_rows()
+    effects, contrasts, cell_means = resampling_inference(df, 'score', n_resamples=200)
+
+    # The observed F values are those of the mixed ANOVA
+    expected = pg.mixed_anova(data=df, dv='score', within='source', between='length', subject='participant_code')
+    np.testing.assert_allclose(effects['F'], expected['F'], rtol=1e-9)
+    assert list(effects['Source']) == list(expected['Source'])
+
+    # Cell means and differences of the per-participant means per source
+    subject_means = df.groupby(['participant_code', 'length', 'source'], observed=True)['score'].mean().unstack()
+    expected_cells = subject_means.groupby(level='length').mean().stack()
+    np.testing.assert_allclose(cell_means['mean'], expected_cells.to_numpy(), rtol=1e-9)
+    assert list(zip(contrasts['A'], contrasts['B'])) == [('ai', 'original'), ('ai', 'programmatic'), ('original', 'programmatic')]
+    np.testing.assert_allclose(contrasts['mean(A-B)'], [(subject_means['ai'] - subject_means['original']).mean(),
+                                                        (subject_means['ai'] - subject_means['programmatic']).mean(),
+                                                        (subject_means['original'] - subject_means['programmatic']).mean()])
+
+def test_p_values_and_intervals():
+    n_resamples = 400
+    effects, contrasts, cell_means = resampling_inference(_dv_rows(), 'score', n_resamples=n_resamples)
+    p = effects.set_index('Source')['p-perm']
+    # No permutation beats the large source effect, the p-value is the smallest possible
+    assert p['source'] == 1 / (n_resamples + 1)
+    assert p['length'] > 0.05
+    assert ((effects['p-perm'] > 0) & (effects['p-perm'] <= 1)).all()
+    # Contrasts with 'original' are significant, ai vs programmatic is not
+    assert list(contrasts['p-perm'] < 0.01) == [True, False, True]
+    for table, estimate in [(contrasts, 'mean(A-B)'), (cell_means, 'mean')]:
+        assert ((table['CI95% low'] <= table[estimate]) & (table[estimate] <= table['CI95% high'])).all()
+
+def test_results_depend_on_the_seed_and_not_on_n_jobs():
+    df = _dv_rows()
+    # More than one batch, so the jobs get different batches
+    n_resamples = 2 * BATCH_SIZE + 100
+    serial = resampling_inference(df, 'score', n_resamples=n_resamples, seed=1, n_jobs=1)
+    repeated = resampling_inference(df, 'score', n_resamples=n_resamples, seed=1, n_jobs=1)
+    parallel = resampling_inference(df, 'score', n_resamples=n_resamples, seed=1, n_jobs=2)
+    for a, b, c in zip(serial, repeated, parallel):
+        pd.testing.assert_frame_equal(a, b)
+        pd.testing.assert_frame_equal(a, c)
+    other_seed = resampling_inference(df, 'score', n_resamples=n_resamples, seed=2, n_jobs=1)
+    assert not other_seed[1]['CI95% low'].equals(serial[1]['CI95% low'])
@@ -0,0 +1,56 @@
+# Tests of the results store (run from "Data Analysis": python -m pytest tests)
+
+import importlib.util
+import os
+import sys
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analyze.results_store import ResultsStore
+
+BACKENDS = ['sqlite', pytest.param('parquet', marks=pytest.mark.skipif(importlib.util.find_spec('pyarrow') is None,
+                                                                      reason='parquet needs pyarrow'))]
+
+def _result_table():
+    """A table like the analysis results: categorical named index, MultiIndex columns and mixed-type values."""
+    return pd.DataFrame({('mean', 'ai'): [1.5, 2.5], ('mean', 'original'): [3.0, 4.0], ('test', 'sphericity'): [True, '-']},
+                        index=pd.CategoricalIndex(['longer', 'shorter'], name='length'))
+
+def _expected():
+    """The table as it is stored and loaded back."""
+    return pd.DataFrame({'length': ['longer', 'shorter'], 'mean_ai': [1.5, 2.5], 'mean_original': [3.0, 4.0],
+                         'test_sphericity': ['True', '-']})
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_round_trip_per_run_step_and_dv(tmp_path, backend):
+    store = ResultsStore(str(tmp_path), backend=backend, run_id='run-1')
+    store.save('anova', _result_table(), 'effort')
+    store.save('anova', _result_table().iloc[::-1], 'accuracy')
+    store.save('anova', None, 'confidence')
+    pd.testing.assert_frame_equal(store.load('anova', 'effort'), _expected())
+    pd.testing.assert_frame_equal(store.load('anova', 'accuracy'), _expected().iloc[::-1].reset_index(drop=True))
+
+    # Saving again replaces the table of that run, step and DV; other runs keep theirs
+    store.save('anova', _result_table().iloc[1:], 'effort')
+    later = ResultsStore(str(tmp_path), backend=backend, run_id='run-2')
+    later.save_all('anova', {'effort': _result_table(), 'confidence': None})
+    pd.testing.assert_frame_equal(store.load('anova', 'effort'), _expected().iloc[1:].reset_index(drop=True))
+    pd.testing.assert_frame_equal(later.load('anova', 'effort', run_id='run-1'), store.load('anova', 'effort'))
+    pd.testing.assert_frame_equal(later.load('anova', 'effort'), _expected())
+    assert store.runs() == later.runs() == ['run-1', 'run-2']
+
+def test_sqlite_steps_take_new_columns(tmp_path):
+    store = ResultsStore(str(tmp_path), backend='sqlite')
+    store.save('posthoc', pd.DataFrame({'A': ['ai'], 'p-unc': [0.2]}), 'effort')
+    store.save('posthoc', pd.DataFrame({'A': ['ai'], 'p-unc': [0.3], 'p-corr': [0.6]}), 'accuracy')
+    pd.testing.assert_frame_equal(store.load('posthoc', 'effort'), pd.DataFrame({'A': ['ai'], 'p-unc': [0.2]}))
+    pd.testing.assert_frame_equal(store.load('posthoc', 'accuracy'), pd.DataFrame({'A': ['ai'], 'p-unc': [0.3], 'p-corr': [0.6]}))
+
+def test_new_stores_get_unique_run_ids(tmp_path):
+    run_ids = {ResultsStore(str(tmp_path)).run_id for _ in range(20)}
+    assert len(run_ids) == 20
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError, match='Unknown results backend'):
+        ResultsStore(str(tmp_path), backend='csv')
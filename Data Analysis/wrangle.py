@@ -1,55 +1,280 @@
 # wrangle.py
 
+import hashlib
+import json
+import os
+import numpy as np
 import pandas as pd
+from storage import intermediate_path, write_table
+import database
+from cohort import DEFAULT_COHORT, participant_mask, participant_sql, test_slug_mask, test_slug_sql
 
-def wrangle_data():
-    df_test_responses = pd.read_csv("data/init/test_responses.csv")
-    df_participants = pd.read_csv("data/init/participants.csv")
-    df_questionnaire_responses = pd.read_csv("data/init/questionnaire_responses.csv")
+# Keys that identify a single answer in each response table
+TEST_GROUP_KEYS = ['test_slug', 'question_id', 'participant_id']
+QUESTIONNAIRE_GROUP_KEYS = ['questionnaire_type', 'question_id', 'participant_id']
 
-    # Filter df_participants to keep only rows where is_controlled is True
-    df_participants_filtered = df_participants[df_participants['is_controlled'] == True].copy()
+# Test response columns that are constant within an answer, and their wrangled names
+TEST_FIRST_COLUMNS = {'content_length': 'length', 'content_source': 'source', 'reaction_time_ms': 'reaction_time'}
 
-    # Convert `created_at` column to datetime in '%Y-%m-%d' format
-    df_participants_filtered['date'] = pd.to_datetime(df_participants_filtered['created_at']).dt.strftime('%Y-%m-%d')
+# Where incremental runs keep their high-water marks and running aggregates
+STATE_DIR = "data/state"
 
-    # Convert `timestamp` column to datetime in '%Y-%m-%d' format
-    df_test_responses['date'] = pd.to_datetime(df_test_responses['timestamp']).dt.strftime('%Y-%m-%d')
-    df_questionnaire_responses['date'] = pd.to_datetime(df_questionnaire_responses['timestamp']).dt.strftime('%Y-%m-%d')
+# Response columns needed for wrangling, selected in the database query
+RESPONSE_COLUMNS = {
+    'test_responses': ['id'] + TEST_GROUP_KEYS + ['response_value'] + list(TEST_FIRST_COLUMNS) + ['timestamp'],
+    'questionnaire_responses': ['id'] + QUESTIONNAIRE_GROUP_KEYS + ['response_value', 'timestamp'],
+}
 
-    # Filter the participants for Thursday (2025-04-24) and Friday (2025-04-25)
-    df_participants_valid = df_participants_filtered[df_participants_filtered['date'] >= '2025-04-25'].copy()
+def _read_in_chunks(path, chunksize=None, usecols=None):
+    """Yields the CSV file at `path` whole, or in chunks of at most `chunksize` rows."""
+    if chunksize is None:
+        yield pd.read_csv(path, usecols=usecols)
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=usecols)
+
+def _aggregate_chunk(chunk, keys, first_columns=()):
+    """
+    Aggregates a chunk of responses to one row per group of `keys`, using only
+    native groupby and NumPy primitives (no per-group Python callbacks).
+
+    The `id`s of a group are joined with '-', `response_value` becomes a list
+    when the group has several rows and stays a scalar otherwise, and every
+    column in `first_columns` keeps its first non-null value.
+    Groups come out sorted by `keys`, in the same order as a sorted groupby.
+    """
+    chunk = chunk.dropna(subset=keys)
+    grouped = chunk.groupby(keys, sort=True)
+    aggregated = grouped[list(first_columns)].first() if first_columns else grouped.size().to_frame()[[]]
+
+    # Positions of the rows ordered by group, keeping the original row order within a group
+    order = np.argsort(grouped.ngroup().to_numpy(), kind='stable')
+    sizes = grouped.size().to_numpy()
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    is_first = np.zeros(len(order), dtype=bool)
+    is_first[starts] = True
+
+    # Join ids with '-' by prefixing every non-leading id and summing the strings per group
+    ids = chunk['id'].astype(str).to_numpy(dtype=object)[order]
+    ids = np.where(is_first, ids, '-' + ids)
+    aggregated['id'] = np.add.reduceat(ids, starts) if len(ids) else ids
+
+    # Single-row groups take their value directly, only multi-row groups are turned into lists
+    values = chunk['response_value'].to_numpy(dtype=object)[order]
+    response_value = values[starts]
+    for group in np.flatnonzero(sizes > 1):
+        response_value[group] = values[starts[group]:starts[group] + sizes[group]].tolist()
+    aggregated['response_value'] = response_value
+
+    return aggregated[['id', 'response_value'] + list(first_columns)].reset_index()
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def _merge_partials(partials, keys):
+    """
+    Merges partial aggregates (possibly from several chunks) into one row per key.
+    Only groups split across chunks need merging: their ids are joined and their
+    response values concatenated in chunk order, every other column keeps its first value.
+    """
+    if len(partials) == 1:
+        return partials[0]
+
+    df_partials = pd.concat(partials, ignore_index=True)
+    is_split = df_partials.duplicated(keys, keep=False)
+    if is_split.any():
+        df_split = df_partials[is_split]
+        aggregations = {col: (col, 'first') for col in df_partials.columns if col not in keys}
+        aggregations['id'] = ('id', '-'.join)
+        aggregations['response_value'] = ('response_value', lambda x: [v for value in x for v in _as_list(value)])
+        df_merged = df_split.groupby(keys, sort=False).agg(**aggregations).reset_index()
+        df_partials = pd.concat([df_partials[~is_split], df_merged], ignore_index=True)
+
+    return df_partials.sort_values(keys, kind='stable').reset_index(drop=True)
+
+def aggregate_test_responses(chunks, participant_ids=None, previous=None, cohort=None):
+    """
+    Aggregates test responses, given as an iterable of DataFrame chunks, to one
+    row per (test_slug, question_id, participant_id).
+
+    Rows of participants not in `participant_ids` (if given), practice rows and rows
+    of tests outside the `cohort`'s test slugs (if given) are dropped before aggregating, so peak memory grows with the number of answers
+    kept and not with the number of rows read.
+
+    `previous` is an earlier aggregate of older rows. Answers that got new rows
+    are merged with it, so multi-row answers split across runs are recomputed.
+    """
+    partials = [] if previous is None else [previous]
+    for chunk in chunks:
+        if participant_ids is not None:
+            chunk = chunk[chunk['participant_id'].isin(participant_ids)]
+        chunk = chunk[test_slug_mask(chunk, cohort or DEFAULT_COHORT)]
+        if not chunk.empty:
+            partial = _aggregate_chunk(chunk, TEST_GROUP_KEYS, TEST_FIRST_COLUMNS.keys())
+            partials.append(partial.rename(columns=TEST_FIRST_COLUMNS))
+
+    if not partials:
+        return pd.DataFrame(columns=TEST_GROUP_KEYS + ['id', 'response_value'] + list(TEST_FIRST_COLUMNS.values()))
+
+    # Multi-select answers span several rows and become lists, single answers stay scalars
+    return _merge_partials(partials, TEST_GROUP_KEYS)
+
+def aggregate_questionnaire_responses(chunks, participant_ids=None, previous=None):
+    """Aggregates questionnaire responses, given as an iterable of DataFrame chunks (see aggregate_test_responses)."""
+    partials = [] if previous is None else [previous]
+    for chunk in chunks:
+        if participant_ids is not None:
+            chunk = chunk[chunk['participant_id'].isin(participant_ids)]
+        if not chunk.empty:
+            partials.append(_aggregate_chunk(chunk, QUESTIONNAIRE_GROUP_KEYS))
+
+    if not partials:
+        return pd.DataFrame(columns=QUESTIONNAIRE_GROUP_KEYS + ['id', 'response_value'])
+
+    aggregated = _merge_partials(partials, QUESTIONNAIRE_GROUP_KEYS)
+    # Each questionnaire question is answered once, on a 7 point Likert scale
+    aggregated['response_value'] = aggregated['response_value'].astype(int)
+    return aggregated
+
+def _response_chunks(table, chunksize=None, db_url=None, watermark=None, cohort=None):
+    """
+    Yields the needed columns of a response table in chunks, from data/init/<table>.csv
+    or, if `db_url` is given, from the database. Database reads push the `cohort`'s
+    participant and test filters (if given), the practice filter and the high-water
+    mark (if given) into the query, so excluded rows are never fetched.
+    """
+    if db_url is None:
+        yield from _read_in_chunks(f"data/init/{table}.csv", chunksize, usecols=RESPONSE_COLUMNS[table])
+        return
+
+    conditions, params = [], []
+    if cohort is not None:
+        participant_condition, participant_params = participant_sql(cohort)
+        conditions.append(f"participant_id IN (SELECT id FROM participants WHERE {participant_condition})")
+        params.extend(participant_params)
+    if table == 'test_responses':
+        slug_condition, slug_params = test_slug_sql(cohort or DEFAULT_COHORT)
+        conditions.append(slug_condition)
+        params.extend(slug_params)
+    if watermark is not None:
+        conditions.append("id > {p}")
+        params.append(watermark['id'])
+
+    yield from database.read_table_chunks(db_url, table, RESPONSE_COLUMNS[table], where=" AND ".join(conditions) or None,
+                                          params=params, batch_size=chunksize or database.DEFAULT_BATCH_SIZE)
+
+def _rows_after_watermark(chunks, watermark, latest):
+    """
+    Yields only the rows of `chunks` whose serial id is above the table's high-water
+    mark, and records the id and timestamp of the highest row seen in `latest`.
+    Every chunk is filtered against `watermark` as it was at the start, the rows need
+    not be sorted by id: the caller moves the mark to `latest` once all chunks are read.
+    """
+    for chunk in chunks:
+        chunk = chunk[chunk['id'] > watermark['id']]
+        if not chunk.empty:
+            last_row = chunk.iloc[chunk['id'].to_numpy().argmax()]
+            if last_row['id'] > latest['id']:
+                latest['id'] = int(last_row['id'])
+                latest['timestamp'] = str(last_row['timestamp'])
+        yield chunk
+
+def _cohort_state_dir(state_dir, cohort):
+    """The state directory of the incremental runs of `cohort`, so runs of different cohorts never share state."""
+    key = hashlib.sha256(json.dumps(cohort, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return os.path.join(state_dir, f"cohort-{key}")
+
+def _load_state(state_dir):
+    """
+    Loads the high-water marks and running aggregates of a previous incremental run.
+    Returns empty marks and no aggregates if there was no previous run.
+    """
+    watermarks_file = os.path.join(state_dir, "watermarks.json")
+    if not os.path.exists(watermarks_file):
+        empty_mark = {'id': 0, 'timestamp': None}
+        return {'test_responses': dict(empty_mark), 'questionnaire_responses': dict(empty_mark)}, {}
+
+    with open(watermarks_file) as f:
+        watermarks = json.load(f)
+    aggregates = {table: pd.read_pickle(os.path.join(state_dir, f"{table}_aggregated.pkl")) for table in watermarks}
+    return watermarks, aggregates
+
+def _save_state(state_dir, watermarks, aggregates, cohort):
+    """Saves high-water marks and running aggregates of `cohort`. The marks are written last, so an interrupted save is ignored."""
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, "cohort.json"), "w") as f:
+        json.dump(cohort, f, indent=2, sort_keys=True, default=str)
+    for table, aggregated in aggregates.items():
+        aggregated.to_pickle(os.path.join(state_dir, f"{table}_aggregated.pkl"))
+    with open(os.path.join(state_dir, "watermarks.json"), "w") as f:
+        json.dump(watermarks, f, indent=2)
+
+def wrangle_data(chunksize=None, data_format='csv', incremental=False, state_dir=STATE_DIR, db_url=None, cohort=None):
+    """
+    Wrangles the raw exports in data/init/ (or the platform database) into one row per answer and saves them to data/.
+
+    Args:
+        chunksize: If given, the response exports are streamed in chunks of at most
+            this many rows and folded into partial aggregates, instead of being
+            loaded fully into memory.
+        data_format: Format of the wrangled outputs, 'csv' or 'parquet'.
+        incremental: If True, only response rows with a serial id above the last
+            run's high-water mark are aggregated and merged into the running
+            aggregates kept in `state_dir`, per cohort. The first run of a cohort
+            processes everything.
+        db_url: If given, the participants, test_responses and questionnaire_responses
+            tables are read from this database (see database.py) instead of the CSV dumps.
+        cohort: Participants and tests to include (see cohort.py), DEFAULT_COHORT if None.
+            Applied while reading, so rows outside the cohort are dropped before aggregation.
+    """
+    cohort = cohort or DEFAULT_COHORT
+
+    # Keep only the participants in the cohort (by default controlled sessions from Friday 2025-04-25)
+    if db_url is None:
+        df_participants = pd.read_csv("data/init/participants.csv")
+        df_participants_valid = df_participants[participant_mask(df_participants, cohort)].copy()
+    else:
+        participant_condition, participant_params = participant_sql(cohort)
+        df_participants_valid = database.read_table(db_url, 'participants', where=participant_condition, params=participant_params)
 
     # Rename the `id` column to `participant_id` in both dataframes before merging
     df_participants_valid = df_participants_valid.rename(columns={'id': 'participant_id'})
+    valid_participant_ids = set(df_participants_valid['participant_id'])
 
-    # Aggregate df_test_responses, INCLUDING content_length and content_source
+    # Aggregate the response exports, INCLUDING content_length and content_source
     # We'll take the first value for content_length and content_source within each group
-    aggregated_test_responses = df_test_responses.groupby(['test_slug', 'question_id', 'participant_id']).agg(
-        id=('id', lambda x: '-'.join(x.astype(str))),
-        response_value=('response_value', lambda x: list(x) if len(x) > 1 else x.iloc[0]),
-        length=('content_length', 'first'), # Include content_length
-        source=('content_source', 'first'),   # Include content_source
-        reaction_time=('reaction_time_ms', 'first'),
-    ).reset_index()
-
-    aggregated_questionnaire_responses = df_questionnaire_responses.groupby(['questionnaire_type', 'question_id', 'participant_id']).agg(
-        id=('id', lambda x: '-'.join(x.astype(str))),
-        response_value=('response_value', lambda x: int(x)),
-    ).reset_index()
+    if incremental:
+        # Running aggregates and marks are kept per cohort (see _cohort_state_dir). The cohort filters
+        # fixed attributes of participants and tests, so rows left out of a run never become valid later
+        state_dir = _cohort_state_dir(state_dir, cohort)
+        watermarks, previous = _load_state(state_dir)
+        # The highest rows seen, the new marks once all chunks are aggregated
+        latest = {table: dict(mark) for table, mark in watermarks.items()}
+        test_chunks = _response_chunks('test_responses', chunksize, db_url, watermarks['test_responses'], cohort)
+        questionnaire_chunks = _response_chunks('questionnaire_responses', chunksize, db_url, watermarks['questionnaire_responses'], cohort)
+        aggregated_test_responses = aggregate_test_responses(
+            _rows_after_watermark(test_chunks, watermarks['test_responses'], latest['test_responses']),
+            valid_participant_ids, previous=previous.get('test_responses'), cohort=cohort)
+        aggregated_questionnaire_responses = aggregate_questionnaire_responses(
+            _rows_after_watermark(questionnaire_chunks, watermarks['questionnaire_responses'], latest['questionnaire_responses']),
+            valid_participant_ids, previous=previous.get('questionnaire_responses'))
+        _save_state(state_dir, latest, {'test_responses': aggregated_test_responses,
+                                        'questionnaire_responses': aggregated_questionnaire_responses}, cohort)
+    else:
+        test_chunks = _response_chunks('test_responses', chunksize, db_url, cohort=cohort)
+        questionnaire_chunks = _response_chunks('questionnaire_responses', chunksize, db_url, cohort=cohort)
+        aggregated_test_responses = aggregate_test_responses(test_chunks, valid_participant_ids, cohort=cohort)
+        aggregated_questionnaire_responses = aggregate_questionnaire_responses(questionnaire_chunks, valid_participant_ids)
 
     # Create a new column with just the dependent variable
-    aggregated_test_responses['question'] = aggregated_test_responses['question_id'].str.rsplit('_', 1).str[-1]
-    aggregated_questionnaire_responses['question'] = aggregated_questionnaire_responses['question_id'].str.split('_', 1).str[1]
+    aggregated_test_responses['question'] = aggregated_test_responses['question_id'].str.rsplit('_', n=1).str[-1]
+    aggregated_questionnaire_responses['question'] = aggregated_questionnaire_responses['question_id'].str.split('_', n=1).str[1]
 
-    # Merge the aggregated data with the participant data for Thursday and Friday
+    # Merge the aggregated data with the participant data of the cohort
     # Using the aggregated_responses which has unique participant_id
+    aggregated_test_responses = aggregated_test_responses[test_slug_mask(aggregated_test_responses, cohort)]
     test_data = aggregated_test_responses.merge(df_participants_valid, on='participant_id', how='inner')
     questionnaire_data = aggregated_questionnaire_responses.merge(df_participants_valid, on='participant_id', how='inner')
 
-    # Filter out rows where test_slug is "practice"
-    test_data = test_data[test_data['test_slug'] != "practice"].copy()
-
     # Drop unnecessary columns
     test_columns_to_drop = ['question_id', 'created_at', 'date', 'is_pilot', 'is_controlled', 'assigned_source_order', 'assigned_length']
     test_data = test_data.drop(columns=test_columns_to_drop, errors='ignore')
@@ -57,10 +282,10 @@ def wrangle_data():
     questionnaire_columns_to_drop = ['question_id',  'created_at', 'date', 'is_pilot', 'is_controlled', 'is_mobile', 'age', 'assigned_source_order', 'assigned_length']
     questionnaire_data = questionnaire_data.drop(columns=questionnaire_columns_to_drop, errors='ignore')
 
-    # Save the dataframes to CSV files
-    test_data.to_csv("data/test_data_wrangled.csv", index=False)
-    questionnaire_data.to_csv("data/questionnaire_data_wrangled.csv", index=False)
+    # Save the dataframes for the evaluation step
+    write_table(test_data, intermediate_path("test_data_wrangled", data_format))
+    write_table(questionnaire_data, intermediate_path("questionnaire_data_wrangled", data_format))
 
 # This block allows the script to be run directly
 if __name__ == "__main__":
-    wrangle_data()
\ No newline at end of file
+    wrangle_data()